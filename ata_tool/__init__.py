@@ -0,0 +1,22 @@
+# ATA pass-through ツール群。import しただけではデバイスを開かず、numpy や ctypes の構造体も読み込まない。
+# よく使う名前はパッケージから直接引けるが、実体のモジュールは最初に触れたときに import する
+_EXPORTS = {
+    'ATA_COMMAND': 'ata_command',
+    'xfer_protocol': 'ata_command',
+    'bsg_with_ata_command_executor': 'async_bsg_executer',
+    'ata_completion': 'async_bsg_executer',
+    'asyncio_ata_executor': 'asyncio_ata_executer',
+    'multi_process_ata_executor': 'multi_process_executer',
+    'device_capabilities': 'device_probe',
+    'probe_device': 'device_probe',
+}
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from importlib import import_module
+    value = getattr(import_module(f'.{module}', __name__), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,108 @@
+import time
+
+_START_NS = time.perf_counter_ns()  # 起動から最初の ioctl までの基準 (これより前はインタプリタ自体の起動)
+
+import sys
+
+# サブコマンド → (モジュール, 説明)。選ばれたモジュールだけを import し、その main(argv) に残りの引数を渡す
+COMMANDS = {
+    'bench': ('ata_bench', "fio-style workload benchmark"),
+    'image': ('ata_imaging', "stream an LBA range of a drive to a file in order"),
+    'verify': ('pattern_verify', "write LBA-stamped/PRBS patterns and verify them on read-back"),
+    'trim': ('ata_trim', "deallocate LBA ranges with DATA SET MANAGEMENT (TRIM)"),
+    'trace': ('trace_replay', "inspect and replay ATA command traces"),
+    'daemon': ('ata_daemon', "keep ATA executors open and serve command batches over a Unix socket"),
+}
+# executor を立ち上げずに transport でコマンドを 1 つだけ同期実行するもの (numpy もスレッドも使わない)
+ONE_SHOT = {
+    'identify': "print IDENTIFY DEVICE",
+    'read': "read sectors with a single READ DMA EXT",
+}
+
+def usage():
+    lines = ["usage: python -m ata_tool <command> [args...]", "", "commands:"]
+    for name, description in {**ONE_SHOT, **{name: entry[1] for name, entry in COMMANDS.items()}}.items():
+        lines.append(f"  {name:<9} {description}")
+    lines.append("")
+    lines.append("run 'python -m ata_tool <command> -h' for the options of each command")
+    return '\n'.join(lines)
+
+def open_transport(dev_path, transport):
+    from .ata_transport import bsg_transport, null_transport, sg_v3_transport
+    if transport == 'bsg':
+        return bsg_transport(dev_path)
+    if transport == 'sg':
+        return sg_v3_transport(dev_path, 1)
+    if transport == 'null':
+        return null_transport(dev_path)
+    from .simulated_ata_device import simulated_transport
+    return simulated_transport(queued=False)
+
+def build_one_shot_parser(name):
+    import argparse
+    parser = argparse.ArgumentParser(prog=f"ata_tool {name}", description=ONE_SHOT[name])
+    parser.add_argument('device', help="device node (/dev/bsg/H:C:T:L, /dev/sgN)")
+    parser.add_argument('--transport', default='bsg', choices=('bsg', 'sg', 'null', 'sim'))
+    parser.add_argument('--timeout-ms', type=int, default=5000)
+    parser.add_argument('--timing', action='store_true',
+                        help="print the time from startup to the completion of the first ioctl to stderr")
+    if name == 'identify':
+        parser.add_argument('--raw', action='store_true', help="dump the 512-byte IDENTIFY data instead of parsing it")
+    else:
+        parser.add_argument('--lba', type=lambda text: int(text, 0), default=0)
+        parser.add_argument('--count', type=int, default=1, help="sectors to read (1-65535)")
+        parser.add_argument('--sector-size', type=int, default=512)
+        parser.add_argument('--output', default=None, help="write the data to this file instead of dumping it")
+    return parser
+
+def one_shot(name, argv):
+    args = build_one_shot_parser(name).parse_args(argv)
+    if name == 'read' and not 1 <= args.count <= 0xFFFF:
+        raise SystemExit(f"--count must be 1-65535, got {args.count}")
+    from .device_probe import identify, parse_identify, read_sectors, sysfs_info
+    imported_ns = time.perf_counter_ns()
+    transport = open_transport(args.device, args.transport)
+    opened_ns = time.perf_counter_ns()
+    try:
+        if name == 'identify':
+            data = identify(transport, args.timeout_ms)
+        else:
+            data = read_sectors(transport, args.lba, args.count, args.sector_size, args.timeout_ms)
+        done_ns = time.perf_counter_ns()
+    finally:
+        transport.close()
+
+    if name == 'identify' and not args.raw:
+        from dataclasses import asdict
+        capabilities = parse_identify(data, sysfs_info(args.device)[2])
+        for key, value in asdict(capabilities).items():
+            print(f"{key:>20}: {value}")
+    elif name == 'read' and args.output:
+        with open(args.output, 'wb') as f:
+            f.write(data)
+    else:
+        from .hex_dump import print_dwords_4_with_ascii
+        print_dwords_4_with_ascii(data)
+    if args.timing:
+        print(f"startup to first ioctl: {(done_ns - _START_NS) / 1e6:.3f} ms "
+              f"(import {(imported_ns - _START_NS) / 1e6:.3f} ms, open {(opened_ns - imported_ns) / 1e6:.3f} ms, "
+              f"command {(done_ns - opened_ns) / 1e6:.3f} ms)", file=sys.stderr)
+    return 0
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage(), file=sys.stdout if argv else sys.stderr)
+        return 0 if argv else 2
+    name, rest = argv[0], argv[1:]
+    if name in ONE_SHOT:
+        return one_shot(name, rest)
+    if name not in COMMANDS:
+        print(f"unknown command: {name}\n\n{usage()}", file=sys.stderr)
+        return 2
+    from importlib import import_module
+    sys.argv[0] = f"ata_tool {name}"  # サブコマンド側の argparse の usage に出る名前
+    return import_module(f'.{COMMANDS[name][0]}', __package__).main(rest)
+
+if __name__ == "__main__":
+    sys.exit(main())
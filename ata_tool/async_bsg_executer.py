@@ -0,0 +1,600 @@
+import ctypes
+import errno
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future, wait
+
+from dataclasses import dataclass, field
+from .ata_buffer_pool import ata_buffer_pool
+from .ata_command import ATA_COMMAND, xfer_protocol
+from .latency_histogram import latency_tracker
+from .ata_pass_through import pack_ata_command_into
+from .ncq_tag_allocator import NCQ_MAX_DEPTH, ncq_tag_allocator, encode_ncq_tag, decode_ncq_tag
+from .ata_transport import io_request, build_iovec, bsg_transport, sg_v3_transport, null_transport
+from .command_trace import trace_writer
+from .device_probe import DEFAULT_CACHE_DIR, probe_device
+from .stage_profiler import stage_profiler
+from .command_watchdog import command_watchdog
+
+@dataclass
+class ata_completion:
+    command: ATA_COMMAND
+    driver_status: int = 0
+    transport_status: int = 0
+    device_status: int = 0
+    sense: bytes = b''
+    tag: int = None
+    submit_ns: int = 0  # submit_command() が呼ばれた時刻 (perf_counter_ns)
+    issue_ns: int = 0  # カーネルへ発行した時刻
+    complete_ns: int = 0  # 完了を受け取った時刻
+    duration: int = 0  # カーネルが報告した処理時間 (ms)
+    resid: int = 0  # 転送されなかったバイト数
+    data: memoryview = None
+    release_slot: object = field(default=None, repr=False, compare=False)
+
+    def is_good(self):
+        return self.driver_status == 0 and self.transport_status == 0 and self.device_status == 0
+
+    def release(self):
+        # zero-copy で受け取ったバッファをプールに返す。以降 data は参照できない
+        if self.release_slot is not None:
+            if self.data is not None:
+                self.data.release()
+            self.release_slot()
+            self.release_slot = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+class bsg_with_ata_command_executor:
+    def __init__(self, dev_path, queue_depth=None, transport='bsg', reaper=True,
+                 buffer_slots=None, max_pooled_transfer=None, zero_copy=False, ncq_depth=None,
+                 record_latency=True, ncq_tags=None, trace=None, scheduler=None,
+                 probe=False, probe_cache=DEFAULT_CACHE_DIR, timeout_ms=5000, completion_log=None,
+                 profile=False, watchdog=None):
+        self.dev_path = dev_path
+        self.timeout_ms = timeout_ms
+        if transport == 'bsg':
+            self.transport = bsg_transport(dev_path)
+        elif transport == 'sg':
+            self.transport = sg_v3_transport(dev_path, queue_depth or NCQ_MAX_DEPTH)
+        elif transport == 'null':
+            self.transport = null_transport(dev_path)
+        elif transport == 'sim':
+            from .simulated_ata_device import simulated_transport  # テスト用なので使うときだけ読み込む
+            self.transport = simulated_transport()
+        elif isinstance(transport, str):
+            raise ValueError(f"Unsupported transport: {transport}")
+        else:
+            # transport オブジェクトをそのまま差し込む (ata_transport.py 参照)
+            self.transport = transport
+        # iovec を受け付けない transport では transfer_buffers を連続バッファ経由で転送する
+        self.iovec = getattr(self.transport, 'iovec', False)
+        # probe=True なら IDENTIFY DEVICE の結果から、明示されていない深さ/転送長を決める (device_probe.py)
+        self.capabilities = None
+        if probe:
+            try:
+                self.capabilities = probe_device(self.transport, dev_path, probe_cache, timeout_ms=timeout_ms)
+            except BaseException:
+                self.transport.close()
+                self.transport = None
+                raise
+            defaults = self.capabilities.executor_defaults()
+            queue_depth = queue_depth or defaults['queue_depth']
+            ncq_depth = ncq_depth or min(defaults['ncq_depth'], queue_depth)
+            max_pooled_transfer = max_pooled_transfer or defaults['max_pooled_transfer']
+        queue_depth = queue_depth or 32
+        self.queue_depth = queue_depth
+        # FPDMA コマンドの同時発行数はデバイスの NCQ 深さで頭打ちにする
+        self.tag_allocator = ncq_tag_allocator(ncq_depth or min(queue_depth, NCQ_MAX_DEPTH), ncq_tags)
+        # タグごとに CDB/センス/データ領域を事前確保して使い回す
+        self.buffer_pool = ata_buffer_pool(buffer_slots or queue_depth, max_pooled_transfer or 128 * 1024)
+        self.zero_copy = zero_copy
+        self.latency = latency_tracker() if record_latency else None
+        # trace にパスを渡すと、完了した全コマンドをバイナリトレースに記録する (command_trace.py)
+        # trace_writer オブジェクトを渡した場合は複数の executor で共有できるよう close() しない
+        self.own_trace = isinstance(trace, str)
+        self.trace = trace_writer(trace) if self.own_trace else trace
+        # completion_log=True で全完了のステータス/センスを列形式で残す (completion_log.py)
+        self.completion_log = completion_log
+        if completion_log is True:
+            from .completion_log import completion_log as completion_log_cls  # numpy は記録するときだけ読み込む
+            self.completion_log = completion_log_cls()
+        # profile=True で段ごとの所要時間を数える (stage_profiler.py)。None のときは計測しない
+        self.profiler = stage_profiler() if profile is True else profile or None
+        self.command_queue = queue.SimpleQueue()
+        # NCQ を使わない読み書きを並べ替え/結合する段 (lba_scheduler.elevator_scheduler など)
+        self.scheduler = scheduler
+        if scheduler is not None:
+            scheduler.attach(self)
+        self.outstanding = set()
+        self.outstanding_lock = threading.Lock()
+        # 発行中コマンドの期限を見張る (command_watchdog.py)。期限切れで失敗させたコマンドのタグは held_tags に残す
+        self.watchdog = command_watchdog() if watchdog is True else watchdog
+        self.held_tags = set()
+        self.spare_workers = 0  # 止まったワーカーの代わりに足した数。止まっていた側が戻ったら抜けて元の数に戻す
+        self.running = True
+        if self.transport.queued:
+            # 発行は呼び出し元スレッドで write()、完了は刈り取りスレッド 1 本で read() する
+            self.io_thread = [threading.Thread(target=self._reaper, daemon=True)] if reaper else []
+        else:
+            # NCQ深さ分のワーカーだけを起動し、コマンドはキュー経由で渡す
+            self.io_thread = [threading.Thread(target=self._worker, daemon=True) for _ in range(queue_depth)]
+        for io in self.io_thread:
+            io.start()
+        if self.watchdog is not None:
+            self.watchdog.attach(self)
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.running = False
+        if getattr(self, 'watchdog', None) is not None:
+            self.watchdog.close()
+        if getattr(self, 'io_thread', None):
+            with self.outstanding_lock:
+                io_thread = list(self.io_thread)
+            if not self.transport.queued:
+                for _ in io_thread:
+                    self.command_queue.put(None)
+            for io in io_thread:
+                io.join()
+            self.io_thread = []
+        if getattr(self, 'transport', None):
+            self.transport.close()
+            self.transport = None
+        if getattr(self, 'trace', None) is not None:
+            if self.own_trace:
+                self.trace.close()
+            else:
+                self.trace.flush()
+            self.trace = None
+
+    def _worker(self):
+        while True:
+            item = self.command_queue.get()
+            if item is None:
+                return
+            command, future, submit_ns = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            request = None
+            profiler = self.profiler
+            if profiler is not None:
+                mark = profiler.add('queue', submit_ns)
+            try:
+                request = self._build_request(command)
+                request.submit_ns = submit_ns
+                request.future = future
+                if profiler is not None:
+                    mark = profiler.add('build', mark)
+                if self.watchdog is not None:
+                    self.watchdog.track(request)
+                try:
+                    self.transport.execute(request)
+                except BaseException:
+                    if self._finish_late(request):
+                        if self._retire_worker():
+                            return
+                        continue
+                    self._discard(request)
+                    raise
+                if profiler is not None:
+                    mark = profiler.add('transport', mark)
+                completion = self._complete(request)
+                if completion is None:
+                    if self._retire_worker():
+                        return
+                    continue
+                if profiler is not None:
+                    mark = profiler.add('complete', mark)
+            except BaseException as e:
+                self._trace_failure(command, submit_ns, request)
+                future.set_exception(e)
+            else:
+                future.set_result(completion)
+            if profiler is not None:
+                profiler.add('resolve', mark)
+
+    def _reaper(self):
+        while self.running:
+            try:
+                self.process_completions(timeout=100)
+            except Exception as e:
+                # 刈り取りが止まると以降の Future がすべて返らなくなるので、報告して続ける
+                print(f"bsg_with_ata_command_executor: reaping completions failed: {e!r}", file=sys.stderr)
+
+    def process_completions(self, fd=None, timeout=0):
+        # sg transport の完了を刈り取って Future を解決する。fd 指定時はその fd だけを読む
+        if fd is None:
+            requests = self.transport.reap(timeout)
+        else:
+            requests = self.transport.reap_fd(fd)
+        profiler = self.profiler
+        for request in requests:
+            if request.error is not None:
+                # transport が発行できなかったコマンド
+                if not self._finish_late(request):
+                    self._discard(request)
+                    self._trace_failure(request.command, request.submit_ns, request)
+                    request.future.set_exception(request.error)
+                continue
+            if profiler is not None:
+                mark = time.perf_counter_ns()
+            try:
+                completion = self._complete(request)
+                if completion is None:
+                    continue
+                if profiler is not None:
+                    mark = profiler.add('complete', mark)
+            except BaseException as e:
+                self._trace_failure(request.command, request.submit_ns, request)
+                request.future.set_exception(e)
+            else:
+                request.future.set_result(completion)
+            if profiler is not None:
+                profiler.add('resolve', mark)
+        return len(requests)
+
+    def _retire(self, future):
+        with self.outstanding_lock:
+            self.outstanding.discard(future)
+
+    def _needs_slot(self, command: ATA_COMMAND):
+        # プールのスロットを使う (= 空きを待つことがある) コマンドか
+        return command.transfer_buffers is not None or self.buffer_pool.fits(command.transfer_length)
+
+    def _build_request(self, command: ATA_COMMAND, slot=None):
+        # slot を渡さなければプールから取る (空きがなければ待つ。待ってよいのはワーカースレッドだけ)
+        is_read = command.protocol.is_read_xfer()
+        transfer_length = command.transfer_length
+        if command.transfer_buffers is not None:
+            if self.iovec:
+                return self._build_iovec_request(command, is_read, slot)
+            return self._build_bounce_request(command, is_read, slot)
+        if not self.buffer_pool.fits(transfer_length):
+            # プールのスロットに収まらない転送だけは従来どおり個別に確保する
+            cdb_buf = (ctypes.c_ubyte * 32)()
+            pack_ata_command_into(cdb_buf, 0, command)
+            sense_buf = (ctypes.c_ubyte * 32)()
+            if is_read:
+                data_buf = (ctypes.c_ubyte * transfer_length)()
+            else:
+                data_buf = (ctypes.c_ubyte * transfer_length).from_buffer_copy(command.transfer_data)
+            return io_request(command, cdb_buf, sense_buf, data_buf, transfer_length, is_read, command.timeout_ms or self.timeout_ms)
+
+        if slot is None:
+            slot = self.buffer_pool.acquire()
+        try:
+            pack_ata_command_into(slot.cdb, 0, command)
+            if transfer_length and not is_read:
+                slot.view[:transfer_length] = command.transfer_data
+        except BaseException:
+            self.buffer_pool.release(slot)
+            raise
+        request = io_request(command, slot.cdb, slot.sense, slot.data, transfer_length, is_read, command.timeout_ms or self.timeout_ms)
+        request.slot = slot
+        return request
+
+    def _build_iovec_request(self, command: ATA_COMMAND, is_read, slot=None):
+        # 呼び出し元のバッファ (bytearray, mmap のスライスなど) へ直接転送する。スロットは CDB/sense だけに使う
+        try:
+            iovec, pins, total = build_iovec(command.transfer_buffers, writable=is_read)
+            if command.transfer_length and command.transfer_length != total:
+                raise ValueError(f"transfer_length {command.transfer_length} does not match transfer_buffers total {total}")
+        except BaseException:
+            if slot is not None:
+                self.buffer_pool.release(slot)
+            raise
+        command.transfer_length = total
+        if slot is None:
+            slot = self.buffer_pool.acquire()
+        try:
+            pack_ata_command_into(slot.cdb, 0, command)
+        except BaseException:
+            self.buffer_pool.release(slot)
+            raise
+        request = io_request(command, slot.cdb, slot.sense, None, total, is_read, command.timeout_ms or self.timeout_ms)
+        request.slot = slot
+        request.iovec = iovec
+        request.buffers = pins
+        return request
+
+    def _build_bounce_request(self, command: ATA_COMMAND, is_read, slot=None):
+        # transfer_buffers をスロットのデータ領域 (収まらなければ個別の領域) にまとめて転送する。
+        # 書き込みは発行前にまとめ、読み込みは完了時に _complete() で各バッファへ分配する
+        try:
+            views = [memoryview(buffer).cast('B') for buffer in command.transfer_buffers]
+            for index, view in enumerate(views):
+                if is_read and view.readonly:
+                    raise ValueError(f"transfer buffer {index} is read-only")
+            total = sum(len(view) for view in views)
+            if command.transfer_length and command.transfer_length != total:
+                raise ValueError(f"transfer_length {command.transfer_length} does not match transfer_buffers total {total}")
+        except BaseException:
+            if slot is not None:
+                self.buffer_pool.release(slot)
+            raise
+        command.transfer_length = total
+        if slot is None:
+            slot = self.buffer_pool.acquire()
+        try:
+            pack_ata_command_into(slot.cdb, 0, command)
+            data = slot.data if self.buffer_pool.fits(total) else (ctypes.c_ubyte * total)()
+            if not is_read:
+                target = memoryview(data).cast('B')
+                offset = 0
+                for view in views:
+                    target[offset:offset + len(view)] = view
+                    offset += len(view)
+        except BaseException:
+            self.buffer_pool.release(slot)
+            raise
+        request = io_request(command, slot.cdb, slot.sense, data, total, is_read, command.timeout_ms or self.timeout_ms)
+        request.slot = slot
+        request.buffers = views
+        return request
+
+    def _finish_late(self, request: io_request):
+        # watchdog が既に失敗させていたコマンドが返ってきたら、ここでバッファと NCQ タグを解放して True を返す
+        if self.watchdog is None or not self.watchdog.finish(request):
+            return False
+        request.buffers = None
+        self._discard(request)
+        command = request.command
+        if command.protocol.get_protocol() == xfer_protocol.fpdma:
+            tag = decode_ncq_tag(command.count)
+            with self.outstanding_lock:
+                self.held_tags.discard(tag)
+            self._release_tag(tag)
+        return True
+
+    def _expire(self, request: io_request, tag, error):
+        # watchdog から呼ばれる。タグは実際に完了が返るまで確保したままにする
+        if tag is not None:
+            with self.outstanding_lock:
+                self.held_tags.add(tag)
+        if not self.transport.queued and self.running:
+            # 止まったワーカーの代わりを立てて、残りのコマンドを流し続ける
+            worker = threading.Thread(target=self._worker, daemon=True)
+            with self.outstanding_lock:
+                self.spare_workers += 1
+                self.io_thread.append(worker)
+            worker.start()
+        self._trace_failure(request.command, request.submit_ns, request)
+        request.future.set_exception(error)
+
+    def _retire_worker(self):
+        # 期限切れにされたコマンドが戻ってきたワーカーから呼ぶ。代わりを足していればこのワーカーが抜ける
+        with self.outstanding_lock:
+            if not self.spare_workers:
+                return False
+            self.spare_workers -= 1
+            self.io_thread.remove(threading.current_thread())
+        return True
+
+    def reset_device(self):
+        # transport が対応していればデバイス (LUN) をリセットする。発行中のコマンドはエラーで返ってくる
+        reset = getattr(self.transport, 'reset', None)
+        if reset is None:
+            raise OSError(errno.EOPNOTSUPP, f"{self.transport.name} transport cannot reset the device")
+        reset()
+
+    def _trace_failure(self, command: ATA_COMMAND, submit_ns, request: io_request = None):
+        # 完了ステータスを受け取らずに失敗させたコマンド (発行失敗・期限切れ) もトレースに残す
+        if self.trace is None:
+            return
+        completion = ata_completion(command=command, submit_ns=submit_ns, complete_ns=time.perf_counter_ns(),
+                                    issue_ns=request.issue_ns if request is not None else 0)
+        if command.protocol.get_protocol() == xfer_protocol.fpdma:
+            completion.tag = decode_ncq_tag(command.count)
+        self.trace.record(completion, failed=True)
+
+    def _discard(self, request: io_request):
+        if request.slot is not None:
+            self.buffer_pool.release(request.slot)
+            request.slot = None
+
+    def _complete(self, request: io_request):
+        # watchdog が失敗させた後で返ってきたコマンドは None (Future は解決済み)
+        if self._finish_late(request):
+            return None
+        command = request.command
+        slot = request.slot
+        completion = ata_completion(
+            command=command,
+            driver_status=request.driver_status,
+            transport_status=request.transport_status,
+            device_status=request.device_status,
+            sense=bytes(request.sense),
+            submit_ns=request.submit_ns,
+            issue_ns=request.issue_ns,
+            complete_ns=request.complete_ns,
+            duration=request.duration,
+            resid=request.resid,
+        )
+        if self.latency is not None:
+            self.latency.record(command.command, request.complete_ns - request.submit_ns,
+                                request.complete_ns - request.issue_ns)
+        if command.protocol.get_protocol() == xfer_protocol.fpdma:
+            completion.tag = decode_ncq_tag(command.count)
+        if self.trace is not None:
+            self.trace.record(completion)
+        if self.completion_log is not None:
+            self.completion_log.record(request, completion.tag)
+        if request.iovec is not None:
+            # データは既に呼び出し元のバッファに入っている
+            request.buffers = None
+            self.buffer_pool.release(slot)
+            return completion
+        if request.buffers is not None:
+            if request.is_read:
+                # 転送できた分 (resid を除く) だけを呼び出し元のバッファへ分配する
+                source = memoryview(request.data).cast('B')[:request.data_len - min(max(request.resid, 0), request.data_len)]
+                for view in request.buffers:
+                    chunk = source[:len(view)]
+                    view[:len(chunk)] = chunk
+                    source = source[len(chunk):]
+            request.buffers = None
+            self.buffer_pool.release(slot)
+            return completion
+        if slot is None:
+            if request.is_read and request.data_len:
+                command.transfer_data = bytes(request.data)
+            return completion
+        if request.is_read and request.data_len:
+            if self.zero_copy:
+                # スロットをそのまま渡し、completion.release() で返してもらう
+                completion.data = slot.view[:request.data_len]
+                completion.release_slot = lambda: self.buffer_pool.release(slot)
+                command.transfer_data = completion.data
+                return completion
+            command.transfer_data = bytes(slot.view[:request.data_len])
+        self.buffer_pool.release(slot)
+        return completion
+
+    def submit_command(self, command: ATA_COMMAND) -> Future:
+        submit_ns = time.perf_counter_ns()
+        future = Future()
+        with self.outstanding_lock:
+            self.outstanding.add(future)
+        future.add_done_callback(self._retire)
+        if command.protocol.get_protocol() == xfer_protocol.fpdma:
+            # NCQ タグは executor が割り当てる。空きがなければタグが返るまで待たせる
+            tag = self.tag_allocator.acquire((command, future, submit_ns))
+            if tag is not None:
+                self._dispatch_tagged(tag, command, future, submit_ns)
+        elif self.scheduler is not None and self.scheduler.accepts(command):
+            self.scheduler.add(command, future, submit_ns)
+        else:
+            self._dispatch(command, future, submit_ns)
+        return future
+
+    def submit_batch(self, batch, data=None):
+        # command_batch をまとめて投入する。data は batch.data_offsets() の並びの転送アリーナ
+        # (iovec を使えない transport ではコマンドごとにスロットへコピーして転送する)
+        return [self.submit_command(command) for command in batch.commands(data)]
+
+    def _dispatch_tagged(self, tag, command: ATA_COMMAND, future: Future, submit_ns):
+        command.count = encode_ncq_tag(command.count, tag)
+        future.add_done_callback(lambda f: self._release_tag(tag))
+        self._dispatch(command, future, submit_ns)
+
+    def _release_tag(self, tag):
+        with self.outstanding_lock:
+            if tag in self.held_tags:
+                return  # watchdog が失敗させたコマンドがまだデバイスに残っている
+        handoff = self.tag_allocator.release(tag)
+        if handoff is not None:
+            tag, (command, future, submit_ns) = handoff
+            self._dispatch_tagged(tag, command, future, submit_ns)
+
+    def _dispatch(self, command: ATA_COMMAND, future: Future, submit_ns):
+        if not self.transport.queued:
+            self.command_queue.put((command, future, submit_ns))
+            return
+        if not future.set_running_or_notify_cancel():
+            return
+        slot = None
+        if self._needs_slot(command):
+            # 発行は呼び出し元 (asyncio ならイベントループ) のスレッドで行うので、スロット待ちで止めない。
+            # 空きがなければ、スロットが返ってきたところで解放したスレッドから _submit() する
+            slot = self.buffer_pool.acquire_nowait(lambda slot: self._submit(command, future, submit_ns, slot))
+            if slot is None:
+                return
+        self._submit(command, future, submit_ns, slot)
+
+    def _submit(self, command: ATA_COMMAND, future: Future, submit_ns, slot):
+        profiler = self.profiler
+        if profiler is not None:
+            mark = profiler.add('queue', submit_ns)
+        request = None
+        try:
+            request = self._build_request(command, slot)
+            request.submit_ns = submit_ns
+            request.future = future
+            if profiler is not None:
+                mark = profiler.add('build', mark)
+            if self.watchdog is not None:
+                self.watchdog.track(request)
+            self.transport.submit(request)
+            if profiler is not None:
+                profiler.add('transport', mark)
+        except BaseException as e:
+            if request is not None:
+                if self._finish_late(request):
+                    return
+                self._discard(request)
+            self._trace_failure(command, submit_ns, request)
+            future.set_exception(e)
+
+    def drain_command(self, timeout=None):
+        # 投入済みの全コマンドが完了するまで待つ。timeout 秒を過ぎたら TimeoutError
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            with self.outstanding_lock:
+                pending = list(self.outstanding)
+            if not pending:
+                return
+            remaining = None if deadline is None else max(deadline - time.perf_counter(), 0)
+            not_done = wait(pending, remaining).not_done
+            if not_done:
+                raise TimeoutError(f"{len(not_done)} commands still outstanding after {timeout} s")
+
+if __name__ == "__main__":
+    import random
+    import sys
+    import time
+    from .hex_dump import print_dwords_4_with_ascii
+    # Example usage
+    dev_path = sys.argv[1] if len(sys.argv) > 1 else "/dev/bsg/1:0:0:0"  # Adjust the path as needed
+    executer = bsg_with_ata_command_executor(dev_path)
+
+    commands = [ATA_COMMAND(
+        feature=0x8,
+        lba=0x1,
+        icc=0,
+        auxiliary=0,
+        device=0x40,
+        command=0x60,
+        protocol=xfer_protocol.read_fpdma,
+        transfer_length=4096
+    ) for _ in range(32)]  # これで全部独立なオブジェクト
+    for i in range(len(commands)):
+        commands[i].lba = random.randint(0, 0x00FF_FFFF) * 8 # Aligned LBAから適当に選ぶ
+        executer.submit_command(commands[i])
+    executer.drain_command()
+    executer.close()
+    print_dwords_4_with_ascii(commands[30].transfer_data[:512])  # Print first 512 bytes of transfer data
+
+    if len(sys.argv) > 2:
+        # 同じドライブの bsg ノードと sg ノードで 4 KiB ランダムリードのスループットを比較する
+        io_count = 20000
+        for transport, path in (('bsg', dev_path), ('sg', sys.argv[2])):
+            with bsg_with_ata_command_executor(path, transport=transport) as executer:
+                start = time.perf_counter()
+                for i in range(io_count):
+                    executer.submit_command(ATA_COMMAND(
+                        feature=0x8,
+                        lba=random.randint(0, 0x00FF_FFFF) * 8,
+                        device=0x40,
+                        command=0x60,
+                        protocol=xfer_protocol.read_fpdma,
+                        transfer_length=4096,
+                    ))
+                executer.drain_command()
+                elapsed = time.perf_counter() - start
+            print(f"{transport:>3} ({path}): {io_count / elapsed:10.0f} IOPS {io_count * 4096 / elapsed / 1e6:8.1f} MB/s")
+            print(executer.latency.report())
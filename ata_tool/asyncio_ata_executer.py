@@ -0,0 +1,142 @@
+import asyncio
+import collections
+import os
+
+from .async_bsg_executer import bsg_with_ata_command_executor, ata_completion
+from .ata_command import ATA_COMMAND
+
+class asyncio_ata_executor:
+    # bsg の SG_IO は O_NONBLOCK でも同期 ioctl なので、発行は固定数のワーカーに任せ、
+    # 完了通知は eventfd 経由でイベントループに返す (コマンドごとのスレッドは作らない)
+    # sg transport では sg の fd 自体の読み込み可能通知で完了を刈り取る
+    def __init__(self, dev_path, queue_depth=None, transport='bsg', probe=False):
+        self.dev_path = dev_path
+        self.executor = bsg_with_ata_command_executor(dev_path, queue_depth, transport=transport, reaper=False,
+                                                      probe=probe)
+        self.queue_depth = self.executor.queue_depth
+        self.event_fd = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+        self.completed = collections.deque()
+        self.waiters = set()
+        self.loop = None
+
+    async def __aenter__(self):
+        self._attach()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.drain()
+        self.close()
+
+    def _attach(self):
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+            self.loop.add_reader(self.event_fd, self._on_event_fd)
+            if self.executor.transport.queued:
+                for fd in self.executor.transport.fds:
+                    self.loop.add_reader(fd, self.executor.process_completions, fd)
+
+    def close(self):
+        if self.loop is not None:
+            self.loop.remove_reader(self.event_fd)
+            if self.executor.transport.queued:
+                for fd in self.executor.transport.fds:
+                    self.loop.remove_reader(fd)
+            self.loop = None
+        if self.event_fd is not None:
+            os.close(self.event_fd)
+            self.event_fd = None
+        self.executor.close()
+
+    def _on_worker_done(self, waiter, future):
+        # ワーカースレッド上で呼ばれる: 完了を積んで eventfd を叩くだけ
+        self.completed.append((waiter, future))
+        os.eventfd_write(self.event_fd, 1)
+
+    def _on_event_fd(self):
+        try:
+            os.eventfd_read(self.event_fd)
+        except BlockingIOError:
+            pass
+        while self.completed:
+            self._resolve(*self.completed.popleft())
+
+    @staticmethod
+    def _resolve(waiter, future):
+        if waiter.cancelled():
+            return
+        exc = future.exception()
+        if exc is not None:
+            waiter.set_exception(exc)
+        else:
+            waiter.set_result(future.result())
+
+    def submit(self, command: ATA_COMMAND) -> asyncio.Future:
+        self._attach()
+        waiter = self.loop.create_future()
+        self.waiters.add(waiter)
+        waiter.add_done_callback(self.waiters.discard)
+        future = self.executor.submit_command(command)
+        if self.executor.transport.queued:
+            # sg の完了はイベントループ上で刈り取られるので、そのまま解決できる
+            future.add_done_callback(lambda f: self._resolve(waiter, f))
+        else:
+            future.add_done_callback(lambda f: self._on_worker_done(waiter, f))
+        return waiter
+
+    async def run(self, command: ATA_COMMAND) -> ata_completion:
+        return await self.submit(command)
+
+    async def completions(self, commands):
+        # 最大 queue_depth 個を投入し続け、完了した順に返す
+        self._attach()
+        done = asyncio.Queue()
+        in_flight = 0
+        commands = iter(commands)
+        exhausted = False
+        while True:
+            while not exhausted and in_flight < self.queue_depth:
+                command = next(commands, None)
+                if command is None:
+                    exhausted = True
+                    break
+                self.submit(command).add_done_callback(done.put_nowait)
+                in_flight += 1
+            if in_flight == 0:
+                return
+            waiter = await done.get()
+            in_flight -= 1
+            yield waiter.result()
+
+    async def drain(self):
+        # 完了がイベントループまで届いたことを待つ (ワーカー側の Future だけでは不十分)
+        if self.waiters:
+            await asyncio.gather(*self.waiters, return_exceptions=True)
+
+if __name__ == "__main__":
+    import random
+    from .ata_command import xfer_protocol
+
+    async def main(dev_paths):
+        executors = [asyncio_ata_executor(dev_path) for dev_path in dev_paths]
+
+        def commands():
+            for _ in range(32):
+                yield ATA_COMMAND(
+                    feature=0x8,
+                    lba=random.randint(0, 0x00FF_FFFF) * 8,
+                    device=0x40,
+                    command=0x60,
+                    protocol=xfer_protocol.read_fpdma,
+                    transfer_length=4096,
+                )
+
+        async def run_device(executor):
+            async with executor:
+                good = 0
+                async for completion in executor.completions(commands()):
+                    good += completion.is_good()
+                print(f"{executor.dev_path}: {good} commands completed without error")
+
+        await asyncio.gather(*(run_device(executor) for executor in executors))
+
+    asyncio.run(main(["/dev/bsg/1:0:0:0"]))  # Adjust the path as needed
@@ -0,0 +1,180 @@
+import argparse
+import json
+import sys
+import threading
+import time
+
+from .async_bsg_executer import bsg_with_ata_command_executor
+from .simulated_ata_device import simulated_ata_device, simulated_transport, file_lba_store
+from .workload_generator import workload_generator
+from .lba_scheduler import elevator_scheduler
+from .command_watchdog import WATCHDOG_POLICIES, command_watchdog
+
+OPCODES = ('read_fpdma', 'write_fpdma', 'read_dma_ext', 'write_dma_ext')
+# --pattern 名 → workload_generator の distribution
+PATTERNS = {'rand': 'uniform', 'seq': 'seq', 'zipf': 'zipf', 'hotspot': 'hotspot'}
+
+def parse_size(text):
+    units = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+    text = text.strip().lower().rstrip('b')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text, 0)
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="fio-style workload benchmark on top of bsg_with_ata_command_executor")
+    parser.add_argument('device', help="device node (/dev/bsg/H:C:T:L, /dev/sgN); a label for --transport sim/null")
+    parser.add_argument('--transport', default='bsg', choices=('bsg', 'sg', 'null', 'sim'))
+    parser.add_argument('--opcode', default='read_fpdma', choices=sorted(OPCODES))
+    parser.add_argument('--bs', type=parse_size, default=4096, help="block size in bytes (4k, 128k, ...)")
+    parser.add_argument('--qd', type=int, default=32, help="queue depth")
+    parser.add_argument('--pattern', default='rand', choices=tuple(PATTERNS))
+    parser.add_argument('--zipf-theta', type=float, default=0.99, help="skew for --pattern zipf (0-1)")
+    parser.add_argument('--hot-fraction', type=float, default=0.2, help="hot share of the LBA span for --pattern hotspot")
+    parser.add_argument('--hot-access', type=float, default=0.8, help="share of IOs that hit the hot span")
+    parser.add_argument('--stride', type=parse_size, default=None, help="sequential stride in bytes (default: --bs)")
+    parser.add_argument('--rwmix-read', type=int, default=None,
+                        help="percentage of reads (default: 100 for read opcodes, 0 for write opcodes)")
+    parser.add_argument('--runtime', type=float, default=None, help="run time in seconds")
+    parser.add_argument('--io-count', type=int, default=None, help="number of IOs to issue")
+    parser.add_argument('--lba-range', type=parse_size, default=0x0800_0000, help="LBA span to touch, in sectors")
+    parser.add_argument('--sector-size', type=int, default=512)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--elevator', action='store_true',
+                        help="sort and merge non-NCQ (DMA EXT) requests before issuing them")
+    parser.add_argument('--json', action='store_true', help="print the result as JSON")
+    parser.add_argument('--deadline-ms', type=float, default=None,
+                        help="flag (and by default fail) commands in flight longer than this")
+    parser.add_argument('--watchdog-policy', default='fail_fast', choices=WATCHDOG_POLICIES,
+                        help="what to do with commands past --deadline-ms")
+    parser.add_argument('--profile', action='store_true', help="time each executor pipeline stage and print us/IO")
+    sim = parser.add_argument_group('simulated device (--transport sim)')
+    sim.add_argument('--sim-latency-us', type=float, default=0, help="base service time per command")
+    sim.add_argument('--sim-jitter-us', type=float, default=0, help="random extra service time (reorders NCQ completions)")
+    sim.add_argument('--sim-bandwidth', type=float, default=None, help="media bandwidth in MB/s")
+    sim.add_argument('--sim-file', default=None, help="back the simulated LBA space with this file")
+    sim.add_argument('--sim-sync', action='store_true', help="complete synchronously on the worker pool instead of queued")
+    return parser
+
+def run(args):
+    if args.bs % args.sector_size:
+        raise ValueError(f"block size must be a multiple of {args.sector_size}, got {args.bs}")
+    sectors = args.bs // args.sector_size
+    if sectors > 0xFFFF:
+        raise ValueError(f"block size too large for one command: {args.bs}")
+    rwmix_read = args.rwmix_read
+    if rwmix_read is None:
+        rwmix_read = 100 if args.opcode.startswith('read') else 0
+    io_limit = args.io_count
+    deadline = None
+    if args.runtime is not None:
+        deadline = time.perf_counter() + args.runtime
+    elif io_limit is None:
+        io_limit = 100000
+
+    # ワークロードの LBA/読み書きはまとめて生成しておき、IO ごとのコストを抑える
+    workload = workload_generator(
+        PATTERNS[args.pattern], lba_range=max(args.lba_range, sectors), block_sectors=sectors,
+        rwmix_read=rwmix_read, fpdma=args.opcode.endswith('fpdma'), seed=args.seed,
+        zipf_theta=args.zipf_theta, hot_fraction=args.hot_fraction, hot_access=args.hot_access,
+        stride_sectors=args.stride // args.sector_size if args.stride else None, sector_size=args.sector_size,
+    )
+    window = threading.BoundedSemaphore(args.qd)
+    errors = []
+    counts = {'read': 0, 'write': 0}
+
+    def on_done(future):
+        window.release()
+        if future.exception() is not None or not future.result().is_good():
+            errors.append(future)  # ワーカースレッドから呼ばれるので append で数える
+
+    transport = args.transport
+    if transport == 'sim':
+        store = file_lba_store(args.sim_file, args.sector_size) if args.sim_file else None
+        device = simulated_ata_device(sector_size=args.sector_size, store=store, queue_depth=min(args.qd, 32),
+                                      service_time_us=args.sim_latency_us, jitter_us=args.sim_jitter_us,
+                                      bandwidth_mb_s=args.sim_bandwidth, seed=args.seed or 0)
+        transport = simulated_transport(device, queued=not args.sim_sync)
+    watchdog = command_watchdog(args.deadline_ms, args.watchdog_policy) if args.deadline_ms else None
+    scheduler = elevator_scheduler(sector_size=args.sector_size) if args.elevator else None
+    executor = bsg_with_ata_command_executor(args.device, queue_depth=args.qd, transport=transport, scheduler=scheduler,
+                                             completion_log=True, profile=args.profile, watchdog=watchdog)
+    try:
+        issued = 0
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        for command in workload.commands(io_limit):
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            window.acquire()
+            executor.submit_command(command).add_done_callback(on_done)
+            counts['read' if command.protocol.is_read_xfer() else 'write'] += 1
+            issued += 1
+        executor.drain_command()
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        latency = executor.latency.snapshot()
+        error_codes = executor.completion_log.error_counts('sense')
+        stages = executor.profiler.report(issued) if executor.profiler is not None else None
+    finally:
+        executor.close()
+
+    result = {
+        'device': args.device,
+        'transport': args.transport,
+        'opcode': args.opcode,
+        'bs': args.bs,
+        'qd': args.qd,
+        'pattern': args.pattern,
+        'rwmix_read': rwmix_read,
+        'ios': issued,
+        'reads': counts['read'],
+        'writes': counts['write'],
+        'errors': len(errors),
+        # 失敗の内訳 (sense key/ASC/ASCQ → 件数)
+        'error_codes': {f"{key:x}/{asc:02x}/{ascq:02x}": count for (key, asc, ascq), count in error_codes.items()},
+        'elapsed_s': elapsed,
+        'iops': issued / elapsed if elapsed else 0,
+        'mb_per_s': issued * args.bs / elapsed / 1e6 if elapsed else 0,
+        'cpu_us_per_io': cpu / issued * 1e6 if issued else 0,
+        'latency_us': {kind: per_opcode['all'].summary(1e-3) for kind, per_opcode in latency.items()},
+        'stages': stages,
+        'overdue': [{key: event[key] for key in ('tag', 'lba', 'command', 'age_ms')} for event in watchdog.events]
+        if watchdog is not None else [],
+    }
+    return result
+
+def format_result(result):
+    lines = [
+        f"{result['device']} ({result['transport']}) {result['opcode']} bs={result['bs']} qd={result['qd']} "
+        f"{result['pattern']} rwmix_read={result['rwmix_read']}%",
+        f"  ios={result['ios']} (read={result['reads']} write={result['writes']}) errors={result['errors']} "
+        f"time={result['elapsed_s']:.3f}s",
+        f"  IOPS={result['iops']:.0f} BW={result['mb_per_s']:.1f}MB/s CPU={result['cpu_us_per_io']:.1f}us/IO",
+    ]
+    if result['error_codes']:
+        lines.append("  errors (sense key/ASC/ASCQ): " +
+                     ' '.join(f"{code}={count}" for code, count in sorted(result['error_codes'].items())))
+    for kind, s in sorted(result['latency_us'].items()):
+        lines.append(f"  {kind:>7} lat (us): mean={s['mean']:.1f} p50={s['p50']:.1f} p99={s['p99']:.1f} "
+                     f"p99.9={s['p99.9']:.1f} max={s['max']:.1f}")
+    for event in result['overdue'][:10]:
+        lines.append(f"  overdue: cmd={event['command']:#04x} lba={event['lba']:#x} tag={event['tag']} "
+                     f"age={event['age_ms']:.1f}ms")
+    if result['stages']:
+        lines.append("  stages (us/IO): " + ' '.join(f"{stage}={entry['ns_per_io'] / 1e3:.2f}({entry['share'] * 100:.0f}%)"
+                                                    for stage, entry in result['stages'].items()))
+    return '\n'.join(lines)
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    result = run(args)
+    if args.json:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    else:
+        print(format_result(result))
+    return 1 if result['errors'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
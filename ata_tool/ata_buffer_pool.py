@@ -0,0 +1,75 @@
+import ctypes
+import mmap
+import threading
+from collections import deque
+
+PAGE_SIZE = mmap.PAGESIZE
+CDB_LENGTH = 32
+SENSE_LENGTH = 32
+
+class buffer_slot:
+    # 1 タグ分のバッファ。data はページ境界に揃えた領域を指す
+    __slots__ = ('index', 'cdb', 'sense', 'data', 'size', 'view')
+
+    def __init__(self, index, cdb, sense, data, size):
+        self.index = index
+        self.cdb = cdb
+        self.sense = sense
+        self.data = data
+        self.size = size
+        self.view = memoryview(data).cast('B')
+
+class ata_buffer_pool:
+    def __init__(self, slot_count=32, slot_size=128 * 1024):
+        # slot_size はページサイズの倍数に切り上げ、各スロットの先頭がページ境界になるようにする
+        self.slot_size = (slot_size + PAGE_SIZE - 1) // PAGE_SIZE * PAGE_SIZE
+        self.slot_count = slot_count
+        self.data_area = mmap.mmap(-1, self.slot_size * slot_count)  # 匿名 mmap はページ境界に配置される
+        self.control_area = (ctypes.c_ubyte * ((CDB_LENGTH + SENSE_LENGTH) * slot_count))()
+        self.slots = []
+        for index in range(slot_count):
+            control = index * (CDB_LENGTH + SENSE_LENGTH)
+            cdb = (ctypes.c_ubyte * CDB_LENGTH).from_buffer(self.control_area, control)
+            sense = (ctypes.c_ubyte * SENSE_LENGTH).from_buffer(self.control_area, control + CDB_LENGTH)
+            data = (ctypes.c_ubyte * self.slot_size).from_buffer(self.data_area, index * self.slot_size)
+            self.slots.append(buffer_slot(index, cdb, sense, data, self.slot_size))
+        self.free = list(reversed(self.slots))
+        self.waiters = deque()  # acquire_nowait() で空きを待っているコールバック
+        self.available = threading.Condition()
+
+    def fits(self, transfer_length):
+        return transfer_length <= self.slot_size
+
+    def acquire(self) -> buffer_slot:
+        # 空きスロットがなければ解放されるまで待つ
+        with self.available:
+            while not self.free:
+                self.available.wait()
+            slot = self.free.pop()
+        ctypes.memset(slot.sense, 0, SENSE_LENGTH)
+        return slot
+
+    def acquire_nowait(self, on_available):
+        # 空きがあればスロットを返す。なければ on_available を積んで None を返し、
+        # スロットが返ってきた時点で release() を呼んだスレッドから on_available(slot) を呼ぶ (呼び出し元を止めない)
+        with self.available:
+            if not self.free or self.waiters:
+                self.waiters.append(on_available)
+                return None
+            slot = self.free.pop()
+        ctypes.memset(slot.sense, 0, SENSE_LENGTH)
+        return slot
+
+    def release(self, slot: buffer_slot):
+        with self.available:
+            if not self.waiters:
+                self.free.append(slot)
+                self.available.notify()
+                return
+            on_available = self.waiters.popleft()
+        ctypes.memset(slot.sense, 0, SENSE_LENGTH)
+        on_available(slot)
+
+    def in_use(self):
+        with self.available:
+            return self.slot_count - len(self.free)
@@ -1,6 +1,6 @@
 
 from enum import Enum, auto
-from dataclasses import dataclass, field
+from dataclasses import dataclass
 
 class xfer_protocol(Enum):
     non_data = auto()
@@ -25,7 +25,14 @@ class xfer_protocol(Enum):
         elif self in ( xfer_protocol.read_fpdma , xfer_protocol.write_fpdma):
             return xfer_protocol.fpdma
 
-@dataclass
+# ext_command ごとの各フィールド上限 (feature, count, lba, icc, auxiliary, device, command)
+FIELD_LIMITS = {
+    True: (0xFFFF, 0xFFFF, 0xFFFF_FFFF_FFFF, 0xFF, 0xFFFF_FFFF, 0xFF, 0xFF),
+    False: (0xFF, 0xFFFF, 0x0FFF_FFFF, 0, 0, 0xFF, 0xFF),
+}
+_UNDIRECTED_PROTOCOLS = (xfer_protocol.pio, xfer_protocol.dma, xfer_protocol.fpdma)
+
+@dataclass(slots=True)
 class ATA_COMMAND:
     feature: int = 0
     count: int = 0
@@ -36,10 +43,22 @@ class ATA_COMMAND:
     command: int = 0
     protocol: xfer_protocol = xfer_protocol.non_data
     transfer_length: int = 0
-    transfer_data: bytes = field(default_factory=list)
+    transfer_data: bytes = b''
     is_512_block: bool = False
     ext_command: bool = True
+    transfer_buffers: list = None  # 指定するとこれらのバッファへ直接 DMA する (scatter-gather)
+    timeout_ms: int = None  # このコマンドだけの期限。None なら executor/watchdog の既定値
     def __post_init__(self):
+        feature, count, lba, icc, auxiliary, device, command = FIELD_LIMITS[self.ext_command is True]
+        # 正常系は比較 1 回で抜け、範囲外のときだけどのフィールドかを調べる
+        if not (0 <= self.feature <= feature and 0 <= self.count <= count and 0 <= self.lba <= lba
+                and 0 <= self.icc <= icc and 0 <= self.auxiliary <= auxiliary
+                and 0 <= self.device <= device and 0 <= self.command <= command):
+            self._raise_out_of_range()
+        if self.protocol in _UNDIRECTED_PROTOCOLS:
+            raise ValueError(f"protocol must be specified xfer direction, got {self.protocol}")
+
+    def _raise_out_of_range(self):
         if self.ext_command is True:
             if not (0 <= self.feature <= 0xFFFF):
                 raise ValueError(f"feature must be in range 0-65535, got {self.feature}")
@@ -66,9 +85,7 @@ class ATA_COMMAND:
                 raise ValueError(f"device must be in range 0-255, got {self.device}")
             if not (0 <= self.command <= 0xFF):
                 raise ValueError(f"command must be in range 0-255, got {self.command}")
-            if not (self.icc or self.auxiliary):
+            if self.icc or self.auxiliary:
                 raise ValueError(f"icc and auxiliary must be 0 when ext_command is False, got icc={self.icc}, auxiliary={self.auxiliary}")
-        if      self.protocol in ( xfer_protocol.pio , xfer_protocol.dma , xfer_protocol.fpdma):
-            raise ValueError(f"protocol must be specified xfer direction, got {self.protocol}")
 if __name__ == "__main__":
     pass
\ No newline at end of file
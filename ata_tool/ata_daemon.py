@@ -0,0 +1,367 @@
+import argparse
+import errno
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from .async_bsg_executer import bsg_with_ata_command_executor
+from .command_batch import COMMAND_DTYPE, command_batch
+from .simulated_ata_device import simulated_ata_device, simulated_transport
+
+DEFAULT_SOCKET = os.path.join(os.environ.get('XDG_RUNTIME_DIR', '/tmp'), 'ata_daemon.sock')
+
+# フレーム: 種別, デバイス番号, 予約, 要求 ID, ペイロード長
+FRAME_HEADER = struct.Struct('<BBHII')
+MSG_BATCH = 0x01  # ペイロード: BATCH_HEADER, COMMAND_DTYPE のレコード * count, 書き込みデータ (行順に連結)
+MSG_STATS = 0x02
+MSG_DEVICES = 0x03
+MSG_COMPLETIONS = 0x81  # ペイロード: COMPLETION_ENTRY (+ sense 32 バイト) (+ 読み込みデータ) の並び
+MSG_BATCH_DONE = 0x82  # ペイロード: BATCH_DONE
+MSG_REPLY = 0x83  # ペイロード: JSON
+MSG_ERROR = 0x8F  # ペイロード: UTF-8 のメッセージ
+
+BATCH_HEADER = struct.Struct('<II')  # count, flags
+BATCH_RETURN_DATA = 0x01  # 読み込みデータを完了と一緒に返す
+# 完了: 行番号, 後ろに付くデータ長, driver/transport/device status, flags, resid, duration (ms), 投入→完了 ns
+COMPLETION_ENTRY = struct.Struct('<IIHHBBxxiIQ')
+ENTRY_SENSE = 0x01  # 32 バイトの sense が続く
+ENTRY_EXCEPTION = 0x02  # 投入時または executor 内で例外になった (sense の代わりにメッセージが続く)
+BATCH_DONE = struct.Struct('<IIQ')  # 完了数, 失敗数, バッチ受信から最後の完了までの ns
+SENSE_LENGTH = 32
+MAX_FRAME = 1 << 30
+
+def recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        got = sock.recv_into(view[received:])
+        if not got:
+            raise ConnectionError("connection closed")
+        received += got
+    return buffer
+
+def send_frame(sock, kind, request_id, payload=b'', device=0):
+    header = FRAME_HEADER.pack(kind, device, 0, request_id, len(payload))
+    if len(payload) < 65536:
+        sock.sendall(header + payload)  # 小さいフレームは 1 回の send にまとめる
+    else:
+        sock.sendall(header)
+        sock.sendall(payload)
+
+def recv_frame(sock):
+    kind, device, _, request_id, length = FRAME_HEADER.unpack(recv_exact(sock, FRAME_HEADER.size))
+    if length > MAX_FRAME:
+        raise ValueError(f"frame too large: {length} bytes")
+    return kind, device, request_id, recv_exact(sock, length) if length else bytearray()
+
+def _remove_stale_socket(path):
+    # 前回異常終了したデーモンのソケットファイルだけを消す。応答するデーモンがいれば起動しない
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise OSError(errno.EADDRINUSE, f"another daemon is already serving {path}")
+
+class _connection(socketserver.BaseRequestHandler):
+    # 1 接続 = 1 スレッド。要求は順番に処理し、バッチの完了はまとまった分ずつ流し返す
+    def handle(self):
+        daemon = self.server.ata_daemon
+        while True:
+            try:
+                kind, device, request_id, payload = recv_frame(self.request)
+            except (ConnectionError, OSError):
+                return
+            try:
+                if kind == MSG_BATCH:
+                    self._batch(daemon, device, request_id, payload)
+                elif kind == MSG_STATS:
+                    send_frame(self.request, MSG_REPLY, request_id, json.dumps(daemon.stats()).encode())
+                elif kind == MSG_DEVICES:
+                    send_frame(self.request, MSG_REPLY, request_id, json.dumps(daemon.device_list()).encode())
+                else:
+                    raise ValueError(f"unknown message type {kind:#x}")
+            except (ConnectionError, BrokenPipeError):
+                return
+            except Exception as e:
+                send_frame(self.request, MSG_ERROR, request_id, f"{type(e).__name__}: {e}".encode())
+
+    def _batch(self, daemon, device, request_id, payload):
+        received_ns = time.perf_counter_ns()
+        executor = daemon.executor(device)
+        count, flags = BATCH_HEADER.unpack_from(payload)
+        end = BATCH_HEADER.size + count * COMMAND_DTYPE.itemsize
+        if len(payload) < end:
+            raise ValueError(f"batch of {count} commands needs {end} bytes, got {len(payload)}")
+        batch = command_batch(records=np.frombuffer(payload, COMMAND_DTYPE, count, BATCH_HEADER.size))
+        batch.validate()
+        # 書き込みデータはペイロード上のスライスをそのまま渡す (コピーしない)
+        is_write = ~batch.is_read() & (batch.transfer_length > 0)
+        lengths = np.where(is_write, batch.transfer_length, 0).astype(np.int64)
+        offsets = (end + np.cumsum(lengths) - lengths).tolist()
+        if len(payload) not in (end, end + int(lengths.sum())):
+            raise ValueError(f"write data must be empty or {int(lengths.sum())} bytes, got {len(payload) - end}")
+        data = memoryview(payload) if len(payload) > end else None
+        done = queue.SimpleQueue()
+        for index, command in enumerate(batch.commands()):
+            if data is not None and lengths[index]:
+                command.transfer_data = data[offsets[index]:offsets[index] + command.transfer_length]
+            try:
+                future = executor.submit_command(command)
+            except Exception as e:
+                # 投入できなかった行だけを失敗として返し、投入済みの行と残りの行はそのまま続ける
+                future = Future()
+                future.set_exception(e)
+            future.add_done_callback(lambda f, index=index: done.put((index, f)))
+        self._stream(daemon, device, request_id, count, flags, done, received_ns)
+
+    def _stream(self, daemon, device, request_id, count, flags, done, received_ns):
+        remaining = count
+        failed = 0
+        while remaining:
+            # 来ている分をまとめて 1 フレームにする
+            parts = []
+            size = 0
+            item = done.get()
+            while True:
+                index, future = item
+                entry, ok = self._entry(index, future, flags)
+                parts.append(entry)
+                size += len(entry)
+                failed += not ok
+                remaining -= 1
+                if not remaining or size >= daemon.frame_bytes:
+                    break
+                try:
+                    item = done.get_nowait()
+                except queue.Empty:
+                    break
+            send_frame(self.request, MSG_COMPLETIONS, request_id, b''.join(parts), device)
+        daemon.count(count, failed)
+        send_frame(self.request, MSG_BATCH_DONE, request_id,
+                   BATCH_DONE.pack(count, failed, time.perf_counter_ns() - received_ns), device)
+
+    @staticmethod
+    def _entry(index, future, flags):
+        error = future.exception()
+        if error is not None:
+            message = f"{type(error).__name__}: {error}".encode()
+            return COMPLETION_ENTRY.pack(index, len(message), 0, 0, 0, ENTRY_EXCEPTION, 0, 0, 0) + message, False
+        completion = future.result()
+        command = completion.command
+        good = completion.is_good()
+        data = b''
+        if flags & BATCH_RETURN_DATA and good and command.transfer_length and command.protocol.is_read_xfer():
+            data = command.transfer_data
+        entry = COMPLETION_ENTRY.pack(index, len(data), completion.driver_status & 0xFFFF,
+                                      completion.transport_status & 0xFFFF, completion.device_status & 0xFF,
+                                      0 if good else ENTRY_SENSE, completion.resid, completion.duration,
+                                      completion.complete_ns - completion.submit_ns)
+        if not good:
+            entry += completion.sense[:SENSE_LENGTH].ljust(SENSE_LENGTH, b'\0')
+        return entry + data if data else entry, good
+
+class _server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class ata_daemon:
+    # デバイスごとの executor (fd, バッファプール, ワーカー) を開いたまま保持し、
+    # Unix ソケット越しに command_batch を受け付けて完了を流し返す
+    def __init__(self, dev_paths, socket_path=DEFAULT_SOCKET, frame_bytes=64 * 1024, **executor_options):
+        self.socket_path = socket_path
+        self.frame_bytes = frame_bytes
+        self.dev_paths = list(dev_paths)
+        self.executors = []
+        try:
+            for dev_path in self.dev_paths:
+                options = dict(executor_options)
+                if options.get('transport') == 'sim':
+                    options['transport'] = simulated_transport(simulated_ata_device(queue_depth=min(
+                        options.get('queue_depth') or 32, 32)))
+                self.executors.append(bsg_with_ata_command_executor(dev_path, **options))
+        except BaseException:
+            self.close()
+            raise
+        self.started = time.time()
+        self.counters = {'batches': 0, 'commands': 0, 'failed': 0}
+        self.counter_lock = threading.Lock()
+        if os.path.exists(socket_path):
+            _remove_stale_socket(socket_path)
+        self.server = _server(socket_path, _connection)
+        self.server.ata_daemon = self
+        self.serving = False
+
+    def executor(self, device):
+        if not 0 <= device < len(self.executors):
+            raise ValueError(f"device must be 0-{len(self.executors) - 1}, got {device}")
+        return self.executors[device]
+
+    def count(self, commands, failed):
+        with self.counter_lock:
+            self.counters['batches'] += 1
+            self.counters['commands'] += commands
+            self.counters['failed'] += failed
+
+    def device_list(self):
+        return [{'index': index, 'path': path, 'transport': executor.transport.name,
+                 'queue_depth': executor.queue_depth}
+                for index, (path, executor) in enumerate(zip(self.dev_paths, self.executors))]
+
+    def stats(self):
+        with self.counter_lock:
+            counters = dict(self.counters)
+        devices = []
+        for entry, executor in zip(self.device_list(), self.executors):
+            with executor.outstanding_lock:
+                entry['outstanding'] = len(executor.outstanding)
+            if executor.latency is not None:
+                entry['latency_us'] = {kind: per_opcode['all'].summary(1e-3)
+                                       for kind, per_opcode in executor.latency.snapshot().items()}
+            devices.append(entry)
+        return dict(counters, uptime_s=time.time() - self.started, devices=devices)
+
+    def serve_forever(self):
+        self.serving = True
+        self.server.serve_forever()
+
+    def start(self):
+        # バックグラウンドで受け付ける (テストや組み込み用)
+        self.serving = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def close(self):
+        if getattr(self, 'server', None) is not None:
+            if self.serving:
+                self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        for executor in self.executors:
+            executor.drain_command()
+            executor.close()
+        self.executors = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class ata_daemon_client:
+    def __init__(self, socket_path=DEFAULT_SOCKET):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.next_id = 1
+        self.last_batch = None  # 直前のバッチの {'completed', 'failed', 'elapsed_ns'}
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _request(self, kind, payload=b'', device=0):
+        request_id = self.next_id
+        self.next_id = (self.next_id + 1) & 0xFFFF_FFFF
+        send_frame(self.sock, kind, request_id, payload, device)
+        return request_id
+
+    def _reply(self):
+        kind, _, _, payload = recv_frame(self.sock)
+        if kind == MSG_ERROR:
+            raise RuntimeError(payload.decode(errors='replace'))
+        return kind, payload
+
+    def stats(self):
+        self._request(MSG_STATS)
+        return json.loads(self._reply()[1])
+
+    def devices(self):
+        self._request(MSG_DEVICES)
+        return json.loads(self._reply()[1])
+
+    def stream_batch(self, batch: command_batch, device=0, write_data=None, return_data=False):
+        # 完了を届いた順に (行番号, driver, transport, device status, resid, duration, 投入→完了 ns, sense, data) で返す。
+        # write_data は書き込みコマンドのデータを行順に連結したもの (None ならゼロを書く)
+        # 投入できなかった行や executor 内で例外になった行は status が 0 のまま、sense の位置に例外メッセージが入る
+        header = BATCH_HEADER.pack(len(batch), BATCH_RETURN_DATA if return_data else 0)
+        records = np.ascontiguousarray(batch.records, COMMAND_DTYPE)
+        self._request(MSG_BATCH, b''.join((header, records.tobytes(), bytes(write_data or b''))), device)
+        while True:
+            kind, payload = self._reply()
+            if kind == MSG_BATCH_DONE:
+                self.last_batch = dict(zip(('completed', 'failed', 'elapsed_ns'), BATCH_DONE.unpack(payload)))
+                return
+            view = memoryview(payload)
+            position = 0
+            while position < len(payload):
+                (index, length, driver_status, transport_status, device_status, flags, resid, duration,
+                 latency_ns) = COMPLETION_ENTRY.unpack_from(view, position)
+                position += COMPLETION_ENTRY.size
+                sense = b''
+                if flags & ENTRY_SENSE:
+                    sense = bytes(view[position:position + SENSE_LENGTH])
+                    position += SENSE_LENGTH
+                data = bytes(view[position:position + length])
+                position += length
+                if flags & ENTRY_EXCEPTION:
+                    sense, data = data, b''  # 例外メッセージ
+                yield index, driver_status, transport_status, device_status, resid, duration, latency_ns, sense, data
+
+    def run_batch(self, batch: command_batch, device=0, write_data=None, return_data=False):
+        # 全完了を行番号順のリストで返す
+        results = [None] * len(batch)
+        for entry in self.stream_batch(batch, device, write_data, return_data):
+            results[entry[0]] = entry
+        return results
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="keep ATA executors open and serve command batches over a Unix socket")
+    commands = parser.add_subparsers(dest='action', required=True)
+    serve = commands.add_parser('serve', help="run the daemon in the foreground")
+    serve.add_argument('devices', nargs='+', help="device nodes (/dev/bsg/H:C:T:L, /dev/sgN); labels for sim/null")
+    serve.add_argument('--socket', default=DEFAULT_SOCKET)
+    serve.add_argument('--transport', default='bsg', choices=('bsg', 'sg', 'null', 'sim'))
+    serve.add_argument('--qd', type=int, default=None, help="queue depth (default: probed or 32)")
+    serve.add_argument('--probe', action='store_true', help="IDENTIFY each device at start to size the executor")
+    for action in ('stats', 'devices'):
+        query = commands.add_parser(action, help=f"print the daemon's {action} as JSON")
+        query.add_argument('--socket', default=DEFAULT_SOCKET)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.action == 'serve':
+        with ata_daemon(args.devices, args.socket, transport=args.transport, queue_depth=args.qd,
+                        probe=args.probe) as daemon:
+            print(f"serving {len(args.devices)} devices on {args.socket}", file=sys.stderr)
+            try:
+                daemon.serve_forever()
+            except KeyboardInterrupt:
+                pass
+        return 0
+    with ata_daemon_client(args.socket) as client:
+        json.dump(client.stats() if args.action == 'stats' else client.devices(), sys.stdout, indent=2)
+        print()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+import argparse
+import errno
+import sys
+import threading
+import time
+
+from .async_bsg_executer import bsg_with_ata_command_executor
+from .ata_bench import parse_size
+from .ata_command import ATA_COMMAND, xfer_protocol
+
+class drive_imager:
+    # start_lba から end_lba (含まない) までを chunk_sectors 単位で先読みしながら順番どおりに取り出す。
+    # チャンク用バッファは in_flight 個だけ確保して使い回すので、ドライブ容量に関係なくメモリ使用量は一定
+    def __init__(self, executor: bsg_with_ata_command_executor, start_lba, end_lba, chunk_sectors=256,
+                 in_flight=8, fpdma=True, sector_size=512, skip_errors=False):
+        if end_lba <= start_lba:
+            raise ValueError(f"end_lba must be greater than start_lba, got {start_lba}-{end_lba}")
+        if not 1 <= chunk_sectors <= 0x10000:
+            raise ValueError(f"chunk_sectors must be 1-65536, got {chunk_sectors}")
+        self.executor = executor
+        self.start_lba = start_lba
+        self.end_lba = end_lba
+        self.chunk_sectors = chunk_sectors
+        self.in_flight = in_flight
+        self.fpdma = fpdma
+        self.sector_size = sector_size
+        self.skip_errors = skip_errors
+        self.bad_ranges = []  # skip_errors=True のとき、読めなかった (lba, sectors)
+        # iovec を使える transport (sg) では自前のバッファへ直接読み込む。使えない transport (bsg) では
+        # プールのスロットへ読み、executor が zero_copy ならスロットをそのまま、そうでなければコピーを返す
+        self.direct = executor.iovec
+        self.buffers = [bytearray(chunk_sectors * sector_size) for _ in range(in_flight)] if self.direct else None
+        self.done = {}  # チャンク番号 → completion (順番待ちの並べ替えバッファ)
+        self.cond = threading.Condition()
+
+    def chunk_count(self):
+        return -(-(self.end_lba - self.start_lba) // self.chunk_sectors)
+
+    def _command(self, index, buffer):
+        lba = self.start_lba + index * self.chunk_sectors
+        sectors = min(self.chunk_sectors, self.end_lba - lba)
+        return ATA_COMMAND(
+            # 0x10000 セクタは FEATURE/COUNT = 0 で表す
+            feature=sectors & 0xFFFF if self.fpdma else 0,
+            count=0 if self.fpdma else sectors & 0xFFFF,
+            lba=lba,
+            device=0x40,
+            command=0x60 if self.fpdma else 0x25,
+            protocol=xfer_protocol.read_fpdma if self.fpdma else xfer_protocol.read_dma,
+            transfer_length=sectors * self.sector_size,
+            transfer_buffers=None if buffer is None else [memoryview(buffer)[:sectors * self.sector_size]],
+        )
+
+    def _submit(self, index):
+        buffer = self.buffers[index % self.in_flight] if self.direct else None
+        future = self.executor.submit_command(self._command(index, buffer))
+        future.add_done_callback(lambda f: self._on_done(index, f))
+
+    def _on_done(self, index, future):
+        with self.cond:
+            self.done[index] = future
+            self.cond.notify()
+
+    def chunks(self):
+        # (lba, memoryview) を LBA 順に返す。memoryview は次の要素を取り出すまでのみ有効
+        total = self.chunk_count()
+        next_submit = 0
+        held = None  # 直前に返した completion。zero_copy のスロットは次の要素を取り出すときに返す
+        try:
+            for index in range(total):
+                if held is not None:
+                    held.release()
+                    held = None
+                while next_submit < total and next_submit < index + self.in_flight:
+                    self._submit(next_submit)
+                    next_submit += 1
+                with self.cond:
+                    while index not in self.done:
+                        self.cond.wait()
+                    future = self.done.pop(index)
+                completion = future.result() if future.exception() is None else None
+                lba = self.start_lba + index * self.chunk_sectors
+                sectors = min(self.chunk_sectors, self.end_lba - lba)
+                if completion is None or not completion.is_good():
+                    if completion is not None:
+                        completion.release()
+                    if not self.skip_errors:
+                        self._abort(index + 1, next_submit)
+                        if completion is None:
+                            raise future.exception()
+                        raise OSError(errno.EIO, f"read failed at LBA {lba:#x} ({sectors} sectors)")
+                    self.bad_ranges.append((lba, sectors))
+                    view = memoryview(bytes(sectors * self.sector_size))
+                elif self.direct:
+                    view = memoryview(self.buffers[index % self.in_flight])[:sectors * self.sector_size]
+                else:
+                    view = memoryview(completion.data if completion.data is not None else completion.command.transfer_data)
+                    held = completion
+                yield lba, view
+        finally:
+            if held is not None:
+                held.release()
+
+    def _abort(self, first, next_submit):
+        # 先読み中のチャンクは捨てる (バッファへの書き込みが終わるまで待ち、スロットは返す)
+        with self.cond:
+            while not all(index in self.done for index in range(first, next_submit)):
+                self.cond.wait()
+            for future in self.done.values():
+                if future.exception() is None:
+                    future.result().release()
+            self.done.clear()
+
+    def image(self, output):
+        # output はパスまたは write() を持つオブジェクト。書き込んだバイト数を返す
+        if isinstance(output, (str, bytes)) or hasattr(output, '__fspath__'):
+            with open(output, 'wb') as f:
+                return self.image(f)
+        written = 0
+        for lba, view in self.chunks():
+            output.write(view)
+            written += len(view)
+        return written
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="stream an LBA range of a drive to a file in order")
+    parser.add_argument('device', help="device node (/dev/bsg/H:C:T:L, /dev/sgN)")
+    parser.add_argument('output', help="output image file ('-' for stdout)")
+    parser.add_argument('--transport', default='bsg', choices=('bsg', 'sg'))
+    parser.add_argument('--start-lba', type=lambda text: int(text, 0), default=0)
+    parser.add_argument('--end-lba', type=lambda text: int(text, 0), default=None,
+                        help="first LBA not read (default: end of the drive, requires --probe)")
+    parser.add_argument('--chunk', type=parse_size, default=128 * 1024, help="bytes per command (128k, 1m, ...)")
+    parser.add_argument('--in-flight', type=int, default=8, help="chunks kept in flight")
+    parser.add_argument('--dma-ext', action='store_true', help="use READ DMA EXT instead of READ FPDMA QUEUED")
+    parser.add_argument('--sector-size', type=int, default=None, help="logical sector size (default: probed, else 512)")
+    parser.add_argument('--probe', action='store_true',
+                        help="IDENTIFY the drive to fill in --end-lba/--sector-size and clamp --chunk")
+    parser.add_argument('--skip-errors', action='store_true', help="zero-fill unreadable chunks and continue")
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.end_lba is None and not args.probe:
+        parser.error("--end-lba is required without --probe")
+    # bsg はスロットへ読み込むので、スロットを 1 チャンク分の大きさにし、取り出し中の 1 個分を足しておく
+    with bsg_with_ata_command_executor(args.device, queue_depth=args.in_flight, transport=args.transport,
+                                       buffer_slots=args.in_flight + 1, max_pooled_transfer=args.chunk,
+                                       zero_copy=True, probe=args.probe) as executor:
+        capabilities = executor.capabilities
+        if capabilities is not None:
+            # 指定がなければ容量とセクタ長を IDENTIFY の値に、チャンクは 1 コマンドの上限に合わせる
+            args.end_lba = capabilities.max_lba + 1 if args.end_lba is None else args.end_lba
+            args.sector_size = args.sector_size or capabilities.logical_sector_size
+            args.chunk = min(args.chunk, capabilities.max_sectors() * args.sector_size)
+        args.sector_size = args.sector_size or 512
+        if args.chunk % args.sector_size:
+            raise ValueError(f"chunk must be a multiple of {args.sector_size}, got {args.chunk}")
+        imager = drive_imager(executor, args.start_lba, args.end_lba, args.chunk // args.sector_size,
+                              args.in_flight, not args.dma_ext, args.sector_size, args.skip_errors)
+        start = time.perf_counter()
+        written = imager.image(sys.stdout.buffer if args.output == '-' else args.output)
+        elapsed = time.perf_counter() - start
+    print(f"{written} bytes in {elapsed:.3f}s ({written / elapsed / 1e6:.1f} MB/s)", file=sys.stderr)
+    for lba, sectors in imager.bad_ranges:
+        print(f"  unreadable: LBA {lba:#x} +{sectors}", file=sys.stderr)
+    return 1 if imager.bad_ranges else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,294 @@
+import struct
+from dataclasses import dataclass
+
+from .ata_command import ATA_COMMAND, xfer_protocol
+
+@dataclass
+class ATA_PASS_THROUGH_32:
+    operation_code: int = 0x7F
+    control: int = 0x00
+    additional_cdb_length: int = 0x18
+    service_action: int = 0x1FF0
+    protocol: int = 0
+    extend: bool = False
+    off_line: int = 0
+    ck_cond: bool = False
+    t_type: bool = False
+    t_dir: bool = False
+    byt_blok: bool = False
+    t_length: int = 0
+    features: int = 0
+    sector_count: int = 0
+    lba: int = 0
+    device: int = 0
+    command: int = 0
+    icc: int = 0
+    auxiliary: int = 0
+
+    def __post_init__(self):
+        if not self.operation_code == 0x7F:
+            raise ValueError(f"operation_code must be 0x7F, got {self.operation_code}")
+        if not self.additional_cdb_length == 0x18:
+            raise ValueError(f"additional_cdb_length must be 0x18, got {self.additional_cdb_length}")
+        if not self.service_action == 0x1FF0:
+            raise ValueError(f"service_action must be 0x1FF0, got {self.service_action}")
+        if not ( 0 <= self.protocol <= 0xF):
+            raise ValueError(f"protocol must be in range 0-15, got {self.protocol}")
+        if not ( 0 <= self.off_line <= 0x3):
+            raise ValueError(f"off_line must be in range 0-3, got {self.off_line}")
+        if not ( 0 <= self.t_length <= 0x3):
+            raise ValueError(f"t_length must be in range 0-3, got {self.t_length}")
+        if not (0 <= self.features <= 0xFFFF):
+            raise ValueError(f"features must be in range 0-65535, got {self.features}")
+        if not (0 <= self.sector_count <= 0xFFFF):
+            raise ValueError(f"sector_count must be in range 0-65535, got {self.sector_count}")
+        if not (0 <= self.lba <= 0xFFFF_FFFF_FFFF):
+            raise ValueError(f"lba must be in range 48 bit, got {self.lba}")
+        if not (0 <= self.device <= 0xFF):
+            raise ValueError(f"device must be in range 0-255, got {self.device}")
+        if not (0 <= self.command <= 0xFF):
+            raise ValueError(f"command must be in range 0-255, got {self.command}")
+
+    def cdb(self):
+        operation_code = self.operation_code
+        control = self.control
+        reserved_0 = 0
+        reserved_1 = 0
+        reserved_2 = 0
+        reserved_3 = 0
+        reserved_4 = 0
+        additional_cdb_length = self.additional_cdb_length
+        service_action_MSB = (self.service_action >> 8) & 0xFF
+        service_action_LSB = self.service_action & 0xFF
+        byte1 = ((self.protocol & 0b1111) << 1) | (self.extend & 0x1)
+        byte2 = ((self.off_line & 0b11) << 6) | ((self.ck_cond & 0b1) << 5) | ((self.t_type & 0b1) << 4) | \
+                ((self.t_dir & 0b1) << 3) | ((self.byt_blok & 0b1) << 2) | (self.t_length & 0b11)
+        reserved_5 = 0
+        reserved_6 = 0
+        if self.extend: # 48 bit LBA Command
+            lba_47_40 = (self.lba >> 40) & 0xFF
+            lba_39_32 = (self.lba >> 32) & 0xFF
+            lba_31_24 = (self.lba >> 24) & 0xFF
+            lba_23_16 = (self.lba >> 16) & 0xFF
+            lba_15_8 = (self.lba >> 8) & 0xFF
+            lba_7_0 = self.lba & 0xFF
+            features_15_8 = (self.features >> 8) & 0xFF
+            features_7_0 = self.features & 0xFF
+            count_15_8 = (self.sector_count >> 8) & 0xFF
+            count_7_0 = self.sector_count & 0xFF
+            device = self.device & 0xFF
+            command = self.command & 0xFF
+            reserved_7 = 0
+            icc = self.icc & 0xFF
+            auxiliary_31_24 = (self.auxiliary >> 24) & 0xFF
+            auxiliary_23_16 = (self.auxiliary >> 16) & 0xFF
+            auxiliary_15_8 = (self.auxiliary >> 8) & 0xFF
+            auxiliary_7_0 = self.auxiliary & 0xFF
+        else: # 28 bit LBA Command
+            lba_47_40 = 0
+            lba_39_32 = 0
+            lba_31_24 = 0
+            lba_23_16 = (self.lba >> 16) & 0xFF
+            lba_15_8 = (self.lba >> 8) & 0xFF
+            lba_7_0 = self.lba & 0xFF
+            features_15_8 = 0
+            features_7_0 = self.features & 0xFF
+            count_15_8 = 0
+            count_7_0 = self.sector_count & 0xFF
+            device = ((self.lba >> 24) & 0x0F) << 4
+            device |= self.device & 0x0F
+            command = self.command & 0xFF
+            reserved_7 = 0  # Reserved byte, can be set to 0
+            icc = 0
+            auxiliary_31_24 = 0
+            auxiliary_23_16 = 0
+            auxiliary_15_8 = 0
+            auxiliary_7_0 = 0
+        return bytes([
+            operation_code,
+            control,
+            reserved_0,
+            reserved_1,
+            reserved_2,
+            reserved_3,
+            reserved_4,
+            additional_cdb_length,
+            service_action_MSB,
+            service_action_LSB,
+            byte1,
+            byte2,
+            reserved_5,
+            reserved_6,
+            lba_47_40,
+            lba_39_32,
+            lba_31_24,
+            lba_23_16,
+            lba_15_8,
+            lba_7_0,
+            features_15_8,
+            features_7_0,
+            count_15_8,
+            count_7_0,
+            device,
+            command,
+            reserved_7,
+            icc,
+            auxiliary_31_24,
+            auxiliary_23_16,
+            auxiliary_15_8,
+            auxiliary_7_0,
+        ])
+
+class ATA_PASS_THROUGH_16:
+    def __init__(self):
+        self.operation_code = 0x85  # ATA PASS-THROUGH (16)
+        self.multiple_count = 0
+        self.protocol = 0
+        self.extend = 0
+        self.off_line = 0
+        self.ck_cond = 0
+        self.reserved = 0
+        self.t_dir = 0
+        self.byt_blok = 0
+        self.t_length = 0
+
+        self.features = 0
+        self.sector_count = 0
+        self.lba = 0
+
+        self.device = 0
+        self.command = 0
+        self.control = 0
+
+    def to_bytes(self):
+        byte1 = (self.multiple_count & 0b111) << 5 | ((self.protocol & 0b1111) << 1) | (self.extend & 0x1)
+        byte2 = ((self.off_line & 0b11) << 6) | ((self.ck_cond & 0b1) << 5) | ((self.reserved & 0b1) << 4) | \
+                ((self.t_dir & 0b1) << 3) | ((self.byt_blok & 0b1) << 2) | (self.t_length & 0b11)
+        features_low = self.features & 0xFF
+        features_high = (self.features >> 8) & 0xFF
+        sector_count = self.sector_count & 0xFF
+        sector_count_ext = (self.sector_count >> 8) & 0xFF
+        lba_low = self.lba & 0xFF
+        lba_low_ext = (self.lba >> 8) & 0xFF
+        lba_mid = (self.lba >> 16) & 0xFF
+        lba_mid_ext = (self.lba >> 24) & 0xFF
+        lba_high = (self.lba >> 32) & 0xFF
+        lba_high_ext = (self.lba >> 40) & 0xFF
+
+        return bytes([
+            self.operation_code,
+            byte1,
+            byte2,
+            features_high,
+            features_low,
+            sector_count_ext,
+            sector_count,
+            lba_low,
+            lba_low_ext,
+            lba_mid,
+            lba_mid_ext,
+            lba_high,
+            lba_high_ext,
+            self.device,
+            self.command,
+            self.control,
+        ])
+
+# ATA PASS-THROUGH(32) の CDB レイアウト (ビッグエンディアン、LBA は上位 16 bit と下位 32 bit に分割)
+ATA_PT32_CDB = struct.Struct('>BB5xBHBB2xHIHHBBxBI')
+_pack_into = ATA_PT32_CDB.pack_into
+
+# xfer_protocol ごとの ATA PASS-THROUGH の PROTOCOL フィールド値
+ATA_PT_PROTOCOL = {
+    xfer_protocol.non_data: 0x3,  # Non-data command
+    xfer_protocol.read_pio: 0x4,  # PIO Data-In
+    xfer_protocol.write_pio: 0x5,  # PIO Data-Out
+    xfer_protocol.read_dma: 0x6,  # DMA
+    xfer_protocol.write_dma: 0x6,  # DMA
+    xfer_protocol.read_fpdma: 0xC,  # NCQ (FPDMA)
+    xfer_protocol.write_fpdma: 0xC,  # NCQ (FPDMA)
+}
+
+def _control_bytes(protocol, extend, is_512_block):
+    byte1 = (ATA_PT_PROTOCOL[protocol] << 1) | extend
+    byte2 = (1 << 4) | (protocol.is_read_xfer() << 3) | ((not is_512_block) << 2) | 0b11  # T_TYPE=1, T_LENGTH=TPSIU
+    return byte1, byte2
+
+# (protocol, ext_command, is_512_block) ごとに byte1/byte2 を事前計算しておく
+_CONTROL_BYTES = {
+    (protocol, extend, is_512_block): _control_bytes(protocol, extend, is_512_block)
+    for protocol in ATA_PT_PROTOCOL for extend in (False, True) for is_512_block in (False, True)
+}
+
+def pack_ata_command_into(buffer, offset, command: ATA_COMMAND):
+    # ATA_COMMAND を 32 byte の CDB として buffer[offset:] に直接書き込む (中間オブジェクトなし)
+    try:
+        byte1, byte2 = _CONTROL_BYTES[command.protocol, command.ext_command, command.is_512_block]
+    except KeyError:
+        raise ValueError(f"Unsupported transfer protocol: {command.protocol}") from None
+    lba = command.lba
+    if command.ext_command: # 48 bit LBA Command
+        _pack_into(buffer, offset, 0x7F, 0, 0x18, 0x1FF0, byte1, byte2,
+                   lba >> 32, lba & 0xFFFF_FFFF, command.feature, command.count,
+                   command.device, command.command, command.icc, command.auxiliary)
+    else: # 28 bit LBA Command
+        _pack_into(buffer, offset, 0x7F, 0, 0x18, 0x1FF0, byte1, byte2,
+                   0, lba & 0x00FF_FFFF, command.feature & 0xFF, command.count & 0xFF,
+                   (((lba >> 24) & 0x0F) << 4) | (command.device & 0x0F), command.command, 0, 0)
+
+if __name__ == "__main__":
+    import ctypes
+    import random
+    import timeit
+
+    from .command_batch import command_batch
+
+    def legacy_cdb(command):
+        # 以前の executor と同じ組み立て方
+        ata_pt = ATA_PASS_THROUGH_32()
+        ata_pt.extend = command.ext_command
+        ata_pt.t_type = True
+        ata_pt.t_dir = command.protocol.is_read_xfer()
+        ata_pt.byt_blok = not command.is_512_block
+        ata_pt.t_length = 0b11
+        ata_pt.protocol = ATA_PT_PROTOCOL[command.protocol]
+        ata_pt.features = command.feature
+        ata_pt.sector_count = command.count
+        ata_pt.lba = command.lba
+        ata_pt.device = command.device
+        ata_pt.command = command.command
+        if command.ext_command:
+            ata_pt.icc = command.icc
+            ata_pt.auxiliary = command.auxiliary
+        return (ctypes.c_ubyte * 32)(*ata_pt.cdb())
+
+    commands = [ATA_COMMAND(
+        feature=0x8,
+        count=(i % 32) << 3,
+        lba=random.randint(0, 0x00FF_FFFF) * 8,
+        device=0x40,
+        command=random.choice((0x60, 0x61)),
+        protocol=random.choice((xfer_protocol.read_fpdma, xfer_protocol.write_fpdma)),
+        transfer_length=4096,
+    ) for i in range(10000)]
+    commands.append(ATA_COMMAND(feature=0x1, count=0x8, lba=0x0ABC_DEF0, device=0x40, command=0xC8,
+                                protocol=xfer_protocol.read_dma, ext_command=False))
+
+    slot = (ctypes.c_ubyte * 32)()
+    for command in commands:
+        pack_ata_command_into(slot, 0, command)
+        assert bytes(slot) == bytes(legacy_cdb(command)), command
+    columns = {name: [getattr(c, name) for c in commands] for name in
+               ('lba', 'feature', 'count', 'icc', 'auxiliary', 'device', 'command', 'transfer_length', 'ext_command')}
+    batch = command_batch.from_columns(protocol=[c.protocol.value for c in commands], **columns)
+    cdbs = batch.cdbs()
+    assert all(cdbs[i * 32:(i + 1) * 32] == bytes(legacy_cdb(c)) for i, c in enumerate(commands))
+
+    n = len(commands)
+    legacy = min(timeit.repeat(lambda: [legacy_cdb(c) for c in commands], number=1, repeat=5)) / n
+    direct = min(timeit.repeat(lambda: [pack_ata_command_into(slot, 0, c) for c in commands], number=1, repeat=5)) / n
+    arena = bytearray(32 * n)
+    batched = min(timeit.repeat(lambda: batch.cdbs(arena), number=1, repeat=5)) / n
+    print(f"ATA_PASS_THROUGH_32.cdb() : {legacy * 1e9:8.0f} ns/CDB")
+    print(f"pack_ata_command_into()   : {direct * 1e9:8.0f} ns/CDB ({legacy / direct:.1f}x)")
+    print(f"command_batch.cdbs()      : {batched * 1e9:8.0f} ns/CDB ({legacy / batched:.1f}x)")
@@ -0,0 +1,67 @@
+import ctypes
+import fcntl
+import os
+import sys
+
+from .ata_pass_through import ATA_PASS_THROUGH_16
+from .ata_transport import SG_IO, SG_DXFER_FROM_DEV, SG_IO_HDR
+
+def send_ata_pass_through(dev_path):
+    cdb_obj = ATA_PASS_THROUGH_16()
+    cdb_obj.protocol = 12 # FPDMA
+    cdb_obj.extend = 1
+    cdb_obj.ck_cond = 1  # Check condition
+    cdb_obj.t_dir = 1  # Device -> Host
+    cdb_obj.byt_blok = 1
+    cdb_obj.t_length = 2  # Transfer length in 512-byte blocks
+
+    cdb_obj.features = 0x8
+    cdb_obj.sector_count = 0
+    cdb_obj.lba = 0x100
+
+    cdb_obj.device = 0x00
+    cdb_obj.command = 0x60
+    cdb_obj.control = 0
+
+    cdb_bytes = cdb_obj.to_bytes()
+    print_cdb(cdb_bytes)
+    cdb = (ctypes.c_ubyte * 16)(*cdb_bytes)
+
+    sense = (ctypes.c_ubyte * 32)()
+    data = (ctypes.c_ubyte * 512)()  # 実際の転送先（未使用の場合あり）
+
+    hdr = SG_IO_HDR()
+    hdr.interface_id = ord('S')
+    hdr.dxfer_direction = SG_DXFER_FROM_DEV
+    hdr.cmd_len = 16
+    hdr.mx_sb_len = 32
+    hdr.dxfer_len = 512
+    hdr.dxferp = ctypes.cast(data, ctypes.c_void_p)
+    hdr.cmdp = ctypes.cast(cdb, ctypes.c_void_p)
+    hdr.sbp = ctypes.cast(sense, ctypes.c_void_p)
+    hdr.timeout = 2000  # ms
+    hdr.flags = 0
+
+    fd = os.open(dev_path, os.O_RDONLY | os.O_DIRECT)
+    try:
+        for _ in range(1):
+            fcntl.ioctl(fd, SG_IO, hdr)
+            print("Command sent.")
+            print("Status:", hdr.status)
+            print("Sense:", bytes(sense).hex())
+            print("Data (first 64 bytes):", bytes(data[:64]).hex())
+            print("Data (ASCII) :", ''.join(chr(b) if 32 <= b < 127 else '.' for b in data[:64]))
+    except Exception as e:
+        print("Error:", e)
+    finally:
+        os.close(fd)
+
+def print_cdb(cdb_bytes: bytes | bytearray):
+    if len(cdb_bytes) != 16:
+        print(f"Warning: CDB length is {len(cdb_bytes)}, expected 16 bytes")
+
+    hex_str = ' '.join(f"{b:02X}" for b in cdb_bytes)
+    print(f"CDB (16 bytes): {hex_str}")
+
+if __name__ == "__main__":
+    send_ata_pass_through(sys.argv[1] if len(sys.argv) > 1 else "/dev/sda")  # 適宜変更してください
@@ -0,0 +1,343 @@
+import ctypes
+import errno
+import fcntl
+import os
+import select
+import threading
+from collections import deque
+from time import perf_counter_ns
+
+SG_IO = 0x2285
+SG_SCSI_RESET = 0x2284
+SG_SCSI_RESET_DEVICE = 1
+SG_MAX_QUEUE = 16  # sg ドライバの 1 fd あたりの最大キュー数
+
+SG_DXFER_NONE = -1
+SG_DXFER_TO_DEV = -2  # Host → Device
+SG_DXFER_FROM_DEV = -3  # Device → Host
+
+class SG_IO_HDR(ctypes.Structure):
+    _fields_ = [
+        ("interface_id", ctypes.c_int),
+        ("dxfer_direction", ctypes.c_int),
+        ("cmd_len", ctypes.c_ubyte),
+        ("mx_sb_len", ctypes.c_ubyte),
+        ("iovec_count", ctypes.c_ushort),
+        ("dxfer_len", ctypes.c_uint),
+        ("dxferp", ctypes.c_void_p),
+        ("cmdp", ctypes.c_void_p),
+        ("sbp", ctypes.c_void_p),
+        ("timeout", ctypes.c_uint),
+        ("flags", ctypes.c_uint),
+        ("pack_id", ctypes.c_int),
+        ("usr_ptr", ctypes.c_void_p),
+        ("status", ctypes.c_ubyte),
+        ("masked_status", ctypes.c_ubyte),
+        ("msg_status", ctypes.c_ubyte),
+        ("sb_len_wr", ctypes.c_ubyte),
+        ("host_status", ctypes.c_ushort),
+        ("driver_status", ctypes.c_ushort),
+        ("resid", ctypes.c_int),
+        ("duration", ctypes.c_uint),
+        ("info", ctypes.c_uint),
+    ]
+
+class sg_io_v4(ctypes.Structure):
+    _fields_ = [
+        ('guard', ctypes.c_int32),
+        ('protocol', ctypes.c_uint32),
+        ('subprotocol', ctypes.c_uint32),
+        ('request_len', ctypes.c_uint32),
+        ('request', ctypes.c_uint64),
+        ('request_tag', ctypes.c_uint64),
+        ('request_attr', ctypes.c_uint32),
+        ('request_priority', ctypes.c_uint32),
+        ('request_extra', ctypes.c_uint32),
+        ('max_response_len', ctypes.c_uint32),
+        ('response', ctypes.c_uint64),
+        ('dout_iovec_count', ctypes.c_uint32),
+        ('dout_xfer_len', ctypes.c_uint32),
+        ('din_iovec_count', ctypes.c_uint32),
+        ('din_xfer_len', ctypes.c_uint32),
+        ('dout_xferp', ctypes.c_uint64),
+        ('din_xferp', ctypes.c_uint64),
+        ('timeout', ctypes.c_uint32),
+        ('flags', ctypes.c_uint32),
+        ('usr_ptr', ctypes.c_uint64),
+        ('spare_in', ctypes.c_uint32),
+        ('driver_status', ctypes.c_uint32),
+        ('transport_status', ctypes.c_uint32),
+        ('device_status', ctypes.c_uint32),
+        ('retry_delay', ctypes.c_uint32),
+        ('info', ctypes.c_uint32),
+        ('duration', ctypes.c_uint32),
+        ('response_len', ctypes.c_uint32),
+        ('din_resid', ctypes.c_int32),
+        ('dout_resid', ctypes.c_int32),
+        ('generated_tag', ctypes.c_uint64),
+        ('spare_out', ctypes.c_uint32),
+        ('padding', ctypes.c_uint32),
+    ]
+
+class sg_iovec(ctypes.Structure):
+    _fields_ = [
+        ('iov_base', ctypes.c_void_p),
+        ('iov_len', ctypes.c_size_t),
+    ]
+
+def build_iovec(buffers, writable=True):
+    # 呼び出し元のバッファをそのまま DMA 先にする iovec 配列を作る。
+    # 戻り値の pins は転送が終わるまで保持する (バッファのサイズ変更や解放を防ぐ)
+    pins = []
+    iovec = (sg_iovec * len(buffers))()
+    total = 0
+    for index, buffer in enumerate(buffers):
+        view = memoryview(buffer).cast('B')
+        if view.readonly:
+            if writable:
+                raise ValueError(f"transfer buffer {index} is read-only")
+            pinned = (ctypes.c_ubyte * len(view)).from_buffer_copy(view)  # 読み取り専用の書き込みデータだけはコピーする
+        else:
+            pinned = (ctypes.c_ubyte * len(view)).from_buffer(view)
+        pins.append(pinned)
+        iovec[index].iov_base = ctypes.addressof(pinned)
+        iovec[index].iov_len = len(view)
+        total += len(view)
+    return iovec, pins, total
+
+class io_request:
+    # 1 コマンド分の ctypes バッファと完了ステータスをまとめたもの
+    __slots__ = (
+        'command', 'cdb', 'sense', 'data', 'data_len', 'is_read', 'timeout', 'pack_id', 'header', 'future', 'slot',
+        'iovec', 'buffers', 'error',
+        'submit_ns', 'issue_ns', 'complete_ns', 'driver_status', 'transport_status', 'device_status', 'duration', 'resid',
+    )
+
+    def __init__(self, command, cdb, sense, data, data_len, is_read, timeout=5000):
+        self.command = command
+        self.cdb = cdb
+        self.sense = sense
+        self.data = data
+        self.data_len = data_len
+        self.is_read = is_read
+        self.timeout = timeout
+        self.pack_id = 0
+        self.header = None
+        self.future = None
+        self.slot = None
+        self.iovec = None
+        self.buffers = None
+        self.error = None  # 発行できなかったときの例外 (reap で完了扱いにして返す)
+        self.submit_ns = 0
+        self.issue_ns = 0
+        self.complete_ns = 0
+        self.driver_status = 0
+        self.transport_status = 0
+        self.device_status = 0
+        self.duration = 0
+        self.resid = 0
+
+# transport は次の属性/メソッドを持てば executor に差し込める
+#   name, queued, close()
+#   queued = False: execute(request) で同期実行する (executor がワーカースレッドから呼ぶ)
+#   queued = True : submit(request) で投入し、reap(timeout_ms) / reap_fd(fd) で完了した request を返す。
+#                   後から発行しようとして失敗した request は error に例外を入れて同じく返す。
+#                   fds は完了時に読み込み可能になる fd の一覧 (asyncio の add_reader 用)
+#   reset() は任意。デバイスをリセットし、発行中のコマンドをエラーで返させる (command_watchdog の reset policy)
+#   iovec = True なら request.iovec (scatter-gather) を渡せる。False の transport には executor が
+#   連続バッファ経由で渡す (ない場合は False とみなす)
+class bsg_transport:
+    # /dev/bsg/* への同期 SG_IO (sg_io_v4)
+    name = 'bsg'
+    queued = False
+    iovec = False  # bsg は din/dout_iovec_count を見ずに xferp を 1 本の連続バッファとして転送する
+
+    def __init__(self, dev_path):
+        self.dev_path = dev_path
+        self.fd = os.open(dev_path, os.O_RDWR | os.O_NONBLOCK)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def execute(self, request: io_request):
+        sg_io = sg_io_v4()
+        sg_io.guard = ord('Q')
+        sg_io.protocol = 0  # BSG_PROTOCOL_SCSI
+        sg_io.subprotocol = 0  # BSG_SUB_PROTOCOL_SCSI_COMMAND
+        sg_io.request_len = len(request.cdb)  # CDB length
+        sg_io.request = ctypes.addressof(request.cdb)  # CDB buffer address
+        sg_io.max_response_len = len(request.sense)  # Sense buffer length
+        sg_io.response = ctypes.addressof(request.sense)  # Sense buffer address
+        sg_io.timeout = request.timeout
+        sg_io.flags = 0
+        if request.iovec is not None:
+            # iovec 配列そのものが転送先/転送元になってしまうので受け付けない
+            raise OSError(errno.EOPNOTSUPP, "bsg transport cannot transfer through an iovec")
+        if request.data_len:
+            if request.is_read:
+                sg_io.din_xfer_len = request.data_len
+                sg_io.din_xferp = ctypes.addressof(request.data)
+            else:
+                sg_io.dout_xfer_len = request.data_len
+                sg_io.dout_xferp = ctypes.addressof(request.data)
+
+        request.issue_ns = perf_counter_ns()
+        fcntl.ioctl(self.fd, SG_IO, sg_io)
+        request.complete_ns = perf_counter_ns()
+
+        request.driver_status = sg_io.driver_status
+        request.transport_status = sg_io.transport_status
+        request.device_status = sg_io.device_status
+        request.duration = sg_io.duration
+        request.resid = sg_io.din_resid if request.is_read else sg_io.dout_resid
+
+class null_transport:
+    # デバイスに触れずに即座に正常完了させる。Python 側のオーバーヘッド計測用
+    name = 'null'
+    queued = False
+    iovec = True  # データには触れない
+
+    def __init__(self, dev_path=None):
+        self.dev_path = dev_path
+        self.fd = None
+
+    def close(self):
+        pass
+
+    def execute(self, request: io_request):
+        request.issue_ns = perf_counter_ns()
+        request.driver_status = 0
+        request.transport_status = 0
+        request.device_status = 0
+        request.duration = 0
+        request.resid = 0
+        request.complete_ns = perf_counter_ns()
+
+class sg_v3_transport:
+    # /dev/sgN の非同期 write()/read() インターフェース。完了は pack_id で突き合わせる
+    name = 'sg'
+    queued = True
+    iovec = True  # sg v3 は iovec_count を見て iovec 配列をたどる
+
+    def __init__(self, dev_path, queue_depth=32):
+        self.dev_path = dev_path
+        self.queue_depth = queue_depth
+        # 1 fd あたり SG_MAX_QUEUE 個までしか積めないので、深さに合わせて fd を複数開く
+        fd_count = (queue_depth + SG_MAX_QUEUE - 1) // SG_MAX_QUEUE
+        self.fds = [os.open(dev_path, os.O_RDWR | os.O_NONBLOCK) for _ in range(fd_count)]
+        self.fd = self.fds[0]
+        self.fd_load = {fd: 0 for fd in self.fds}
+        self.in_flight = {}
+        self.pending = deque()
+        self.next_pack_id = 0
+        self.lock = threading.Lock()
+        self.poller = select.poll()
+        for fd in self.fds:
+            self.poller.register(fd, select.POLLIN)
+
+    def close(self):
+        for fd in self.fds:
+            os.close(fd)
+        self.fds = []
+        self.fd = None
+
+    def _header(self, request: io_request):
+        hdr = SG_IO_HDR()
+        hdr.interface_id = ord('S')
+        hdr.cmd_len = len(request.cdb)
+        hdr.mx_sb_len = len(request.sense)
+        hdr.cmdp = ctypes.addressof(request.cdb)
+        hdr.sbp = ctypes.addressof(request.sense)
+        hdr.timeout = request.timeout
+        hdr.flags = 0
+        if request.data_len:
+            hdr.dxfer_direction = SG_DXFER_FROM_DEV if request.is_read else SG_DXFER_TO_DEV
+            hdr.dxfer_len = request.data_len
+            if request.iovec is not None:
+                hdr.iovec_count = len(request.iovec)
+                hdr.dxferp = ctypes.addressof(request.iovec)
+            else:
+                hdr.dxferp = ctypes.addressof(request.data)
+        else:
+            hdr.dxfer_direction = SG_DXFER_NONE
+        hdr.pack_id = request.pack_id
+        return hdr
+
+    @staticmethod
+    def _fill_status(request: io_request, hdr):
+        request.driver_status = hdr.driver_status
+        request.transport_status = hdr.host_status
+        request.device_status = hdr.status
+        request.duration = hdr.duration
+        request.resid = hdr.resid
+
+    def execute(self, request: io_request):
+        hdr = self._header(request)
+        request.issue_ns = perf_counter_ns()
+        fcntl.ioctl(self.fd, SG_IO, hdr)
+        request.complete_ns = perf_counter_ns()
+        self._fill_status(request, hdr)
+
+    def submit(self, request: io_request):
+        with self.lock:
+            request.pack_id = self.next_pack_id
+            self.next_pack_id = (self.next_pack_id + 1) & 0x7FFF_FFFF
+            if len(self.in_flight) < self.queue_depth:
+                self._write(request)
+            else:
+                self.pending.append(request)
+
+    def _write(self, request: io_request):
+        fd = min(self.fds, key=self.fd_load.__getitem__)
+        request.header = self._header(request)
+        request.issue_ns = perf_counter_ns()
+        os.write(fd, request.header)
+        self.fd_load[fd] += 1
+        self.in_flight[request.pack_id] = (fd, request)
+
+    def reap(self, timeout=None):
+        # timeout は ms。None なら完了が来るまで待つ、0 ならポーリングのみ
+        completed = []
+        for fd, _ in self.poller.poll(timeout):
+            completed.extend(self.reap_fd(fd))
+        return completed
+
+    def reap_fd(self, fd):
+        completed = []
+        hdr = SG_IO_HDR()
+        with self.lock:
+            while True:
+                hdr.interface_id = ord('S')
+                hdr.pack_id = -1  # 任意の完了を受け取る
+                try:
+                    os.readv(fd, [hdr])
+                except OSError as e:
+                    if e.errno == errno.EAGAIN:
+                        break
+                    raise
+                complete_ns = perf_counter_ns()
+                owner, request = self.in_flight.pop(hdr.pack_id)
+                request.complete_ns = complete_ns
+                self.fd_load[owner] -= 1
+                self._fill_status(request, hdr)
+                request.header = None
+                completed.append(request)
+            while self.pending and len(self.in_flight) < self.queue_depth:
+                request = self.pending.popleft()
+                try:
+                    self._write(request)
+                except OSError as e:
+                    # この request だけを失敗として返し、残りの発行と刈り取りは続ける
+                    request.error = e
+                    completed.append(request)
+        return completed
+
+    def reset(self):
+        # LUN リセット。発行中のコマンドは DID_RESET などで reap() から返ってくる
+        fcntl.ioctl(self.fd, SG_SCSI_RESET, ctypes.c_int(SG_SCSI_RESET_DEVICE))
+
+    def outstanding(self):
+        with self.lock:
+            return len(self.in_flight) + len(self.pending)
@@ -0,0 +1,157 @@
+import argparse
+import errno
+import sys
+import threading
+import time
+
+import numpy as np
+
+from .async_bsg_executer import bsg_with_ata_command_executor
+from .ata_command import ATA_COMMAND, xfer_protocol
+
+DATA_SET_MANAGEMENT = 0x06
+DSM_TRIM = 0x01  # FEATURE bit 0
+DSM_MAX_RANGE = 0xFFFF  # 1 エントリで指定できる最大セクタ数
+DSM_ENTRIES_PER_BLOCK = 64  # 512 バイトのペイロードブロックに 8 バイトのエントリが 64 個
+DSM_BLOCK_SIZE = 512
+
+def normalize_extents(lbas, lengths, max_range=DSM_MAX_RANGE):
+    # (lba, length) の配列を LBA 順に並べ、重なる/隣接する範囲を結合してから max_range セクタずつに切り分ける
+    lbas = np.asarray(lbas, dtype=np.int64).ravel()
+    lengths = np.asarray(lengths, dtype=np.int64).ravel()
+    if lbas.shape != lengths.shape:
+        raise ValueError(f"lbas and lengths must have the same length, got {len(lbas)} and {len(lengths)}")
+    if (lbas < 0).any() or (lengths < 0).any():
+        raise ValueError("lbas and lengths must not be negative")
+    keep = lengths > 0
+    lbas, lengths = lbas[keep], lengths[keep]
+    if not len(lbas):
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    order = np.argsort(lbas, kind='stable')
+    starts = lbas[order]
+    ends = starts + lengths[order]
+    reach = np.maximum.accumulate(ends)  # ここまでの範囲が届く最大の終端
+    first = np.ones(len(starts), dtype=bool)
+    first[1:] = starts[1:] > reach[:-1]
+    run_starts = starts[first]
+    run_ends = np.maximum.reduceat(ends, np.flatnonzero(first))
+    pieces = -(-(run_ends - run_starts) // max_range)
+    offsets = np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+    out_lbas = np.repeat(run_starts, pieces) + offsets * max_range
+    out_lengths = np.minimum(np.repeat(run_ends, pieces) - out_lbas, max_range)
+    return out_lbas, out_lengths
+
+def pack_dsm_ranges(lbas, lengths):
+    # 正規化済みの範囲を LBA(47:0) | 長さ(63:48) のエントリに詰め、512 バイト境界までゼロで埋める
+    entries = -(-len(lbas) // DSM_ENTRIES_PER_BLOCK) * DSM_ENTRIES_PER_BLOCK
+    payload = np.zeros(entries, dtype='<u8')
+    payload[:len(lbas)] = np.asarray(lbas, np.uint64) | (np.asarray(lengths, np.uint64) << np.uint64(48))
+    return payload
+
+class dsm_trimmer:
+    # 大量の範囲をまとめて DATA SET MANAGEMENT (TRIM) で解放する。
+    # 1 コマンドに blocks_per_command 個のペイロードブロック (= 64 * blocks_per_command 範囲) を詰め、in_flight 個まで並行で出す
+    def __init__(self, executor: bsg_with_ata_command_executor, blocks_per_command=None, in_flight=None, max_lba=None):
+        capabilities = executor.capabilities
+        if capabilities is not None:
+            if not capabilities.trim:
+                raise ValueError("device does not support DATA SET MANAGEMENT TRIM")
+            blocks_per_command = blocks_per_command or capabilities.dsm_max_blocks
+            max_lba = capabilities.max_lba if max_lba is None else max_lba
+        blocks_per_command = blocks_per_command or 1  # IDENTIFY word 105 が 0 のときは 1 ブロックずつ
+        if not 1 <= blocks_per_command <= 0xFFFF:
+            raise ValueError(f"blocks_per_command must be 1-65535, got {blocks_per_command}")
+        self.executor = executor
+        self.blocks_per_command = blocks_per_command
+        self.in_flight = in_flight or executor.queue_depth
+        self.max_lba = max_lba
+        self.stats = {'ranges': 0, 'sectors': 0, 'commands': 0}
+
+    def _command(self, payload):
+        blocks = len(payload) * 8 // DSM_BLOCK_SIZE
+        return ATA_COMMAND(
+            feature=DSM_TRIM,
+            count=blocks,
+            device=0x40,
+            command=DATA_SET_MANAGEMENT,
+            protocol=xfer_protocol.write_dma,
+            transfer_length=blocks * DSM_BLOCK_SIZE,
+            is_512_block=True,  # ペイロードは論理セクタ長に関係なく 512 バイト単位
+            transfer_data=payload.tobytes(),
+        )
+
+    def trim(self, lbas, lengths):
+        lbas, lengths = normalize_extents(lbas, lengths)
+        if self.max_lba is not None and len(lbas) and int(lbas[-1] + lengths[-1]) > self.max_lba + 1:
+            raise ValueError(f"range ends beyond max LBA {self.max_lba:#x}")
+        payload = pack_dsm_ranges(lbas, lengths)
+        per_command = self.blocks_per_command * DSM_ENTRIES_PER_BLOCK
+        window = threading.BoundedSemaphore(self.in_flight)
+        failed = []
+
+        def on_done(future, first):
+            window.release()
+            if future.exception() is not None or not future.result().is_good():
+                failed.append((first, future))
+
+        for first in range(0, len(payload), per_command):
+            window.acquire()
+            future = self.executor.submit_command(self._command(payload[first:first + per_command]))
+            future.add_done_callback(lambda f, first=first: on_done(f, first))
+            self.stats['commands'] += 1
+        for _ in range(self.in_flight):
+            window.acquire()  # 全部取れたら完了コールバックまで終わっている
+        self.stats['ranges'] += len(lbas)
+        self.stats['sectors'] += int(lengths.sum())
+        if failed:
+            first, future = min(failed, key=lambda item: item[0])
+            if future.exception() is not None:
+                raise future.exception()
+            raise OSError(errno.EIO, f"TRIM failed for ranges starting at LBA {int(lbas[first]):#x} "
+                                     f"({len(failed)} of {self.stats['commands']} commands)")
+        return len(lbas)
+
+    def trim_range(self, start_lba, end_lba):
+        # start_lba から end_lba (含まない) までをまとめて解放する (ベンチマーク前のプリコンディション用)
+        return self.trim([start_lba], [end_lba - start_lba])
+
+def read_extents(path):
+    # 1 行に "lba length" (10 進/16 進) の並んだテキストを読む
+    with open(path) as f:
+        pairs = [line.split()[:2] for line in f if line.strip() and not line.lstrip().startswith('#')]
+    if not pairs:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    values = np.array([[int(lba, 0), int(length, 0)] for lba, length in pairs], dtype=np.int64)
+    return values[:, 0], values[:, 1]
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="deallocate LBA ranges with DATA SET MANAGEMENT (TRIM)")
+    parser.add_argument('device', help="device node (/dev/bsg/H:C:T:L, /dev/sgN)")
+    parser.add_argument('--transport', default='bsg', choices=('bsg', 'sg'))
+    parser.add_argument('--start-lba', type=lambda text: int(text, 0), default=0)
+    parser.add_argument('--end-lba', type=lambda text: int(text, 0), default=None,
+                        help="first LBA not trimmed (default: end of the drive)")
+    parser.add_argument('--extents', default=None, help="file of 'lba length' lines to trim instead of a range")
+    parser.add_argument('--blocks', type=int, default=None, help="512-byte payload blocks per command (default: probed)")
+    parser.add_argument('--in-flight', type=int, default=8)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    with bsg_with_ata_command_executor(args.device, queue_depth=args.in_flight, transport=args.transport,
+                                       probe=True) as executor:
+        trimmer = dsm_trimmer(executor, args.blocks, args.in_flight)
+        start = time.perf_counter()
+        if args.extents:
+            trimmer.trim(*read_extents(args.extents))
+        else:
+            end_lba = executor.capabilities.max_lba + 1 if args.end_lba is None else args.end_lba
+            trimmer.trim_range(args.start_lba, end_lba)
+        elapsed = time.perf_counter() - start
+    stats = trimmer.stats
+    print(f"{stats['sectors']} sectors in {stats['ranges']} ranges, {stats['commands']} commands, {elapsed:.3f}s",
+          file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+import numpy as np
+
+from .ata_command import ATA_COMMAND, FIELD_LIMITS, xfer_protocol
+from .ata_pass_through import ATA_PT_PROTOCOL
+
+# 1 コマンド 1 レコードの構造化配列。protocol は xfer_protocol.value を持つ
+COMMAND_DTYPE = np.dtype([
+    ('feature', np.uint16),
+    ('count', np.uint16),
+    ('lba', np.uint64),
+    ('icc', np.uint8),
+    ('auxiliary', np.uint32),
+    ('device', np.uint8),
+    ('command', np.uint8),
+    ('protocol', np.uint8),
+    ('transfer_length', np.uint32),
+    ('is_512_block', np.bool_),
+    ('ext_command', np.bool_),
+])
+LIMITED_FIELDS = ('feature', 'count', 'lba', 'icc', 'auxiliary', 'device', 'command')
+
+_PROTOCOLS = {protocol.value: protocol for protocol in xfer_protocol}
+_DIRECTED_VALUES = np.array([protocol.value for protocol in xfer_protocol
+                             if protocol not in (xfer_protocol.pio, xfer_protocol.dma, xfer_protocol.fpdma)])
+_READ_VALUES = np.array([protocol.value for protocol in xfer_protocol if protocol.is_read_xfer()])
+_new_command = ATA_COMMAND.__new__
+
+# ATA PASS-THROUGH(32) の CDB を 1 行とみなした構造化型 (ata_pass_through.ATA_PT32_CDB と同じ配置)
+CDB_DTYPE = np.dtype({
+    'names': ['opcode', 'additional_length', 'service_action', 'byte1', 'byte2', 'lba_high', 'lba_low',
+              'feature', 'count', 'device', 'command', 'icc', 'auxiliary'],
+    'formats': ['u1', 'u1', '>u2', 'u1', 'u1', '>u2', '>u4', '>u2', '>u2', 'u1', 'u1', 'u1', '>u4'],
+    'offsets': [0, 7, 8, 10, 11, 14, 16, 20, 22, 24, 25, 27, 28],
+    'itemsize': 32,
+})
+# protocol の値 → PROTOCOL フィールド (対応しないものは 0)、読み込み方向か
+_PT_PROTOCOL = np.zeros(max(protocol.value for protocol in xfer_protocol) + 1, np.uint8)
+for _protocol, _value in ATA_PT_PROTOCOL.items():
+    _PT_PROTOCOL[_protocol.value] = _value
+_IS_READ = np.zeros(len(_PT_PROTOCOL), np.uint8)
+_IS_READ[_READ_VALUES] = 1
+
+def pack_ata_commands(records, out=None):
+    # COMMAND_DTYPE の行をまとめて 32 byte 間隔の CDB 列に詰める (列ごとの numpy 演算だけで、行ごとの Python 処理なし)。
+    # out (bytearray, ctypes 配列など書き込めるバッファ) を渡すとその先頭に書く
+    count = len(records)
+    if out is None:
+        out = bytearray(CDB_DTYPE.itemsize * count)
+    raw = np.frombuffer(out, np.uint8, CDB_DTYPE.itemsize * count)
+    raw[:] = 0
+    cdbs = raw.view(CDB_DTYPE)
+    protocol = records['protocol']
+    pt_protocol = _PT_PROTOCOL[protocol]
+    if count and not pt_protocol.all():
+        index = int(np.argmin(pt_protocol))
+        raise ValueError(f"Unsupported transfer protocol at index {index}: {_PROTOCOLS.get(int(protocol[index]))}")
+    ext = records['ext_command']
+    lba = records['lba']
+    cdbs['opcode'] = 0x7F
+    cdbs['additional_length'] = 0x18
+    cdbs['service_action'] = 0x1FF0
+    cdbs['byte1'] = (pt_protocol << 1) | ext
+    # T_TYPE=1, T_LENGTH=TPSIU、BYT_BLOK は is_512_block の逆
+    cdbs['byte2'] = 0x13 | (_IS_READ[protocol] << 3) | ((~records['is_512_block']).astype(np.uint8) << 2)
+    cdbs['command'] = records['command']
+    # 48 bit と 28 bit で詰め方が違う (ata_pass_through.pack_ata_command_into と同じ)
+    cdbs['lba_high'] = np.where(ext, lba >> np.uint64(32), 0)
+    cdbs['lba_low'] = np.where(ext, lba & np.uint64(0xFFFF_FFFF), lba & np.uint64(0x00FF_FFFF))
+    cdbs['feature'] = np.where(ext, records['feature'], records['feature'] & 0xFF)
+    cdbs['count'] = np.where(ext, records['count'], records['count'] & 0xFF)
+    cdbs['device'] = np.where(ext, records['device'],
+                              ((lba >> np.uint64(24)) & np.uint64(0x0F)) << np.uint64(4) | (records['device'] & 0x0F))
+    cdbs['icc'] = np.where(ext, records['icc'], 0)
+    cdbs['auxiliary'] = np.where(ext, records['auxiliary'], 0)
+    return out
+
+class command_batch:
+    # ATA_COMMAND の列指向版。検証は列単位でまとめて行い、executor へは submit_batch() で一括投入する
+    def __init__(self, size=0, records=None):
+        if records is None:
+            records = np.zeros(size, COMMAND_DTYPE)
+            records['protocol'] = xfer_protocol.non_data.value
+            records['ext_command'] = True
+        self.records = records
+
+    @classmethod
+    def from_columns(cls, lba, feature=0, count=0, icc=0, auxiliary=0, device=0, command=0,
+                     protocol=xfer_protocol.non_data, transfer_length=0, is_512_block=False, ext_command=True,
+                     validate=True):
+        # 各引数はスカラーか同じ長さの配列 (スカラーは全行に展開する)
+        if isinstance(protocol, xfer_protocol):
+            protocol = protocol.value
+        columns = {
+            'feature': feature, 'count': count, 'lba': lba, 'icc': icc, 'auxiliary': auxiliary, 'device': device,
+            'command': command, 'protocol': protocol, 'transfer_length': transfer_length,
+            'is_512_block': is_512_block, 'ext_command': ext_command,
+        }
+        arrays = dict(zip(columns, np.broadcast_arrays(*(np.asarray(value) for value in columns.values()))))
+        size = arrays['lba'].size
+        batch = cls(size)
+        for name, array in arrays.items():
+            array = array.reshape(size)
+            if validate and array.dtype.kind in 'iu' and size:
+                # 構造化配列へ入れると負数や桁あふれが丸められるので、その前に調べる
+                limit = np.iinfo(COMMAND_DTYPE[name]).max
+                if array.min() < 0 or array.max() > limit:
+                    index = int(np.flatnonzero((array < 0) | (array > limit))[0])
+                    raise ValueError(f"{name} out of range at index {index}, got {array[index]}")
+            batch.records[name] = array
+        if validate:
+            batch.validate()
+        return batch
+
+    @classmethod
+    def concatenate(cls, batches):
+        return cls(records=np.concatenate([batch.records for batch in batches]))
+
+    def validate(self):
+        # ATA_COMMAND.__post_init__ と同じ条件を列ごとに調べる
+        records = self.records
+        ext = records['ext_command']
+        for position, name in enumerate(LIMITED_FIELDS):
+            limit = np.where(ext, FIELD_LIMITS[True][position], FIELD_LIMITS[False][position])
+            bad = records[name] > limit
+            if bad.any():
+                index = int(np.argmax(bad))
+                bits = '48 bit' if ext[index] else '28 bit'
+                detail = f" ({bits})" if name == 'lba' else ''
+                raise ValueError(f"{name} out of range{detail} at index {index}, got {records[name][index]}")
+        bad = ~np.isin(records['protocol'], _DIRECTED_VALUES)
+        if bad.any():
+            index = int(np.argmax(bad))
+            value = int(records['protocol'][index])
+            raise ValueError(f"protocol must be specified xfer direction at index {index}, "
+                             f"got {_PROTOCOLS.get(value, value)}")
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getattr__(self, name):
+        # batch.lba などで列をそのまま参照できる
+        if name in COMMAND_DTYPE.names:
+            return self.records[name]
+        raise AttributeError(name)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.command_at(int(index))
+        return command_batch(records=self.records[index])
+
+    def is_read(self):
+        return np.isin(self.records['protocol'], _READ_VALUES)
+
+    def cdbs(self, out=None):
+        # 全行の CDB を 1 本の連続した領域に詰める
+        return pack_ata_commands(self.records, out)
+
+    def data_offsets(self):
+        # data アリーナ上での各コマンドの開始オフセット (transfer_length を詰めて並べる)
+        lengths = self.records['transfer_length'].astype(np.int64)
+        return np.cumsum(lengths) - lengths
+
+    def nbytes(self):
+        return int(self.records['transfer_length'].sum(dtype=np.int64))
+
+    def command_at(self, index):
+        return next(self.commands(start=index, stop=index + 1))
+
+    def commands(self, data=None, start=0, stop=None):
+        # 検証済みの行から ATA_COMMAND を作る (__post_init__ は通さない)。
+        # data を渡すと data_offsets() の位置をそのまま転送先/転送元にする (transfer_buffers)。
+        # iovec を使えない transport (bsg) では executor がスロット経由でコピーする
+        records = self.records[start:stop]
+        columns = [records[name].tolist() for name in COMMAND_DTYPE.names]
+        arena = memoryview(data).cast('B') if data is not None else None
+        offsets = self.data_offsets()[start:stop].tolist() if arena is not None else None
+        zeros = {}
+        for row, (feature, count, lba, icc, auxiliary, device, code, protocol, length, is_512_block,
+                  ext_command) in enumerate(zip(*columns)):
+            protocol = _PROTOCOLS[protocol]
+            command = _new_command(ATA_COMMAND)
+            command.feature = feature
+            command.count = count
+            command.lba = lba
+            command.icc = icc
+            command.auxiliary = auxiliary
+            command.device = device
+            command.command = code
+            command.protocol = protocol
+            command.transfer_length = length
+            command.is_512_block = is_512_block
+            command.ext_command = ext_command
+            command.transfer_buffers = None
+            command.timeout_ms = None
+            command.transfer_data = b''
+            if length:
+                if arena is not None:
+                    command.transfer_buffers = [arena[offsets[row]:offsets[row] + length]]
+                elif not protocol.is_read_xfer():
+                    # データ無しの書き込みはゼロを送る (同じ長さは同じ bytes を共有)
+                    if length not in zeros:
+                        zeros[length] = bytes(length)
+                    command.transfer_data = zeros[length]
+            yield command
@@ -0,0 +1,78 @@
+import struct
+import threading
+import time
+
+# ファイル先頭のヘッダ: magic, 版, レコード長, 記録開始時の time_ns() と perf_counter_ns()
+TRACE_MAGIC = b'ATATRACE'
+TRACE_VERSION = 1
+TRACE_HEADER = struct.Struct('<8sHHqq12x')
+
+# 1 コマンド 1 レコード (64 バイト固定)
+#   submit_ns, issue_ns, complete_ns, lba, auxiliary, transfer_length, duration,
+#   feature, count, driver_status, transport_status, icc, device, command, protocol, tag, device_status, flags
+TRACE_RECORD = struct.Struct('<QQQQIIIHHHHBBBBBBB5x')
+TRACE_FIELDS = (
+    'submit_ns', 'issue_ns', 'complete_ns', 'lba', 'auxiliary', 'transfer_length', 'duration',
+    'feature', 'count', 'driver_status', 'transport_status', 'icc', 'device', 'command', 'protocol', 'tag',
+    'device_status', 'flags',
+)
+TRACE_NO_TAG = 0xFF
+FLAG_512_BLOCK = 0x01
+FLAG_EXT_COMMAND = 0x02
+FLAG_FAILED = 0x04  # デバイスの完了ステータスなしで失敗した (発行できなかった、watchdog が期限切れにした)
+
+class trace_writer:
+    # 完了したコマンドをメモリ上のバッファに詰め、buffer_records 件たまるごとにまとめて書き出す
+    def __init__(self, path, buffer_records=4096):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, TRACE_RECORD.size,
+                                          time.time_ns(), time.perf_counter_ns()))
+        self.buffer = bytearray(TRACE_RECORD.size * buffer_records)
+        self.used = 0
+        self.records = 0
+        self.lock = threading.Lock()
+
+    def record(self, completion, failed=False):
+        # completion は ata_completion (ワーカー/刈り取りスレッドから呼ばれる)
+        command = completion.command
+        flags = (FLAG_512_BLOCK if command.is_512_block else 0) | (FLAG_EXT_COMMAND if command.ext_command else 0) | \
+            (FLAG_FAILED if failed else 0)
+        with self.lock:
+            if self.file is None:
+                return
+            TRACE_RECORD.pack_into(
+                self.buffer, self.used, completion.submit_ns, completion.issue_ns, completion.complete_ns,
+                command.lba, command.auxiliary, command.transfer_length, completion.duration,
+                command.feature, command.count, completion.driver_status & 0xFFFF,
+                completion.transport_status & 0xFFFF, command.icc, command.device, command.command,
+                command.protocol.value, TRACE_NO_TAG if completion.tag is None else completion.tag,
+                completion.device_status & 0xFF, flags,
+            )
+            self.used += TRACE_RECORD.size
+            self.records += 1
+            if self.used == len(self.buffer):
+                self._flush()
+
+    def _flush(self):
+        self.file.write(memoryview(self.buffer)[:self.used])
+        self.used = 0
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self._flush()
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self._flush()
+                self.file.close()
+                self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
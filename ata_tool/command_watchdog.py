@@ -0,0 +1,154 @@
+import sys
+import threading
+from time import perf_counter_ns
+
+from .ata_command import xfer_protocol
+from .ncq_tag_allocator import decode_ncq_tag
+
+WATCHDOG_POLICIES = ('report', 'fail_fast', 'abort_queue', 'reset')
+
+class command_timeout(TimeoutError):
+    # watchdog が期限切れにした (またはキューごと打ち切った) コマンドの Future に入る例外
+    def __init__(self, message, command=None, tag=None, age_ms=None):
+        super().__init__(message)
+        self.command = command
+        self.tag = tag
+        self.age_ms = age_ms
+
+class command_watchdog:
+    # executor が発行中の request を登録し、期限を過ぎたものを見つけて policy に従って処理する。
+    #   report: 報告だけ (コマンドはカーネルのタイムアウトまで待つ)
+    #   fail_fast: 期限切れのコマンドだけ command_timeout で失敗させる
+    #   abort_queue: 期限切れが出たら発行中の全コマンドを失敗させる (NCQ エラー時にデバイスがキューを捨てるのに合わせる)
+    #   reset: abort_queue に加えて transport.reset() でデバイスをリセットする
+    # 失敗させたコマンドのバッファと NCQ タグは、カーネルから実際に完了が返るまで解放しない。
+    # policy には callable(watchdog, overdue) も渡せる (overdue は report() と同じ dict のリスト)
+    def __init__(self, deadline_ms=None, policy='fail_fast', interval_ms=None, command_timeouts=None, on_overdue=None):
+        if not callable(policy) and policy not in WATCHDOG_POLICIES:
+            raise ValueError(f"policy must be one of {WATCHDOG_POLICIES} or callable, got {policy!r}")
+        self.deadline_ms = deadline_ms  # None なら executor の timeout_ms
+        self.policy = policy
+        self.interval_ms = interval_ms
+        self.command_timeouts = dict(command_timeouts or {})  # コマンドコード → 期限 (ms)
+        self.on_overdue = on_overdue
+        self.executor = None
+        self.tracked = {}  # id(request) → (request, 期限 ns, tag)
+        self.expired = {}  # 失敗させたがカーネルからはまだ返っていない request
+        self.reported = set()  # 報告済み (report policy で発行中のまま残っているもの) の id(request)
+        self.events = []  # 期限切れの報告 (report() の dict)
+        self.reset_error = None
+        self.errors = []  # check() で起きた例外 (見張りスレッドは続行する)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def attach(self, executor):
+        self.executor = executor
+        if self.deadline_ms is None:
+            self.deadline_ms = executor.timeout_ms
+        if self.interval_ms is None:
+            # 一番短い期限の 1/4 ごとに見回る (1 ms - 100 ms)
+            shortest = min([self.deadline_ms, *self.command_timeouts.values()])
+            self.interval_ms = min(max(shortest / 4, 1), 100)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        if self.thread is not None:
+            self.wakeup.set()
+            self.thread.join()
+            self.thread = None
+
+    def deadline_for(self, command):
+        # コマンド自身の timeout_ms > コマンドコードごとの期限 > 既定値
+        if command.timeout_ms is not None:
+            return command.timeout_ms
+        return self.command_timeouts.get(command.command, self.deadline_ms)
+
+    def track(self, request):
+        command = request.command
+        tag = decode_ncq_tag(command.count) if command.protocol.get_protocol() == xfer_protocol.fpdma else None
+        due = perf_counter_ns() + int(self.deadline_for(command) * 1_000_000)
+        with self.lock:
+            self.tracked[id(request)] = (request, due, tag)
+
+    def finish(self, request):
+        # 完了/破棄時に呼ぶ。既に watchdog が失敗させていた (遅れて返ってきた) なら True
+        key = id(request)
+        with self.lock:
+            if self.tracked.pop(key, None) is not None:
+                self.reported.discard(key)
+                return False
+            return self.expired.pop(key, None) is not None
+
+    def in_flight(self):
+        with self.lock:
+            return len(self.tracked)
+
+    def _run(self):
+        while not self.wakeup.wait(self.interval_ms / 1000):
+            try:
+                self.check()
+            except Exception as e:
+                # policy の処理が 1 回失敗しても見張りは止めない
+                self.errors.append(e)
+                print(f"command_watchdog: {self.policy} failed: {e!r}", file=sys.stderr)
+
+    def check(self):
+        # 期限切れを探して policy を実行する。見つかった件数を返す
+        now = perf_counter_ns()
+        with self.lock:
+            overdue = [(request, due, tag) for key, (request, due, tag) in self.tracked.items()
+                       if due <= now and key not in self.reported]
+            self.reported.update(id(request) for request, _, _ in overdue)
+        if not overdue:
+            return 0
+        reports = [self.report(request, due, tag, now) for request, due, tag in overdue]
+        self.events.extend(reports)
+        if self.on_overdue is not None:
+            self.on_overdue(reports)
+        if callable(self.policy):
+            self.policy(self, reports)
+        elif self.policy == 'fail_fast':
+            self.expire([request for request, _, _ in overdue], "deadline exceeded")
+        elif self.policy in ('abort_queue', 'reset'):
+            with self.lock:
+                victims = [request for request, _, _ in self.tracked.values()]
+            self.expire(victims, "queue aborted after a deadline was exceeded")
+            if self.policy == 'reset':
+                try:
+                    self.executor.reset_device()
+                except OSError as e:
+                    self.reset_error = e  # リセットできない transport では abort_queue と同じ動きになる
+        return len(overdue)
+
+    def report(self, request, due, tag, now):
+        command = request.command
+        deadline_ms = self.deadline_for(command)
+        return {
+            'tag': tag,
+            'lba': command.lba,
+            'command': command.command,
+            'deadline_ms': deadline_ms,
+            'age_ms': (now - due) / 1e6 + deadline_ms,
+            'request': request,
+        }
+
+    def expire(self, requests, reason):
+        # requests の Future を command_timeout で失敗させる。既に完了していたものは飛ばす
+        expired = []
+        with self.lock:
+            for request in requests:
+                entry = self.tracked.pop(id(request), None)
+                self.reported.discard(id(request))
+                if entry is not None:
+                    self.expired[id(request)] = request
+                    expired.append(entry)
+        now = perf_counter_ns()
+        for request, due, tag in expired:
+            command = request.command
+            age_ms = (now - due) / 1e6 + self.deadline_for(command)
+            self.executor._expire(request, tag, command_timeout(
+                f"command 0x{command.command:02X} LBA {command.lba:#x} tag {tag}: {reason} ({age_ms:.1f} ms)",
+                command, tag, age_ms))
+        return len(expired)
@@ -0,0 +1,160 @@
+import struct
+import threading
+
+import numpy as np
+
+# 1 完了 1 レコード (88 バイト固定)。record() は pack_into 1 回で書き込み、デコードは numpy でまとめて行う
+#   submit_ns, issue_ns, complete_ns, lba, duration, resid, transfer_length,
+#   feature, count, driver_status, transport_status, command, protocol, tag, device_status, sense(32)
+LOG_RECORD = struct.Struct('<QQQQIiIHHHHBBBB32s')
+LOG_DTYPE = np.dtype([
+    ('submit_ns', '<u8'), ('issue_ns', '<u8'), ('complete_ns', '<u8'), ('lba', '<u8'),
+    ('duration', '<u4'), ('resid', '<i4'), ('transfer_length', '<u4'),
+    ('feature', '<u2'), ('count', '<u2'), ('driver_status', '<u2'), ('transport_status', '<u2'),
+    ('command', 'u1'), ('protocol', 'u1'), ('tag', 'u1'), ('device_status', 'u1'),
+    ('sense', 'u1', (32,)),
+])
+LOG_NO_TAG = 0xFF
+ATA_RETURN_DESCRIPTOR = 0x09
+
+def decode_sense(sense):
+    # (n, 32) の uint8 配列から sense key/ASC/ASCQ と ATA Status Return descriptor の中身を取り出す。
+    # ATA の値が読めなかった行は ata_valid が False になる
+    sense = np.asarray(sense, dtype=np.uint8).reshape(-1, 32)
+    rows = np.arange(len(sense))
+    response = sense[:, 0] & 0x7F
+    descriptor = (response == 0x72) | (response == 0x73)
+    fixed = (response == 0x70) | (response == 0x71)
+    sense_key = np.where(descriptor, sense[:, 1], np.where(fixed, sense[:, 2], 0)) & 0x0F
+    asc = np.where(descriptor, sense[:, 2], np.where(fixed, sense[:, 12], 0))
+    ascq = np.where(descriptor, sense[:, 3], np.where(fixed, sense[:, 13], 0))
+
+    # 可変長ディスクリプタを先頭から辿り、ATA Status Return (09h) の位置を探す (32 バイトに収まるのは高々 4 個)
+    end = np.minimum(8 + sense[:, 7].astype(np.int64), 32)
+    position = np.full(len(sense), 8, dtype=np.int64)
+    found = np.full(len(sense), -1, dtype=np.int64)
+    for _ in range(4):
+        live = descriptor & (found < 0) & (position + 14 <= end)
+        code = sense[rows, np.minimum(position, 31)]
+        hit = live & (code == ATA_RETURN_DESCRIPTOR)
+        found[hit] = position[hit]
+        position = position + 2 + sense[rows, np.minimum(position + 1, 31)]
+    at = np.maximum(found, 0)
+
+    def byte(offset):
+        return sense[rows, np.minimum(at + offset, 31)].astype(np.uint64)
+
+    in_descriptor = found >= 0
+    # 固定形式は SAT の ATA PASS-THROUGH INFORMATION AVAILABLE (ASC/ASCQ 00h/1Dh) のときだけ ATA の値が入る
+    in_fixed = fixed & (asc == 0x00) & (ascq == 0x1D)
+    descriptor_lba = (byte(7) | byte(9) << np.uint64(8) | byte(11) << np.uint64(16) | byte(6) << np.uint64(24) |
+                      byte(8) << np.uint64(32) | byte(10) << np.uint64(40))
+    fixed_lba = (sense[:, 9].astype(np.uint64) | sense[:, 10].astype(np.uint64) << np.uint64(8) |
+                 sense[:, 11].astype(np.uint64) << np.uint64(16))
+    return {
+        'sense_key': sense_key.astype(np.uint8),
+        'asc': asc.astype(np.uint8),
+        'ascq': ascq.astype(np.uint8),
+        'ata_valid': in_descriptor | in_fixed,
+        'ata_status': np.where(in_descriptor, byte(13), np.where(in_fixed, sense[:, 4], 0)).astype(np.uint8),
+        'ata_error': np.where(in_descriptor, byte(3), np.where(in_fixed, sense[:, 3], 0)).astype(np.uint8),
+        'ata_lba': np.where(in_descriptor, descriptor_lba, np.where(in_fixed, fixed_lba, 0)),
+    }
+
+class completion_log:
+    # executor の全完了を事前確保した構造化配列に詰める。足りなくなったら倍に広げる。
+    # 問い合わせ (失敗 LBA, エラーコード別件数など) は列に対する numpy 演算で行う
+    def __init__(self, capacity=1 << 16):
+        self.records = np.zeros(max(capacity, 1), dtype=LOG_DTYPE)
+        self.buffer = memoryview(self.records).cast('B')
+        self.size = 0
+        self.lock = threading.Lock()
+        self.decoded = None  # (件数, decode_sense の結果, 列) のキャッシュ
+
+    def record(self, request, tag=None):
+        # request は io_request (ワーカー/刈り取りスレッドから呼ばれる)
+        command = request.command
+        with self.lock:
+            if self.size == len(self.records):
+                self._grow()
+            LOG_RECORD.pack_into(
+                self.buffer, self.size * LOG_RECORD.size, request.submit_ns, request.issue_ns, request.complete_ns,
+                command.lba, request.duration, request.resid, request.data_len, command.feature, command.count,
+                request.driver_status & 0xFFFF, request.transport_status & 0xFFFF, command.command,
+                command.protocol.value, LOG_NO_TAG if tag is None else tag, request.device_status & 0xFF,
+                bytes(request.sense),
+            )
+            self.size += 1
+
+    def _grow(self):
+        records = np.zeros(len(self.records) * 2, dtype=LOG_DTYPE)
+        records[:self.size] = self.records[:self.size]
+        self.buffer.release()
+        self.records = records
+        self.buffer = memoryview(records).cast('B')
+
+    def __len__(self):
+        return self.size
+
+    def clear(self):
+        with self.lock:
+            self.size = 0
+            self.decoded = None
+
+    def view(self):
+        # 記録済みのレコード。書き込み済みの行は変わらないのでコピーせずに切り出す (clear() 後は無効)
+        with self.lock:
+            return self.records[:self.size]
+
+    def decode(self):
+        # 全レコードの列と sense のデコード結果を dict で返す。前回から増えた分だけデコードする
+        records = self.view()
+        cached = self.decoded
+        if cached is not None and cached[0] == len(records):
+            return cached[2]
+        if cached is None or cached[0] > len(records):
+            cached = (0, decode_sense(records['sense'][:0]), None)
+        done, previous, _ = cached
+        fresh = decode_sense(records['sense'][done:])
+        decoded = {name: np.concatenate((previous[name], fresh[name])) for name in fresh}
+        columns = {name: records[name] for name in LOG_DTYPE.names if name != 'sense'}
+        columns.update(decoded)
+        columns['failed'] = ((records['driver_status'] != 0) | (records['transport_status'] != 0) |
+                             (records['device_status'] != 0))
+        columns['error_lba'] = np.where(decoded['ata_valid'], decoded['ata_lba'], records['lba'])
+        columns['latency_ns'] = records['complete_ns'] - records['submit_ns']
+        self.decoded = (len(records), decoded, columns)
+        return columns
+
+    def failed_lbas(self):
+        # 失敗したコマンドがエラーを報告した LBA (ATA の値が読めなければコマンドの先頭 LBA)
+        columns = self.decode()
+        return np.unique(columns['error_lba'][columns['failed']])
+
+    def error_counts(self, by='sense'):
+        # 失敗をコード別に数える。by='sense' は (sense key, ASC, ASCQ)、'ata' は (ATA status, ATA error)、
+        # 'status' は (driver, transport, device) status
+        columns = self.decode()
+        failed = columns['failed']
+        if by == 'sense':
+            keys = ('sense_key', 'asc', 'ascq')
+        elif by == 'ata':
+            keys = ('ata_status', 'ata_error')
+        elif by == 'status':
+            keys = ('driver_status', 'transport_status', 'device_status')
+        else:
+            raise ValueError(f"by must be 'sense', 'ata' or 'status', got {by!r}")
+        if not failed.any():
+            return {}
+        stacked = np.stack([columns[key][failed].astype(np.int64) for key in keys], axis=1)
+        codes, counts = np.unique(stacked, axis=0, return_counts=True)
+        return {tuple(code): count for code, count in zip(codes.tolist(), counts.tolist())}
+
+    def summary(self):
+        columns = self.decode()
+        return {
+            'completions': len(columns['failed']),
+            'failed': int(columns['failed'].sum()),
+            'short_transfers': int((columns['resid'] > 0).sum()),
+            'errors_by_sense': self.error_counts('sense'),
+        }
@@ -0,0 +1,196 @@
+import ctypes
+import errno
+import json
+import os
+from dataclasses import asdict, dataclass
+
+from .ata_command import ATA_COMMAND, xfer_protocol
+from .ata_pass_through import pack_ata_command_into
+from .ata_transport import io_request
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'ata_tool')
+DEFAULT_MAX_TRANSFER = 128 * 1024  # sysfs から読めないときの最大転送長 (sg の既定値)
+MAX_POOLED_TRANSFER = 1024 * 1024  # バッファプール 1 スロットの上限
+IDENTIFY_DEVICE = 0xEC
+READ_LOG_EXT = 0x2F
+READ_DMA_EXT = 0x25
+NCQ_SEND_RECEIVE_LOG = 0x13
+
+@dataclass
+class device_capabilities:
+    serial: str
+    model: str
+    firmware: str
+    lba48: bool
+    max_lba: int
+    logical_sector_size: int
+    physical_sector_size: int
+    ncq: bool
+    ncq_depth: int
+    ncq_priority: bool
+    trim: bool
+    queued_trim: bool
+    max_transfer: int  # ホスト側 (カーネル) が許す 1 コマンドの最大転送バイト数
+    dsm_max_blocks: int = 0  # DATA SET MANAGEMENT 1 コマンドあたりの 512 バイトブロック数の上限 (0 は不明)
+
+    def executor_defaults(self):
+        # bsg_with_ata_command_executor の queue_depth / ncq_depth / max_pooled_transfer の既定値
+        return {
+            'queue_depth': self.ncq_depth if self.ncq else 2,
+            'ncq_depth': self.ncq_depth if self.ncq else 1,
+            'max_pooled_transfer': min(self.max_transfer, MAX_POOLED_TRANSFER),
+        }
+
+    def max_sectors(self):
+        # 1 コマンドで読み書きできる最大セクタ数
+        limit = 0x10000 if self.lba48 else 0x100
+        return min(self.max_transfer // self.logical_sector_size, limit)
+
+def _ata_string(words, first, count):
+    # IDENTIFY の文字列は 1 ワードに 2 文字を上位バイト先に詰めてある
+    raw = bytes(byte for word in words[first:first + count] for byte in (word >> 8, word & 0xFF))
+    return raw.decode('ascii', 'replace').strip()
+
+def parse_identify(data, max_transfer=None):
+    words = memoryview(bytes(data)).cast('H').tolist()  # リトルエンディアン前提 (x86/ARM)
+    lba48 = bool(words[83] & (1 << 10))
+    if lba48:
+        max_lba = (words[100] | words[101] << 16 | words[102] << 32 | words[103] << 48) - 1
+    else:
+        max_lba = (words[60] | words[61] << 16) - 1
+    logical = 512
+    physical_per_logical = 1
+    if words[106] & 0xC000 == 0x4000:  # word 106 が有効
+        if words[106] & (1 << 12):
+            logical = (words[117] | words[118] << 16) * 2
+        if words[106] & (1 << 13):
+            physical_per_logical = 1 << (words[106] & 0xF)
+    ncq = bool(words[76] & (1 << 8))
+    return device_capabilities(
+        serial=_ata_string(words, 10, 10),
+        model=_ata_string(words, 27, 20),
+        firmware=_ata_string(words, 23, 4),
+        lba48=lba48,
+        max_lba=max_lba,
+        logical_sector_size=logical,
+        physical_sector_size=logical * physical_per_logical,
+        ncq=ncq,
+        ncq_depth=(words[75] & 0x1F) + 1 if ncq else 1,
+        ncq_priority=bool(words[76] & (1 << 12)),
+        trim=bool(words[169] & 1),
+        queued_trim=False,
+        max_transfer=max_transfer or DEFAULT_MAX_TRANSFER,
+        dsm_max_blocks=words[105],
+    )
+
+def _execute(transport, command: ATA_COMMAND, timeout_ms):
+    # executor を作る前に transport で 1 コマンドだけ同期実行する
+    cdb = (ctypes.c_ubyte * 32)()
+    pack_ata_command_into(cdb, 0, command)
+    sense = (ctypes.c_ubyte * 32)()
+    data = (ctypes.c_ubyte * command.transfer_length)()
+    request = io_request(command, cdb, sense, data, command.transfer_length, True, timeout_ms)
+    transport.execute(request)
+    if request.driver_status or request.transport_status or request.device_status:
+        raise OSError(errno.EIO, f"command 0x{command.command:02X} failed "
+                                 f"(driver={request.driver_status:#x} transport={request.transport_status:#x} "
+                                 f"device={request.device_status:#x})")
+    return bytes(data)
+
+def identify(transport, timeout_ms=5000):
+    return _execute(transport, ATA_COMMAND(device=0x40, command=IDENTIFY_DEVICE, protocol=xfer_protocol.read_pio,
+                                           transfer_length=512, ext_command=False), timeout_ms)
+
+def read_log(transport, log_address, page=0, pages=1, timeout_ms=5000):
+    # READ LOG EXT: LBA(7:0) がログアドレス、LBA(15:8) と LBA(47:32) がページ番号
+    return _execute(transport, ATA_COMMAND(count=pages, lba=log_address | (page & 0xFF) << 8 | (page >> 8) << 32,
+                                           device=0x40, command=READ_LOG_EXT, protocol=xfer_protocol.read_pio,
+                                           transfer_length=512 * pages), timeout_ms)
+
+def read_sectors(transport, lba, count=1, sector_size=512, timeout_ms=5000):
+    # READ DMA EXT を 1 回だけ同期で出す (executor を立ち上げるまでもない単発の読み出し用)
+    return _execute(transport, ATA_COMMAND(count=count & 0xFFFF, lba=lba, device=0x40, command=READ_DMA_EXT,
+                                           protocol=xfer_protocol.read_dma, transfer_length=count * sector_size),
+                    timeout_ms)
+
+def _sysfs_device_dir(dev_path):
+    name = os.path.basename(dev_path or '')
+    for base in ('/sys/class/bsg', '/sys/class/scsi_generic'):
+        path = os.path.join(base, name, 'device')
+        if name and os.path.isdir(path):
+            return path
+    return None
+
+def sysfs_info(dev_path):
+    # コマンドを出さずに分かる範囲: (serial, firmware, max_transfer)。分からなければ None
+    device_dir = _sysfs_device_dir(dev_path)
+    if device_dir is None:
+        return None, None, None
+    serial = firmware = max_transfer = None
+    try:
+        with open(os.path.join(device_dir, 'vpd_pg80'), 'rb') as f:
+            serial = f.read()[4:].decode('ascii', 'replace').strip() or None
+    except OSError:
+        pass
+    try:
+        with open(os.path.join(device_dir, 'rev')) as f:
+            firmware = f.read().strip() or None
+    except OSError:
+        pass
+    try:
+        for block in os.listdir(os.path.join(device_dir, 'block')):
+            with open(os.path.join(device_dir, 'block', block, 'queue', 'max_sectors_kb')) as f:
+                max_transfer = int(f.read()) * 1024
+    except (OSError, ValueError):
+        pass
+    return serial, firmware, max_transfer
+
+def _cache_path(cache_dir, serial):
+    safe = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in serial)
+    return os.path.join(cache_dir, f"{safe}.json")
+
+def _load_cache(cache_dir, serial, firmware):
+    try:
+        with open(_cache_path(cache_dir, serial)) as f:
+            capabilities = device_capabilities(**json.load(f))
+    except (OSError, ValueError, TypeError):
+        return None
+    # sysfs の rev は先頭 4 文字だけのことがある。ファームウェアが変わっていたら読み直す
+    if firmware and not capabilities.firmware.startswith(firmware):
+        return None
+    return capabilities
+
+def _store_cache(cache_dir, capabilities):
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = _cache_path(cache_dir, capabilities.serial)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(asdict(capabilities), f, indent=1)
+        os.replace(path + '.tmp', path)
+    except OSError:
+        pass  # キャッシュは高速化のためだけなので書けなくても続ける
+
+def probe_device(transport, dev_path=None, cache_dir=DEFAULT_CACHE_DIR, refresh=False, timeout_ms=5000):
+    # sysfs でシリアルが分かりキャッシュがあればコマンドを出さずに返す。
+    # なければ IDENTIFY DEVICE (と必要なログ) を発行し、結果をシリアルごとにキャッシュする
+    serial, firmware, max_transfer = sysfs_info(dev_path)
+    if cache_dir and serial and not refresh:
+        capabilities = _load_cache(cache_dir, serial, firmware)
+        if capabilities is not None:
+            return capabilities
+    data = identify(transport, timeout_ms)
+    capabilities = parse_identify(data, max_transfer)
+    if cache_dir and not refresh:
+        cached = _load_cache(cache_dir, capabilities.serial, capabilities.firmware)
+        if cached is not None and cached.max_lba == capabilities.max_lba:
+            return cached
+    words = memoryview(data).cast('H')
+    if words[77] & (1 << 6):  # NCQ SEND/RECEIVE 対応ならキュー付き TRIM の可否をログ 13h で調べる
+        try:
+            log = read_log(transport, NCQ_SEND_RECEIVE_LOG, timeout_ms=timeout_ms)
+            capabilities.queued_trim = bool(log[0] & 1) and bool(log[4] & 1)
+        except OSError:
+            pass
+    if cache_dir:
+        _store_cache(cache_dir, capabilities)
+    return capabilities
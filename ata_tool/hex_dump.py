@@ -0,0 +1,23 @@
+def print_hex_dump(data: bytes, width: int = 4):
+    for i in range(0, len(data), width):
+        line = data[i:i+width]
+        hex_part = ' '.join(f'{b:02X}' for b in line)
+        print(hex_part)
+
+def print_dwords_4_with_ascii(data):
+    # 必要なら list → bytes に変換
+    if isinstance(data, list):
+        data = bytes(data)
+
+    padded_data = data + b'\x00' * ((4 - len(data) % 4) % 4)
+
+    dwords = [int.from_bytes(padded_data[i:i+4], 'little') for i in range(0, len(padded_data), 4)]
+
+    for i in range(0, len(dwords), 4):
+        dw_line = dwords[i:i+4]
+        hex_part = ' '.join(f"{dw:08X}" for dw in dw_line)
+
+        ascii_bytes = data[i*4:i*4+16]
+        ascii_part = ''.join(chr(b) if 32 <= b <= 126 else '.' for b in ascii_bytes)
+
+        print(f"{hex_part:<40} {ascii_part}")
@@ -0,0 +1,139 @@
+import threading
+
+class latency_histogram:
+    # HDR 形式の対数バケット。2 の冪ごとに 2**sub_bucket_bits 個へ線形分割する (相対誤差 2**-sub_bucket_bits)
+    def __init__(self, sub_bucket_bits=7, max_value_bits=42):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.max_value_bits = max_value_bits
+        self.counts = [0] * ((max_value_bits - sub_bucket_bits + 1) * self.sub_bucket_count)
+        self.total = 0
+        self.sum = 0
+        self.max = 0
+        self.lock = threading.Lock()
+
+    def _index(self, value):
+        shift = value.bit_length() - self.sub_bucket_bits - 1
+        if shift <= 0:
+            return value
+        return shift * self.sub_bucket_count + (value >> shift)
+
+    def _value(self, index):
+        # バケットの下限値
+        if index < 2 * self.sub_bucket_count:
+            return index
+        shift = index // self.sub_bucket_count - 1
+        return (index - shift * self.sub_bucket_count) << shift
+
+    def record(self, value):
+        index = min(self._index(value), len(self.counts) - 1)
+        with self.lock:
+            self.counts[index] += 1
+            self.total += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def merge(self, other):
+        if other.sub_bucket_bits != self.sub_bucket_bits or other.max_value_bits != self.max_value_bits:
+            raise ValueError("cannot merge histograms with different bucket layouts")
+        with other.lock:
+            counts = list(other.counts)
+            total, value_sum, value_max = other.total, other.sum, other.max
+        with self.lock:
+            for index, count in enumerate(counts):
+                if count:
+                    self.counts[index] += count
+            self.total += total
+            self.sum += value_sum
+            self.max = max(self.max, value_max)
+        return self
+
+    def snapshot(self, reset=False):
+        # 計測を止めずに現在値を複製する。reset=True なら同時にカウンタをクリアする
+        copy = latency_histogram(self.sub_bucket_bits, self.max_value_bits)
+        with self.lock:
+            if reset:
+                copy.counts, self.counts = self.counts, [0] * len(self.counts)
+            else:
+                copy.counts = list(self.counts)
+            copy.total, copy.sum, copy.max = self.total, self.sum, self.max
+            if reset:
+                self.total = self.sum = self.max = 0
+        return copy
+
+    def percentile(self, percent):
+        if self.total == 0:
+            return 0
+        threshold = self.total * percent / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= threshold:
+                return min(self._value(index + 1) - 1, self.max)
+        return self.max
+
+    def mean(self):
+        return self.sum / self.total if self.total else 0
+
+    def summary(self, scale=1):
+        # scale で単位を変換する (ns → us なら 1e-3)
+        return {
+            'count': self.total,
+            'mean': self.mean() * scale,
+            'p50': self.percentile(50) * scale,
+            'p99': self.percentile(99) * scale,
+            'p99.9': self.percentile(99.9) * scale,
+            'max': self.max * scale,
+        }
+
+class latency_tracker:
+    # デバイス単位の集計器。opcode ごとに投入→完了 (total) と発行→完了 (service) を記録する
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def _histogram(self, kind, opcode):
+        key = (kind, opcode)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, latency_histogram())
+        return histogram
+
+    def record(self, opcode, total_ns, service_ns):
+        self._histogram('total', opcode).record(total_ns)
+        self._histogram('service', opcode).record(service_ns)
+
+    def snapshot(self, reset=False):
+        # {kind: {opcode: latency_histogram}} と、opcode をまとめた {kind: {'all': ...}} を返す
+        with self.lock:
+            items = list(self.histograms.items())
+        result = {}
+        for (kind, opcode), histogram in items:
+            copy = histogram.snapshot(reset)
+            per_kind = result.setdefault(kind, {})
+            per_kind[opcode] = copy
+            merged = per_kind.get('all')
+            if merged is None:
+                per_kind['all'] = latency_histogram(copy.sub_bucket_bits, copy.max_value_bits).merge(copy)
+            else:
+                merged.merge(copy)
+        return result
+
+    def merge(self, other):
+        with other.lock:
+            items = list(other.histograms.items())
+        for (kind, opcode), histogram in items:
+            self._histogram(kind, opcode).merge(histogram)
+        return self
+
+    def report(self, reset=False):
+        lines = []
+        for kind, per_opcode in sorted(self.snapshot(reset).items()):
+            for opcode, histogram in sorted(per_opcode.items(), key=lambda item: str(item[0])):
+                label = opcode if opcode == 'all' else f"0x{opcode:02X}"
+                s = histogram.summary(1e-3)
+                lines.append(f"{kind:>7} {label:>4}: n={s['count']} mean={s['mean']:.1f}us p50={s['p50']:.1f}us "
+                             f"p99={s['p99']:.1f}us p99.9={s['p99.9']:.1f}us max={s['max']:.1f}us")
+        return '\n'.join(lines)
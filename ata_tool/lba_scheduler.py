@@ -0,0 +1,222 @@
+import bisect
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from .ata_command import ATA_COMMAND, xfer_protocol
+from .async_bsg_executer import ata_completion
+
+SCHEDULED_PROTOCOLS = (xfer_protocol.read_dma, xfer_protocol.write_dma, xfer_protocol.read_pio, xfer_protocol.write_pio)
+# READ/WRITE DMA EXT, READ/WRITE SECTORS EXT (DATA SET MANAGEMENT などは LBA がアドレスではないので対象外)
+SCHEDULED_COMMANDS = (0x25, 0x35, 0x24, 0x34)
+
+class _pending:
+    __slots__ = ('lba', 'end', 'seq', 'command', 'future', 'submit_ns', 'is_read', 'key')
+
+    def __init__(self, lba, end, seq, command, future, submit_ns):
+        self.lba = lba
+        self.end = end
+        self.seq = seq
+        self.command = command
+        self.future = future
+        self.submit_ns = submit_ns
+        self.is_read = command.protocol.is_read_xfer()
+        # 同じ key 同士だけを 1 コマンドにまとめられる
+        self.key = (command.command, command.protocol, command.device, command.icc, command.auxiliary,
+                    command.is_512_block)
+
+    def overlaps(self, other):
+        return self.lba < other.end and other.lba < self.end
+
+class elevator_scheduler:
+    # NCQ を使わない DMA/PIO の読み書きを C-LOOK 順に並べ、連続/重なる LBA を max_transfer まで 1 コマンドにまとめる。
+    # デバイスへは depth 個までしか出さず、その間に溜まった要求を次の発行でまとめる
+    def __init__(self, max_transfer=128 * 1024, sector_size=512, depth=1):
+        self.max_sectors = min(max_transfer // sector_size, 0x10000)
+        self.sector_size = sector_size
+        self.depth = depth
+        self.executor = None
+        self.pending = []  # (lba, seq) 順
+        self.retry = deque()  # まとめたコマンドが失敗したとき、元の要求を 1 つずつ出し直す
+        self.in_flight = []
+        self.head = 0  # 直前に発行した転送の終端 LBA
+        self.seq = itertools.count()
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'dispatched': 0, 'merged': 0}
+
+    def attach(self, executor):
+        self.executor = executor
+        if not executor.iovec:
+            # iovec を使えない transport (bsg) ではスロットに収まる長さまでしかまとめない
+            self.max_sectors = min(self.max_sectors, executor.buffer_pool.slot_size // self.sector_size)
+
+    def accepts(self, command: ATA_COMMAND):
+        if command.protocol not in SCHEDULED_PROTOCOLS or command.command not in SCHEDULED_COMMANDS or \
+                not command.ext_command:
+            return False
+        sectors = command.count or 0x10000
+        return command.transfer_length == sectors * self.sector_size
+
+    def add(self, command: ATA_COMMAND, future: Future, submit_ns):
+        entry = _pending(command.lba, command.lba + (command.count or 0x10000), next(self.seq),
+                         command, future, submit_ns)
+        with self.lock:
+            self.stats['requests'] += 1
+            bisect.insort(self.pending, entry, key=lambda e: (e.lba, e.seq))
+            issues = self._schedule()
+        self._issue(issues)
+
+    def _blocked(self, entry, group_seqs):
+        # 先に投入された重なる要求を追い越さない (読み書きの順序を守る)
+        for other in self.pending:
+            if other.seq < entry.seq and other.seq not in group_seqs and other.overlaps(entry):
+                return True
+        return any(other.overlaps(entry) and not (other.is_read and entry.is_read) for other in self.in_flight)
+
+    def _schedule(self):
+        # lock を持った状態で呼ぶ。発行するグループの一覧を返す
+        issues = []
+        while len(self.in_flight) < self.depth:
+            if self.retry:
+                group = [self.retry.popleft()]
+            else:
+                group = self._next_group()
+                if group is None:
+                    break
+                for entry in group:
+                    self.pending.remove(entry)
+            self.in_flight.extend(group)
+            self.head = max(entry.end for entry in group)
+            self.stats['dispatched'] += 1
+            if len(group) > 1:
+                self.stats['merged'] += len(group)
+            issues.append(group)
+        return issues
+
+    def _next_group(self):
+        if not self.pending:
+            return None
+        # C-LOOK: head 以降で最も近い要求から、なければ先頭に戻る
+        start = bisect.bisect_left(self.pending, self.head, key=lambda e: e.lba)
+        for index in itertools.chain(range(start, len(self.pending)), range(start)):
+            first = self.pending[index]
+            if self._blocked(first, ()):
+                continue
+            group = [first]
+            end = first.end
+            for other in self.pending[index + 1:]:
+                if other.lba > end:
+                    break
+                if other.key != first.key or max(end, other.end) - first.lba > self.max_sectors:
+                    continue
+                seqs = {entry.seq for entry in group}
+                if self._blocked(other, seqs):
+                    continue
+                group.append(other)
+                end = max(end, other.end)
+            return group
+        return None
+
+    def _issue(self, issues):
+        for group in issues:
+            if len(group) == 1:
+                entry = group[0]
+                entry.future.add_done_callback(lambda f, group=group: self._done(group))
+                self.executor._dispatch(entry.command, entry.future, entry.submit_ns)
+                continue
+            command, buffer = self._merge(group)
+            future = Future()
+            future.add_done_callback(lambda f, group=group, buffer=buffer: self._merged_done(group, buffer, f))
+            self.executor._dispatch(command, future, time.perf_counter_ns())
+
+    def _merge(self, group):
+        # プールのスロットに収まる長さならスロット経由の連続転送にし、収まらないときだけ iovec にする
+        # (iovec を使えない transport では attach() でスロット長に抑えてある)。iovec のときだけ転送先の buffer を返す
+        first = group[0]
+        lba = min(entry.lba for entry in group)
+        sectors = max(entry.end for entry in group) - lba
+        length = sectors * self.sector_size
+        pooled = self.executor.buffer_pool.fits(length)
+        buffer = None if pooled and first.is_read else bytearray(length)
+        if not first.is_read:
+            # 重なる書き込みは投入順に重ねて後勝ちにする
+            for entry in sorted(group, key=lambda e: e.seq):
+                offset = (entry.lba - lba) * self.sector_size
+                data = entry.command.transfer_data
+                if entry.command.transfer_buffers is not None:
+                    data = b''.join(entry.command.transfer_buffers)
+                buffer[offset:offset + entry.command.transfer_length] = data
+        source = first.command
+        command = ATA_COMMAND(
+            count=sectors & 0xFFFF,
+            lba=lba,
+            icc=source.icc,
+            auxiliary=source.auxiliary,
+            device=source.device,
+            command=source.command,
+            protocol=source.protocol,
+            transfer_length=length,
+            is_512_block=source.is_512_block,
+        )
+        if not pooled:
+            command.transfer_buffers = [buffer]
+            return command, buffer
+        if buffer is not None:
+            command.transfer_data = buffer
+        return command, None
+
+    def _merged_done(self, group, buffer, future):
+        completion = None if future.exception() is not None else future.result()
+        if completion is None or not completion.is_good():
+            if completion is not None:
+                completion.release()
+            # どの要求が悪いか切り分けるため、元の要求を個別に出し直す
+            with self.lock:
+                for entry in group:
+                    self.in_flight.remove(entry)
+                self.retry.extend(sorted(group, key=lambda e: e.seq))
+                issues = self._schedule()
+            self._issue(issues)
+            return
+        if buffer is None:
+            # スロット経由で読んだデータ (zero_copy ならスロットそのもの)
+            buffer = completion.data if completion.data is not None else completion.command.transfer_data
+        lba = min(entry.lba for entry in group)
+        # 転送されなかった末尾 (resid) を、そこに掛かる元の要求へ割り振る
+        transferred = completion.command.transfer_length - max(completion.resid, 0)
+        for entry in group:
+            command = entry.command
+            offset = (entry.lba - lba) * self.sector_size
+            if entry.is_read:
+                data = memoryview(buffer)[offset:offset + command.transfer_length]
+                if command.transfer_buffers is not None:
+                    for target in command.transfer_buffers:
+                        target = memoryview(target).cast('B')
+                        target[:] = data[:len(target)]
+                        data = data[len(target):]
+                else:
+                    command.transfer_data = bytes(data)
+            if entry.future.set_running_or_notify_cancel():
+                entry.future.set_result(ata_completion(
+                    command=command,
+                    driver_status=completion.driver_status,
+                    transport_status=completion.transport_status,
+                    device_status=completion.device_status,
+                    sense=completion.sense,
+                    submit_ns=entry.submit_ns,
+                    issue_ns=completion.issue_ns,
+                    complete_ns=completion.complete_ns,
+                    duration=completion.duration,
+                    resid=min(command.transfer_length, max(offset + command.transfer_length - transferred, 0)),
+                ))
+        completion.release()
+        self._done(group)
+
+    def _done(self, group):
+        with self.lock:
+            for entry in group:
+                self.in_flight.remove(entry)
+            issues = self._schedule()
+        self._issue(issues)
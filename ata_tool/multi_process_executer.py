@@ -0,0 +1,428 @@
+import errno
+import multiprocessing
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import Future, wait
+from multiprocessing import shared_memory
+
+from .async_bsg_executer import bsg_with_ata_command_executor, ata_completion
+from .ata_command import ATA_COMMAND, xfer_protocol
+from .latency_histogram import latency_tracker
+from .ncq_tag_allocator import NCQ_MAX_DEPTH
+
+# コマンドレコード: id, feature, count, lba, icc, auxiliary, device, command, protocol, transfer_length, data slot, flags
+COMMAND_RECORD = struct.Struct('<QHHQBIBBBIIB')
+# 完了レコード: id, count, driver/transport/device status, duration, resid, submit/issue/complete ns, flags, sense
+COMPLETION_RECORD = struct.Struct('<QHIIIIiQQQB32s')
+
+FLAG_512_BLOCK = 0x01
+FLAG_EXT_COMMAND = 0x02
+FLAG_STOP = 0x80
+FLAG_FAILED = 0x01
+FLAG_READY = 0x02
+POLL_INTERVAL = 0.1  # 起動待ち/完了待ちでワーカーの生死を確かめる間隔 (秒)
+
+class shared_ring:
+    # 固定長レコードの SPSC リングを共有メモリ上に置く。
+    # 空き/詰まりはセマフォで数えるので、head/tail は各プロセスのローカル変数で足りる
+    def __init__(self, record_size, capacity, name=None, items=None, space=None):
+        self.record_size = record_size
+        self.capacity = capacity
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=record_size * capacity)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.items = items
+        self.space = space
+        self.position = 0
+
+    @classmethod
+    def create(cls, context, record_size, capacity):
+        return cls(record_size, capacity, items=context.Semaphore(0), space=context.Semaphore(capacity))
+
+    def handle(self):
+        # 子プロセスへ渡すための最小情報
+        return (self.record_size, self.capacity, self.memory.name, self.items, self.space)
+
+    @classmethod
+    def attach(cls, handle):
+        record_size, capacity, name, items, space = handle
+        return cls(record_size, capacity, name, items, space)
+
+    def push(self, record: struct.Struct, *values):
+        self.space.acquire()
+        record.pack_into(self.memory.buf, self.position * self.record_size, *values)
+        self.position = (self.position + 1) % self.capacity
+        self.items.release()
+
+    def pop(self, record: struct.Struct, timeout=None):
+        # timeout 秒待っても届かなければ None
+        if not self.items.acquire(timeout=timeout):
+            return None
+        values = record.unpack_from(self.memory.buf, self.position * self.record_size)
+        self.position = (self.position + 1) % self.capacity
+        self.space.release()
+        return values
+
+    def close(self, unlink=False):
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+def _shard_main(dev_path, transport, queue_depth, ncq_tags, slot_size, command_handle, completion_handle, data_name):
+    # ワーカープロセス: 自分の fd/executor/バッファを持ち、リング経由でだけ親とやり取りする
+    commands = shared_ring.attach(command_handle)
+    completions = shared_ring.attach(completion_handle)
+    data = shared_memory.SharedMemory(name=data_name)
+    completion_lock = threading.Lock()
+    try:
+        executor = bsg_with_ata_command_executor(dev_path, queue_depth=queue_depth, transport=transport,
+                                                 max_pooled_transfer=slot_size, zero_copy=True,
+                                                 record_latency=False, ncq_tags=ncq_tags)
+    except BaseException as e:
+        # 起動に失敗したことを最初のレコードで親に知らせる (driver_status の位置に errno を入れる)
+        completions.push(COMPLETION_RECORD, 0, 0, getattr(e, 'errno', None) or 0, 0, 0, 0, 0, 0, 0, 0,
+                         FLAG_STOP | FLAG_FAILED, (getattr(e, 'strerror', None) or str(e)).encode()[:32])
+        commands.close()
+        completions.close()
+        data.close()
+        return
+    completions.push(COMPLETION_RECORD, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, FLAG_READY, b'')
+
+    def on_done(command_id, slot, command, future):
+        exc = future.exception()
+        if exc is not None:
+            values = (command_id, command.count, 0, 0, 0, 0, 0, 0, 0, 0, FLAG_FAILED, str(exc).encode()[:32])
+        else:
+            completion = future.result()
+            if completion.data is not None:
+                offset = slot * slot_size
+                data.buf[offset:offset + len(completion.data)] = completion.data
+                completion.release()
+            values = (command_id, command.count, completion.driver_status, completion.transport_status,
+                      completion.device_status, completion.duration, completion.resid, completion.submit_ns,
+                      completion.issue_ns, completion.complete_ns, 0, completion.sense)
+        with completion_lock:
+            completions.push(COMPLETION_RECORD, *values)
+
+    stop_flags, message = FLAG_STOP, b''
+    try:
+        while True:
+            (command_id, feature, count, lba, icc, auxiliary, device, opcode, protocol,
+             transfer_length, slot, flags) = commands.pop(COMMAND_RECORD)
+            if flags & FLAG_STOP:
+                break
+            command = ATA_COMMAND(
+                feature=feature, count=count, lba=lba, icc=icc, auxiliary=auxiliary, device=device,
+                command=opcode, protocol=xfer_protocol(protocol), transfer_length=transfer_length,
+                is_512_block=bool(flags & FLAG_512_BLOCK), ext_command=bool(flags & FLAG_EXT_COMMAND),
+            )
+            if transfer_length and not command.protocol.is_read_xfer():
+                command.transfer_data = data.buf[slot * slot_size:slot * slot_size + transfer_length]
+            future = executor.submit_command(command)
+            future.add_done_callback(lambda f, i=command_id, s=slot, c=command: on_done(i, s, c, f))
+        executor.drain_command()
+    except BaseException as e:
+        # 親は FLAG_FAILED 付きの停止レコードを見て、残りのコマンドをこのメッセージで失敗させる
+        stop_flags, message = FLAG_STOP | FLAG_FAILED, str(e).encode()[:32]
+    finally:
+        executor.close()
+        with completion_lock:
+            completions.push(COMPLETION_RECORD, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, stop_flags, message)
+        commands.close()
+        completions.close()
+        data.close()
+
+class _shard:
+    def __init__(self, context, dev_path, transport, queue_depth, ncq_tags, slot_size):
+        self.dev_path = dev_path
+        self.slot_size = slot_size
+        self.commands = shared_ring.create(context, COMMAND_RECORD.size, queue_depth + 1)
+        self.completions = shared_ring.create(context, COMPLETION_RECORD.size, queue_depth + 1)
+        self.data = shared_memory.SharedMemory(create=True, size=slot_size * queue_depth)
+        self.free_slots = list(range(queue_depth))
+        self.slot_available = threading.Condition()
+        self.submit_lock = threading.Lock()
+        self.pending = {}
+        self.error = None  # ワーカーが止まったら以降のコマンドをこの例外で失敗させる
+        self.process = context.Process(
+            target=_shard_main,
+            args=(dev_path, transport, queue_depth, ncq_tags, slot_size,
+                  self.commands.handle(), self.completions.handle(), self.data.name),
+            daemon=True,
+        )
+        self.process.start()
+        self.collector = None
+
+    def wait_ready(self):
+        # ワーカーの最初のレコードを待つ。起動に失敗していれば OSError にする
+        while True:
+            values = self.completions.pop(COMPLETION_RECORD, timeout=POLL_INTERVAL)
+            if values is not None:
+                break
+            if not self.process.is_alive():
+                raise OSError(errno.EIO, f"{self.dev_path}: worker exited during startup "
+                                         f"(exit code {self.process.exitcode})")
+        _, _, error, *_, flags, message = values
+        if flags & FLAG_FAILED:
+            self.process.join()
+            raise OSError(error or errno.EIO, f"{self.dev_path}: worker failed to start: "
+                                              f"{message.rstrip(bytes(1)).decode(errors='replace')}")
+
+    def stop(self):
+        if self.process.is_alive():
+            with self.submit_lock:
+                self.commands.push(COMMAND_RECORD, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, FLAG_STOP)
+
+    def release(self):
+        self.process.join()
+        self.commands.close(unlink=True)
+        self.completions.close(unlink=True)
+        self.data.close()
+        self.data.unlink()
+
+    def fail(self, error):
+        # 完了待ちのコマンドを全て error で失敗させ、以降の投入も受け付けない
+        with self.submit_lock:
+            self.error = error
+            pending, self.pending = self.pending, {}
+        for command, future, slot, submit_ns, buffers in pending.values():
+            self.release_slot(slot)
+            future.set_exception(error)
+
+    def acquire_slot(self):
+        with self.slot_available:
+            while not self.free_slots:
+                self.slot_available.wait()
+            return self.free_slots.pop()
+
+    def release_slot(self, slot):
+        with self.slot_available:
+            self.free_slots.append(slot)
+            self.slot_available.notify()
+
+class multi_process_ata_executor:
+    # デバイス (と、そのストライプ) ごとにワーカープロセスを割り当てて GIL を分散する。
+    # 呼び出し側の API は bsg_with_ata_command_executor と同じ。違いは次のとおり
+    #   - submit_command()/submit_batch() に投入先の device (番号かパス) を指定できる
+    #   - 転送はシャードの共有メモリのスロット (max_transfer) 経由。これより長い転送は個別に確保できないので、
+    #     Future を ValueError で失敗させる。transfer_buffers はスロットとの間でコピーする
+    def __init__(self, dev_paths, queue_depth=32, transport='bsg', shards_per_device=1,
+                 stripe_sectors=2048, max_transfer=128 * 1024, record_latency=True):
+        if isinstance(dev_paths, str):
+            dev_paths = [dev_paths]
+        if not (1 <= shards_per_device <= min(queue_depth, NCQ_MAX_DEPTH)):
+            raise ValueError(f"shards_per_device must be in range 1-{min(queue_depth, NCQ_MAX_DEPTH)}, got {shards_per_device}")
+        self.dev_paths = list(dev_paths)
+        self.queue_depth = queue_depth
+        self.shards_per_device = shards_per_device
+        self.stripe_sectors = stripe_sectors
+        self.latency = latency_tracker() if record_latency else None
+        self.outstanding = set()
+        self.outstanding_lock = threading.Lock()
+        self.next_id = 1
+        self.id_lock = threading.Lock()
+        context = multiprocessing.get_context('spawn')
+        self.shards = []
+        shard_depth = max(queue_depth // shards_per_device, 1)
+        for dev_path in self.dev_paths:
+            for index in range(shards_per_device):
+                # 同じデバイスを分け合うシャード同士で NCQ タグが重ならないように分割する
+                tags = list(range(index, min(queue_depth, NCQ_MAX_DEPTH), shards_per_device))
+                self.shards.append(_shard(context, dev_path, transport, shard_depth, tags, max_transfer))
+        try:
+            for shard in self.shards:
+                shard.wait_ready()
+        except BaseException:
+            # 起動できたシャードも止めてから例外を投げる
+            for shard in self.shards:
+                shard.stop()
+            for shard in self.shards:
+                shard.release()
+            self.shards = []
+            raise
+        for shard in self.shards:
+            shard.collector = threading.Thread(target=self._collect, args=(shard,), daemon=True)
+            shard.collector.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _route(self, command: ATA_COMMAND, device):
+        if isinstance(device, str):
+            device = self.dev_paths.index(device)
+        stripe = (command.lba // self.stripe_sectors) % self.shards_per_device
+        return self.shards[device * self.shards_per_device + stripe]
+
+    @staticmethod
+    def _transfer_views(command: ATA_COMMAND, is_read):
+        # transfer_buffers を検証して memoryview の並びにする (転送長は executor と同じく合計に合わせる)
+        views = [memoryview(buffer).cast('B') for buffer in command.transfer_buffers]
+        for index, view in enumerate(views):
+            if is_read and view.readonly:
+                raise ValueError(f"transfer buffer {index} is read-only")
+        total = sum(len(view) for view in views)
+        if command.transfer_length and command.transfer_length != total:
+            raise ValueError(f"transfer_length {command.transfer_length} does not match transfer_buffers total {total}")
+        command.transfer_length = total
+        return views
+
+    def submit_command(self, command: ATA_COMMAND, device=0) -> Future:
+        submit_ns = time.perf_counter_ns()
+        shard = self._route(command, device)
+        future = Future()
+        future.set_running_or_notify_cancel()
+        with self.outstanding_lock:
+            self.outstanding.add(future)
+        future.add_done_callback(self._retire)
+        is_read = command.protocol.is_read_xfer()
+        try:
+            buffers = self._transfer_views(command, is_read) if command.transfer_buffers is not None else None
+            if command.transfer_length > shard.slot_size:
+                raise ValueError(f"transfer_length must be at most {shard.slot_size}, got {command.transfer_length}")
+        except ValueError as e:
+            future.set_exception(e)
+            return future
+        slot = shard.acquire_slot()
+        if command.transfer_length and not is_read:
+            offset = slot * shard.slot_size
+            if buffers is None:
+                shard.data.buf[offset:offset + command.transfer_length] = command.transfer_data
+            else:
+                for view in buffers:
+                    shard.data.buf[offset:offset + len(view)] = view
+                    offset += len(view)
+        flags = (FLAG_512_BLOCK if command.is_512_block else 0) | (FLAG_EXT_COMMAND if command.ext_command else 0)
+        with self.id_lock:
+            command_id = self.next_id
+            self.next_id += 1
+        with shard.submit_lock:
+            error = shard.error
+            if error is None:
+                shard.pending[command_id] = (command, future, slot, submit_ns, buffers if is_read else None)
+                # スロット数 = リング容量 - 1 なので、ここで push が詰まることはない
+                shard.commands.push(COMMAND_RECORD, command_id, command.feature, command.count, command.lba,
+                                    command.icc, command.auxiliary, command.device, command.command,
+                                    command.protocol.value, command.transfer_length, slot, flags)
+        if error is not None:
+            shard.release_slot(slot)
+            future.set_exception(error)
+        return future
+
+    def submit_batch(self, batch, data=None, device=0):
+        # data は batch.data_offsets() の並びの転送アリーナ (bsg_with_ata_command_executor.submit_batch と同じ)
+        return [self.submit_command(command, device) for command in batch.commands(data)]
+
+    def _collect(self, shard: _shard):
+        while True:
+            values = shard.completions.pop(COMPLETION_RECORD, timeout=POLL_INTERVAL)
+            if values is None:
+                if shard.process.is_alive():
+                    continue
+                # 止まる直前に積まれたレコードがあれば先に読む
+                values = shard.completions.pop(COMPLETION_RECORD, timeout=0)
+                if values is None:
+                    shard.fail(OSError(errno.EIO, f"{shard.dev_path}: worker exited "
+                                                  f"(exit code {shard.process.exitcode})"))
+                    return
+            (command_id, count, driver_status, transport_status, device_status, duration, resid,
+             _, issue_ns, complete_ns, flags, sense) = values
+            if flags & FLAG_STOP:
+                message = sense.rstrip(bytes(1)).decode(errors='replace')
+                shard.fail(OSError(errno.EIO, f"{shard.dev_path}: worker stopped"
+                                              + (f": {message}" if flags & FLAG_FAILED else "")))
+                return
+            entry = shard.pending.pop(command_id, None)
+            if entry is None:
+                print(f"{shard.dev_path}: completion for unknown command id {command_id}", file=sys.stderr)
+                continue
+            command, future, slot, submit_ns, buffers = entry
+            if flags & FLAG_FAILED:
+                shard.release_slot(slot)
+                future.set_exception(RuntimeError(f"{shard.dev_path}: {sense.rstrip(bytes(1)).decode(errors='replace')}"))
+                continue
+            command.count = count
+            offset = slot * shard.slot_size
+            if buffers is not None:
+                # 転送できた分 (resid を除く) だけを呼び出し元のバッファへ分配する
+                source = shard.data.buf[offset:offset + command.transfer_length - min(max(resid, 0), command.transfer_length)]
+                for view in buffers:
+                    chunk = source[:len(view)]
+                    view[:len(chunk)] = chunk
+                    source = source[len(chunk):]
+            elif command.transfer_length and command.protocol.is_read_xfer():
+                command.transfer_data = bytes(shard.data.buf[offset:offset + command.transfer_length])
+            shard.release_slot(slot)
+            completion = ata_completion(
+                command=command,
+                driver_status=driver_status,
+                transport_status=transport_status,
+                device_status=device_status,
+                sense=sense,
+                submit_ns=submit_ns,
+                issue_ns=issue_ns,
+                complete_ns=complete_ns,
+                duration=duration,
+                resid=resid,
+            )
+            if command.protocol.get_protocol() == xfer_protocol.fpdma:
+                completion.tag = (count >> 3) & 0x1F
+            if self.latency is not None:
+                self.latency.record(command.command, complete_ns - submit_ns, complete_ns - issue_ns)
+            future.set_result(completion)
+
+    def _retire(self, future):
+        with self.outstanding_lock:
+            self.outstanding.discard(future)
+
+    def drain_command(self, timeout=None):
+        # 投入済みの全コマンドが完了するまで待つ。timeout 秒を過ぎたら TimeoutError
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            with self.outstanding_lock:
+                pending = list(self.outstanding)
+            if not pending:
+                return
+            remaining = None if deadline is None else max(deadline - time.perf_counter(), 0)
+            not_done = wait(pending, remaining).not_done
+            if not_done:
+                raise TimeoutError(f"{len(not_done)} commands still outstanding after {timeout} s")
+
+    def close(self):
+        if not self.shards:
+            return
+        self.drain_command()
+        for shard in self.shards:
+            shard.stop()
+        for shard in self.shards:
+            shard.collector.join()
+            shard.release()
+        self.shards = []
+
+if __name__ == "__main__":
+    import random
+    import sys
+
+    # 例: python multi_process_executer.py /dev/bsg/1:0:0:0 /dev/bsg/2:0:0:0 ...
+    dev_paths = sys.argv[1:] or ["/dev/bsg/1:0:0:0"]
+    io_count = 20000
+    with multi_process_ata_executor(dev_paths) as executor:
+        start = time.perf_counter()
+        for i in range(io_count):
+            executor.submit_command(ATA_COMMAND(
+                feature=0x8,
+                lba=random.randint(0, 0x00FF_FFFF) * 8,
+                device=0x40,
+                command=0x60,
+                protocol=xfer_protocol.read_fpdma,
+                transfer_length=4096,
+            ), device=i % len(dev_paths))
+        executor.drain_command()
+        elapsed = time.perf_counter() - start
+        print(f"{len(dev_paths)} devices: {io_count / elapsed:10.0f} IOPS")
+        print(executor.latency.report())
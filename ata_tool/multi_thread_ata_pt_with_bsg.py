@@ -0,0 +1,71 @@
+import ctypes
+import fcntl
+import os
+import sys
+import threading
+
+from .ata_pass_through import ATA_PASS_THROUGH_32
+from .ata_transport import SG_IO, sg_io_v4
+from .hex_dump import print_dwords_4_with_ascii
+
+def executer(fd,tag):
+        # CDBの準備
+        import random
+        ata_pt = ATA_PASS_THROUGH_32()
+        ata_pt.protocol = 0xC # FPDMA
+        ata_pt.extend = True  # 48 bit LBA Command
+        ata_pt.off_line = 0  # オフラインモードは無効
+        ata_pt.ck_cond = False  # チェックコンディションは無効
+        ata_pt.t_type = True  # Block長はSector長に合わせる
+        ata_pt.t_dir = True  # 読み取り方向
+        ata_pt.byt_blok = True  # ブロックモードを有効にする
+        ata_pt.t_length = 2 # FEATURES Fieldを転送長として使用
+
+        ata_pt.features = 0x8 # Xfer Block Lengthを設定
+        ata_pt.sector_count = tag << 3 # tagを設定
+        ata_pt.lba = random.randint(0, 0x00FF_FFFF) * 8 # Aligned LBAから適当に選ぶ
+        ata_pt.device = 0x40 # 規格に書いてあるから
+        ata_pt.command = 0x60 # READ FPDMA QUEUED の Command Code
+
+        # print_hex_dump(ata_pt.cdb(), width=4)
+        cdb_buf = (ctypes.c_ubyte * 32)(*ata_pt.cdb())
+        sense_buf = (ctypes.c_ubyte * 32)()
+        data_buf = (ctypes.c_ubyte * 4096)()
+
+        io = sg_io_v4()
+        io.guard = ord('Q')
+        io.protocol = 0  # BSG_PROTOCOL_SCSI
+        io.subprotocol = 0  # BSG_SUB_PROTOCOL_SCSI_COMMAND
+        io.request_len = 32
+        io.request = ctypes.addressof(cdb_buf)
+        io.max_response_len = 32
+        io.response = ctypes.addressof(sense_buf)
+        io.din_xfer_len = 4096
+        io.din_xferp = ctypes.addressof(data_buf)
+        io.timeout = 5000
+        io.flags = 0
+
+        # ioctl呼び出し
+        fcntl.ioctl(fd, SG_IO, io)
+
+        print(f"driver_status: {io.driver_status}")
+        print(f"device_status: {io.device_status}")
+        print(f"transport_status: {io.transport_status}")
+        print(" --- response data head 512 bytes begin (ascii) --- ")
+        print_dwords_4_with_ascii(data_buf[:512])
+        print(" --- response data head 512 bytes end   (ascii) --- ")
+
+def send_ata_pt_via_bsg(dev_path):
+    fd = os.open(dev_path, os.O_RDONLY|os.O_NONBLOCK)
+
+    threads = []
+    for tag in range(1):
+        t = threading.Thread(target=executer, args=(fd,tag,))
+        threads.append(t)
+        t.start()
+    for t in threads:
+        t.join()
+    os.close(fd)
+
+if __name__ == "__main__":
+    send_ata_pt_via_bsg(sys.argv[1] if len(sys.argv) > 1 else "/dev/bsg/1:0:0:0")  # bsgデバイスのパスは環境に応じて
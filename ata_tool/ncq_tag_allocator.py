@@ -0,0 +1,55 @@
+import threading
+from collections import deque
+
+NCQ_MAX_DEPTH = 32
+
+def encode_ncq_tag(count, tag):
+    # READ/WRITE FPDMA QUEUED の COUNT フィールド bit 7:3 が NCQ TAG
+    return (count & 0xFF07) | (tag << 3)
+
+def decode_ncq_tag(count):
+    return (count >> 3) & 0x1F
+
+NCQ_PRIO_NORMAL = 0x0
+NCQ_PRIO_ISOCHRONOUS = 0x1
+NCQ_PRIO_HIGH = 0x2
+
+def encode_ncq_priority(count, priority):
+    # COUNT フィールド bit 15:14 が PRIO (0: normal, 1: isochronous, 2: high)
+    return (count & 0x3FFF) | (priority << 14)
+
+class ncq_tag_allocator:
+    # 空きタグがなければ投入要求を pending に積み、タグが返ってきた時点でそのまま引き渡す
+    def __init__(self, depth=NCQ_MAX_DEPTH, tags=None):
+        # tags を指定すると、その部分集合だけを使う (同じデバイスを複数プロセスで分け合う場合)
+        tags = list(range(depth)) if tags is None else list(tags)
+        if not (1 <= len(tags) <= NCQ_MAX_DEPTH) or not all(0 <= tag < NCQ_MAX_DEPTH for tag in tags):
+            raise ValueError(f"tags must be 1-{NCQ_MAX_DEPTH} tags in range 0-{NCQ_MAX_DEPTH - 1}, got {tags}")
+        self.depth = len(tags)
+        self.free_tags = deque(tags)
+        self.pending = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self, item):
+        # タグが取れればそれを返し、取れなければ item を pending に積んで None を返す
+        with self.lock:
+            if self.free_tags and not self.pending:
+                return self.free_tags.popleft()
+            self.pending.append(item)
+            return None
+
+    def release(self, tag):
+        # pending があれば (tag, item) を返して即再利用、なければタグを空きに戻す
+        with self.lock:
+            if self.pending:
+                return tag, self.pending.popleft()
+            self.free_tags.append(tag)
+            return None
+
+    def in_flight(self):
+        with self.lock:
+            return self.depth - len(self.free_tags)
+
+    def waiting(self):
+        with self.lock:
+            return len(self.pending)
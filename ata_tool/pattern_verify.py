@@ -0,0 +1,198 @@
+import argparse
+import queue
+import sys
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from .async_bsg_executer import bsg_with_ata_command_executor
+from .ata_bench import parse_size
+from .ata_command import ATA_COMMAND, xfer_protocol
+from .simulated_ata_device import simulated_ata_device, simulated_transport
+
+PATTERNS = ('lba', 'prbs')
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = np.uint64(0x94D049BB133111EB)
+
+def _splitmix64(x):
+    # uint64 配列をそのまま撹拌する (オーバーフローは mod 2^64 で折り返す)
+    x = x + _GOLDEN
+    x = (x ^ (x >> np.uint64(30))) * _MIX1
+    x = (x ^ (x >> np.uint64(27))) * _MIX2
+    return x ^ (x >> np.uint64(31))
+
+@dataclass
+class mismatch_range:
+    lba: int
+    sectors: int
+    reason: str  # 'data' (比較不一致) または 'io' (コマンド自体が失敗)
+
+class pattern_generator:
+    # セクタ単位で LBA とパス番号から決まるパターン。どの LBA からでも単独で生成/比較できる
+    #   lba : 先頭 2 ワードが LBA とパス番号、残りは LBA とワード位置から作る固定値
+    #   prbs: (seed, パス番号, LBA, ワード位置) を splitmix64 に通した擬似乱数
+    def __init__(self, kind='lba', sector_size=512, pass_id=0, seed=0):
+        if kind not in PATTERNS:
+            raise ValueError(f"pattern must be one of {PATTERNS}, got {kind!r}")
+        if sector_size % 8:
+            raise ValueError(f"sector_size must be a multiple of 8, got {sector_size}")
+        self.kind = kind
+        self.sector_size = sector_size
+        self.pass_id = pass_id
+        self.seed = seed
+        self.word_index = np.arange(sector_size // 8, dtype=np.uint64)
+        self.key = _splitmix64(np.array([seed ^ (pass_id << 32)], dtype=np.uint64))[0]  # スカラー演算はオーバーフロー警告が出る
+
+    def sectors_view(self, buffer, sectors):
+        # バッファ先頭を (sectors, ワード数) の uint64 配列として見る
+        return np.frombuffer(buffer, dtype=np.uint64, count=sectors * len(self.word_index)).reshape(sectors, -1)
+
+    def fill(self, out, lba, sectors):
+        # out は (sectors, ワード数) の uint64 配列
+        lbas = np.arange(lba, lba + sectors, dtype=np.uint64)[:, None]
+        if self.kind == 'lba':
+            np.bitwise_xor(lbas, self.word_index * _GOLDEN, out=out)
+            out ^= np.uint64(self.pass_id) << np.uint64(48)
+            out[:, 0] = lbas[:, 0]
+            out[:, 1] = self.pass_id
+        else:
+            out[:] = _splitmix64(((lbas << np.uint64(16)) | self.word_index) ^ self.key)
+        return out
+
+    def compare(self, buffer, lba, sectors, scratch):
+        # 一致しなかったセクタを連続範囲にまとめて [(lba, sectors)] で返す
+        actual = self.sectors_view(buffer, sectors)
+        expected = self.fill(scratch[:sectors], lba, sectors)
+        bad = np.not_equal(actual, expected).any(axis=1)
+        if not bad.any():
+            return []
+        edges = np.flatnonzero(np.diff(np.concatenate(([False], bad, [False])).astype(np.int8)))
+        return [(lba + int(first), int(last - first)) for first, last in zip(edges[::2], edges[1::2])]
+
+class verify_engine:
+    # パターン書き込みと読み戻し比較を in_flight 個のバッファで流す。比較は完了順に本スレッドで行う
+    def __init__(self, executor: bsg_with_ata_command_executor, generator: pattern_generator,
+                 chunk_sectors=256, in_flight=8, fpdma=True):
+        self.executor = executor
+        self.generator = generator
+        self.chunk_sectors = chunk_sectors
+        self.in_flight = in_flight
+        self.fpdma = fpdma
+        words = generator.sector_size // 8
+        self.buffers = [np.empty((chunk_sectors, words), dtype=np.uint64) for _ in range(in_flight)]
+        self.scratch = np.empty((chunk_sectors, words), dtype=np.uint64)
+        # iovec を使える transport (sg) では buffers へ直接転送する。使えない transport (bsg) では
+        # 書き込みは buffers からプールのスロットへコピーし、読み込みはスロット (zero_copy) かそのコピーと比較する
+        self.direct = executor.iovec
+        self.stats = {'written_sectors': 0, 'verified_sectors': 0}
+
+    def _command(self, lba, sectors, buffer, is_read):
+        view = memoryview(buffer[:sectors]).cast('B')
+        if self.fpdma:
+            code, protocol = (0x60, xfer_protocol.read_fpdma) if is_read else (0x61, xfer_protocol.write_fpdma)
+        else:
+            code, protocol = (0x25, xfer_protocol.read_dma) if is_read else (0x35, xfer_protocol.write_dma)
+        return ATA_COMMAND(
+            feature=sectors & 0xFFFF if self.fpdma else 0,
+            count=0 if self.fpdma else sectors & 0xFFFF,
+            lba=lba,
+            device=0x40,
+            command=code,
+            protocol=protocol,
+            transfer_length=len(view),
+            transfer_data=b'' if is_read or self.direct else view,
+            transfer_buffers=[view] if self.direct else None,
+        )
+
+    def _run(self, start_lba, end_lba, is_read):
+        mismatches = []
+        done = queue.SimpleQueue()
+        free = list(range(self.in_flight))
+        outstanding = 0
+        lba = start_lba
+        while lba < end_lba or outstanding:
+            if lba < end_lba and free:
+                index = free.pop()
+                sectors = min(self.chunk_sectors, end_lba - lba)
+                buffer = self.buffers[index]
+                if not is_read:
+                    self.generator.fill(buffer[:sectors], lba, sectors)
+                future = self.executor.submit_command(self._command(lba, sectors, buffer, is_read))
+                future.add_done_callback(lambda f, item=(index, lba, sectors): done.put((item, f)))
+                outstanding += 1
+                lba += sectors
+                continue
+            (index, chunk_lba, sectors), future = done.get()
+            outstanding -= 1
+            completion = future.result() if future.exception() is None else None
+            if completion is None or not completion.is_good():
+                mismatches.append(mismatch_range(chunk_lba, sectors, 'io'))
+            elif is_read:
+                if self.direct:
+                    actual = self.buffers[index]
+                else:
+                    actual = completion.data if completion.data is not None else completion.command.transfer_data
+                for first, count in self.generator.compare(actual, chunk_lba, sectors, self.scratch):
+                    mismatches.append(mismatch_range(first, count, 'data'))
+                self.stats['verified_sectors'] += sectors
+            else:
+                self.stats['written_sectors'] += sectors
+            if completion is not None:
+                completion.release()
+            free.append(index)
+        mismatches.sort(key=lambda m: m.lba)
+        return mismatches
+
+    def write(self, start_lba, end_lba):
+        # 書き込みに失敗した範囲を返す
+        return self._run(start_lba, end_lba, is_read=False)
+
+    def verify(self, start_lba, end_lba):
+        # 読み戻してパターンと一致しなかった範囲を返す
+        return self._run(start_lba, end_lba, is_read=True)
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="write LBA-stamped/PRBS patterns and verify them on read-back")
+    parser.add_argument('device', help="device node (/dev/bsg/H:C:T:L, /dev/sgN); a label for --transport sim")
+    parser.add_argument('--transport', default='bsg', choices=('bsg', 'sg', 'sim'))
+    parser.add_argument('--start-lba', type=lambda text: int(text, 0), default=0)
+    parser.add_argument('--end-lba', type=lambda text: int(text, 0), required=True, help="first LBA not touched")
+    parser.add_argument('--pattern', default='lba', choices=PATTERNS)
+    parser.add_argument('--pass-id', type=int, default=0, help="pass counter stamped into every sector")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk', type=parse_size, default=128 * 1024, help="bytes per command")
+    parser.add_argument('--in-flight', type=int, default=8)
+    parser.add_argument('--dma-ext', action='store_true', help="use READ/WRITE DMA EXT instead of FPDMA QUEUED")
+    parser.add_argument('--sector-size', type=int, default=512)
+    parser.add_argument('--verify-only', action='store_true', help="skip the write pass")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    transport = args.transport
+    if transport == 'sim':
+        transport = simulated_transport(simulated_ata_device(sector_size=args.sector_size, queue_depth=min(args.in_flight, 32)))
+    generator = pattern_generator(args.pattern, args.sector_size, args.pass_id, args.seed)
+    # bsg はスロット経由で転送するので、スロットを 1 チャンク分の大きさにする
+    with bsg_with_ata_command_executor(args.device, queue_depth=args.in_flight, transport=transport,
+                                       buffer_slots=args.in_flight, max_pooled_transfer=args.chunk,
+                                       zero_copy=True) as executor:
+        engine = verify_engine(executor, generator, args.chunk // args.sector_size, args.in_flight, not args.dma_ext)
+        mismatches = []
+        for name, run in (('write', engine.write), ('verify', engine.verify)):
+            if name == 'write' and args.verify_only:
+                continue
+            start = time.perf_counter()
+            mismatches += run(args.start_lba, args.end_lba)
+            elapsed = time.perf_counter() - start
+            size = (args.end_lba - args.start_lba) * args.sector_size
+            print(f"{name:>6}: {size / elapsed / 1e6:.1f} MB/s", file=sys.stderr)
+    for m in mismatches:
+        print(f"{m.reason:>4} mismatch: LBA {m.lba:#x} +{m.sectors}")
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, wait
+from dataclasses import dataclass, field
+
+from .async_bsg_executer import bsg_with_ata_command_executor
+from .ata_command import ATA_COMMAND, xfer_protocol
+from .latency_histogram import latency_histogram
+from .ncq_tag_allocator import NCQ_PRIO_HIGH, encode_ncq_priority
+
+@dataclass
+class qos_class:
+    name: str
+    priority: int = 0  # 小さいほど先に発行する
+    iops: float = None  # None は無制限
+    mb_per_s: float = None
+    burst_ms: float = 50  # トークンバケットの容量 (上限レートで何 ms 分貯められるか)
+    ncq_priority: bool = False  # FPDMA コマンドの PRIO に high priority を立てる
+    reserved: bool = False  # 予約した発行枠 (qos_scheduler の reserved_depth) まで使えるクラス
+    max_in_flight: int = None
+    timeout_ms: int = None  # このクラスのコマンドの期限 (command_watchdog が見る)。コマンド側の指定が優先
+
+def default_qos_classes():
+    return [
+        qos_class('high', priority=0, ncq_priority=True, reserved=True),
+        qos_class('normal', priority=1),
+        qos_class('background', priority=2),
+    ]
+
+class _token_bucket:
+    def __init__(self, rate, burst_ms):
+        self.rate = rate  # 1 秒あたりのトークン
+        self.capacity = max(rate * burst_ms / 1000, 1)
+        self.tokens = self.capacity
+        self.last = time.perf_counter()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def wait_time(self, cost, now):
+        # 今すぐ取れれば 0、足りなければ貯まるまでの秒数。容量を超える要求は満タンなら通して負債にする
+        self._refill(now)
+        need = min(cost, self.capacity)
+        return 0 if self.tokens >= need else (need - self.tokens) / self.rate
+
+    def take(self, cost):
+        self.tokens -= cost
+
+@dataclass
+class _class_state:
+    config: qos_class
+    queue: deque = field(default_factory=deque)
+    buckets: list = field(default_factory=list)  # [(bucket, コマンドから cost を求める関数)]
+    in_flight: int = 0
+    latency: latency_histogram = field(default_factory=latency_histogram)
+    stats: dict = field(default_factory=lambda: {'submitted': 0, 'dispatched': 0})
+
+class qos_scheduler:
+    # executor の手前で優先度クラスごとにキューを持ち、
+    #   - 発行可能なクラスのうち priority が最小のものから出す。キューの先頭が aging_ms 待つごとに priority を 1 つ
+    #     上げたものとして扱い、上のクラスが詰まっていても下のクラスが止まり続けないようにする (None で厳密な優先順)
+    #   - クラスごとのトークンバケットで IOPS/帯域を制限する
+    #   - 発行中の総数を NCQ 深さまでに抑え、最後の reserved_depth 個分は reserved クラス専用にする。
+    #     特定のタグ番号を取り置くのではなく発行数の上限で分けるので、executor へはこのスケジューラ経由だけで
+    #     投入する前提 (そうすれば reserved クラスには常に reserved_depth 個の空きタグが残る)
+    def __init__(self, executor: bsg_with_ata_command_executor, classes=None, reserved_depth=4, depth=None,
+                 aging_ms=100):
+        self.executor = executor
+        self.depth = depth or executor.tag_allocator.depth
+        if not 0 <= reserved_depth < self.depth:
+            raise ValueError(f"reserved_depth must be 0-{self.depth - 1}, got {reserved_depth}")
+        self.reserved_depth = reserved_depth
+        self.aging_ns = None if aging_ms is None else int(aging_ms * 1_000_000)
+        self.classes = {}
+        for config in sorted(classes or default_qos_classes(), key=lambda c: c.priority):
+            state = _class_state(config)
+            if config.iops:
+                state.buckets.append((_token_bucket(config.iops, config.burst_ms), lambda command: 1))
+            if config.mb_per_s:
+                state.buckets.append((_token_bucket(config.mb_per_s * 1e6, config.burst_ms),
+                                      lambda command: command.transfer_length))
+            self.classes[config.name] = state
+        self.in_flight = 0
+        self.outstanding = set()
+        self.lock = threading.Lock()
+        # レート制限で止まったクラスの見直しは 1 本のスレッドが timer_due まで待って行う (初めて止まったときに起動)
+        self.wakeup = threading.Condition(self.lock)
+        self.timer = None
+        self.timer_due = None
+        self.running = True
+
+    def submit(self, command: ATA_COMMAND, qos='normal') -> Future:
+        state = self.classes.get(qos)
+        if state is None:
+            raise ValueError(f"unknown QoS class {qos!r}, expected one of {sorted(self.classes)}")
+        if state.config.timeout_ms is not None and command.timeout_ms is None:
+            command.timeout_ms = state.config.timeout_ms
+        if state.config.ncq_priority and command.protocol.get_protocol() == xfer_protocol.fpdma:
+            command.count = encode_ncq_priority(command.count, NCQ_PRIO_HIGH)
+        future = Future()
+        with self.lock:
+            if not self.running:
+                raise RuntimeError("qos_scheduler is closed")
+            self.outstanding.add(future)
+            state.stats['submitted'] += 1
+            state.queue.append((command, future, time.perf_counter_ns()))
+        future.add_done_callback(self._retire)
+        self._pump()
+        return future
+
+    def _retire(self, future):
+        with self.lock:
+            self.outstanding.discard(future)
+
+    def _pick(self, now):
+        # lock を持った状態で呼ぶ。(クラス, 要素) か、発行できなければ (None, 次に試す時刻までの秒数) を返す
+        retry = None
+        for state in self._order():
+            config = state.config
+            limit = self.depth if config.reserved else self.depth - self.reserved_depth
+            if self.in_flight >= limit or (config.max_in_flight and state.in_flight >= config.max_in_flight):
+                continue
+            command = state.queue[0][0]
+            delay = max((bucket.wait_time(cost(command), now) for bucket, cost in state.buckets), default=0)
+            if delay:
+                retry = delay if retry is None else min(retry, delay)
+                continue
+            for bucket, cost in state.buckets:
+                bucket.take(cost(command))
+            return state, state.queue.popleft()
+        return None, retry
+
+    def _order(self):
+        # lock を持った状態で呼ぶ。キューに要素のあるクラスを、待ち時間で底上げした priority 順に返す
+        waiting = [state for state in self.classes.values() if state.queue]
+        if self.aging_ns is None or len(waiting) < 2:
+            return waiting
+        now_ns = time.perf_counter_ns()
+        return sorted(waiting, key=lambda state: state.config.priority - (now_ns - state.queue[0][2]) // self.aging_ns)
+
+    def _pump(self):
+        issues = []
+        with self.lock:
+            now = time.perf_counter()
+            while True:
+                state, item = self._pick(now)
+                if state is None:
+                    retry = item
+                    break
+                if not item[1].set_running_or_notify_cancel():
+                    continue
+                state.in_flight += 1
+                state.stats['dispatched'] += 1
+                self.in_flight += 1
+                issues.append((state, item))
+            if retry is not None:
+                self._arm_timer(retry)
+        for state, (command, future, submit_ns) in issues:
+            try:
+                inner = self.executor.submit_command(command)
+            except BaseException as e:
+                self._finish(state)
+                future.set_exception(e)
+                continue
+            inner.add_done_callback(lambda f, state=state, future=future, submit_ns=submit_ns:
+                                    self._done(state, future, submit_ns, f))
+
+    def _arm_timer(self, delay):
+        # lock を持った状態で呼ぶ。delay 秒後に見直すよう、待っている期限より早ければ前倒しする
+        due = time.perf_counter() + delay
+        if self.timer_due is not None and self.timer_due <= due:
+            return
+        self.timer_due = due
+        if self.timer is None:
+            self.timer = threading.Thread(target=self._run_timer, daemon=True)
+            self.timer.start()
+        else:
+            self.wakeup.notify()
+
+    def _run_timer(self):
+        while True:
+            with self.lock:
+                while self.running and (self.timer_due is None or self.timer_due > time.perf_counter()):
+                    self.wakeup.wait(None if self.timer_due is None else self.timer_due - time.perf_counter())
+                if not self.running:
+                    return
+                self.timer_due = None
+            self._pump()
+
+    def close(self):
+        # 以降の submit() は受け付けない。まだキューに残っている (レート制限などで止まっている) コマンドは
+        # RuntimeError で失敗させる。発行済みのコマンドはそのまま完了を待てる
+        with self.lock:
+            self.running = False
+            self.wakeup.notify()
+            timer, self.timer = self.timer, None
+            queued = [item for state in self.classes.values() for item in state.queue]
+            for state in self.classes.values():
+                state.queue.clear()
+        if timer is not None:
+            timer.join()
+        for command, future, submit_ns in queued:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(RuntimeError("qos_scheduler closed before the command was issued"))
+
+    def _finish(self, state):
+        with self.lock:
+            state.in_flight -= 1
+            self.in_flight -= 1
+
+    def _done(self, state, future, submit_ns, inner):
+        self._finish(state)
+        state.latency.record(time.perf_counter_ns() - submit_ns)
+        if inner.exception() is not None:
+            future.set_exception(inner.exception())
+        else:
+            future.set_result(inner.result())
+        self._pump()
+
+    def drain(self):
+        while True:
+            with self.lock:
+                pending = list(self.outstanding)
+            if not pending:
+                return
+            wait(pending)
+
+    def report(self):
+        # クラスごとの投入→完了レイテンシ (us) と件数
+        return {name: dict(state.stats, latency_us=state.latency.summary(1e-3)) for name, state in self.classes.items()}
@@ -0,0 +1,442 @@
+import errno
+import heapq
+import os
+import random
+import select
+import struct
+import threading
+from dataclasses import dataclass
+from time import perf_counter_ns
+
+from .ata_command import xfer_protocol
+from .ata_pass_through import ATA_PT32_CDB
+from .ata_transport import io_request
+
+SAM_STAT_CHECK_CONDITION = 0x02
+DRIVER_SENSE = 0x08
+DID_TIME_OUT = 0x03
+DID_RESET = 0x08
+
+ATA_STATUS_GOOD = 0x50  # DRDY | DSC
+ATA_STATUS_ERR = 0x51  # DRDY | DSC | ERR
+ATA_ERROR_ABRT = 0x04
+ATA_ERROR_IDNF = 0x10
+ATA_ERROR_UNC = 0x40
+
+# エラー種別 → (ATA ERROR, sense key, ASC, ASCQ)
+ERROR_SENSE = {
+    'unc': (ATA_ERROR_UNC, 0x03, 0x11, 0x04),  # MEDIUM ERROR / UNRECOVERED READ ERROR - AUTO REALLOCATE FAILED
+    'idnf': (ATA_ERROR_IDNF, 0x05, 0x21, 0x00),  # ILLEGAL REQUEST / LBA OUT OF RANGE
+    'abort': (ATA_ERROR_ABRT, 0x0B, 0x00, 0x00),  # ABORTED COMMAND
+}
+
+READ_COMMANDS = {0x60: 'fpdma', 0x25: 'ext', 0xC8: '28bit'}
+WRITE_COMMANDS = {0x61: 'fpdma', 0x35: 'ext', 0xCA: '28bit'}
+NON_DATA_COMMANDS = {0xE7, 0xEA}  # FLUSH CACHE / FLUSH CACHE EXT
+IDENTIFY_DEVICE = 0xEC
+DATA_SET_MANAGEMENT = 0x06
+
+class sparse_lba_store:
+    # 書き込まれたセクタだけを dict に保持する。未書き込みセクタはゼロを返す
+    def __init__(self, sector_size=512):
+        self.sector_size = sector_size
+        self.sectors = {}
+        self.zero = bytes(sector_size)
+
+    def read_into(self, lba, count, view):
+        size = self.sector_size
+        for i in range(count):
+            view[i * size:(i + 1) * size] = self.sectors.get(lba + i, self.zero)
+
+    def write_from(self, lba, count, view):
+        size = self.sector_size
+        for i in range(count):
+            self.sectors[lba + i] = bytes(view[i * size:(i + 1) * size])
+
+    def trim(self, lba, count):
+        if count > len(self.sectors):
+            for key in [key for key in self.sectors if lba <= key < lba + count]:
+                del self.sectors[key]
+        else:
+            for i in range(count):
+                self.sectors.pop(lba + i, None)
+
+    def close(self):
+        pass
+
+class file_lba_store:
+    # イメージファイルを LBA 空間として使う
+    def __init__(self, path, sector_size=512):
+        self.sector_size = sector_size
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def read_into(self, lba, count, view):
+        length = count * self.sector_size
+        done = os.preadv(self.fd, [view[:length]], lba * self.sector_size)
+        if done < length:
+            view[done:length] = bytes(length - done)  # ファイル末尾より後ろはゼロ
+
+    def write_from(self, lba, count, view):
+        os.pwrite(self.fd, view[:count * self.sector_size], lba * self.sector_size)
+
+    def trim(self, lba, count):
+        # 解放した範囲はゼロを返す (ファイル末尾より後ろは元からゼロ)
+        end = min(lba + count, os.fstat(self.fd).st_size // self.sector_size)
+        zero = bytes(min(end - lba, 2048) * self.sector_size) if end > lba else b''
+        while lba < end:
+            chunk = min(end - lba, 2048)
+            os.pwrite(self.fd, zero[:chunk * self.sector_size], lba * self.sector_size)
+            lba += chunk
+
+    def close(self):
+        os.close(self.fd)
+
+@dataclass
+class injected_error:
+    first_lba: int
+    last_lba: int
+    error: str = 'unc'  # 'unc' | 'idnf' | 'abort' | 'timeout'
+    commands: tuple = None  # None なら全コマンドが対象
+    remaining: int = None  # None なら何度でも発生させる
+    probability: float = 1.0
+
+    def __post_init__(self):
+        if self.error not in ERROR_SENSE and self.error != 'timeout':
+            raise ValueError(f"error must be one of {sorted(ERROR_SENSE) + ['timeout']}, got {self.error}")
+
+class simulated_ata_device:
+    def __init__(self, capacity=0x1_0000_0000, sector_size=512, store=None, queue_depth=32,
+                 service_time_us=0, jitter_us=0, bandwidth_mb_s=None, seed=0,
+                 model='SIMULATED ATA DEVICE', serial='SIM0000000001', firmware='SIM1.0'):
+        self.capacity = capacity
+        self.sector_size = sector_size
+        self.store = store if store is not None else sparse_lba_store(sector_size)
+        self.queue_depth = queue_depth
+        self.service_time_us = service_time_us
+        self.jitter_us = jitter_us  # NCQ コマンドはこのばらつきで完了順が入れ替わる
+        self.bandwidth_mb_s = bandwidth_mb_s
+        self.rng = random.Random(seed)
+        self.model = model
+        self.serial = serial
+        self.firmware = firmware
+        self.errors = []
+        self.lock = threading.RLock()
+        self.stats = {'commands': 0, 'read_sectors': 0, 'written_sectors': 0, 'trimmed_sectors': 0, 'errors': 0}
+
+    def inject_error(self, first_lba, last_lba=None, error='unc', commands=None, remaining=None, probability=1.0):
+        rule = injected_error(first_lba, first_lba if last_lba is None else last_lba, error,
+                              tuple(commands) if commands is not None else None, remaining, probability)
+        with self.lock:
+            self.errors.append(rule)
+        return rule
+
+    def clear_errors(self):
+        with self.lock:
+            self.errors.clear()
+
+    def service_time_ns(self, request: io_request):
+        service = self.service_time_us
+        if self.jitter_us:
+            with self.lock:
+                service += self.rng.uniform(0, self.jitter_us)
+        if self.bandwidth_mb_s:
+            service += request.data_len / self.bandwidth_mb_s
+        return int(service * 1000)
+
+    def _match_error(self, command, lba, sectors):
+        with self.lock:
+            for rule in self.errors:
+                if rule.commands is not None and command not in rule.commands:
+                    continue
+                if lba > rule.last_lba or lba + sectors - 1 < rule.first_lba:
+                    continue
+                if rule.remaining == 0 or (rule.probability < 1.0 and self.rng.random() >= rule.probability):
+                    continue
+                if rule.remaining is not None:
+                    rule.remaining -= 1
+                return rule.error, max(lba, rule.first_lba)
+        return None
+
+    def execute(self, request: io_request):
+        # CDB を解釈してストアに対して読み書きし、センス/ステータスを埋める。戻り値はタイムアウトさせるかどうか
+        with self.lock:
+            return self._execute(request)
+
+    def _execute(self, request: io_request):
+        (_, _, _, _, byte1, byte2, lba_hi, lba_lo, features, count,
+         device, command, _, _) = ATA_PT32_CDB.unpack_from(request.cdb)
+        extend = byte1 & 0x1
+        if extend:
+            lba = (lba_hi << 32) | lba_lo
+        else:
+            lba = (lba_lo & 0x00FF_FFFF) | (((device >> 4) & 0x0F) << 24)
+        request.driver_status = 0
+        request.transport_status = 0
+        request.device_status = 0
+        request.resid = 0
+        request.duration = 0
+        self.stats['commands'] += 1
+
+        if command == IDENTIFY_DEVICE:
+            return self._complete_data(request, self.identify_data())
+        if command in NON_DATA_COMMANDS:
+            return self._finish(request, extend, lba, count, None)
+        if command == DATA_SET_MANAGEMENT:
+            return self._data_set_management(request, extend, lba, features, count)
+
+        mode = READ_COMMANDS.get(command) or WRITE_COMMANDS.get(command)
+        if mode is None:
+            return self._finish(request, extend, lba, count, 'abort')
+        if mode == 'fpdma':
+            sectors = features or 0x10000
+        elif mode == 'ext':
+            sectors = count or 0x10000
+        else:
+            sectors = count & 0xFF or 0x100
+        if sectors * self.sector_size != request.data_len or lba + sectors > self.capacity:
+            return self._finish(request, extend, lba, count, 'idnf' if lba + sectors > self.capacity else 'abort')
+
+        hit = self._match_error(command, lba, sectors)
+        if hit is not None:
+            error, error_lba = hit
+            if error == 'timeout':
+                request.transport_status = DID_TIME_OUT
+                return True
+            return self._finish(request, extend, error_lba, count, error)
+
+        if request.iovec is not None:
+            # scatter-gather: 一旦まとめてから各バッファへ分配する (実機の DMA 相当)
+            view = memoryview(bytearray(request.data_len)) if command in READ_COMMANDS else \
+                memoryview(b''.join(request.buffers))
+        else:
+            view = memoryview(request.data).cast('B')
+        if command in READ_COMMANDS:
+            self.store.read_into(lba, sectors, view)
+            if request.iovec is not None:
+                self._scatter(request, view)
+            self.stats['read_sectors'] += sectors
+        else:
+            self.store.write_from(lba, sectors, view)
+            self.stats['written_sectors'] += sectors
+        return self._finish(request, extend, lba, count, None)
+
+    def _data_set_management(self, request: io_request, extend, lba, features, count):
+        # TRIM のみ対応。ペイロードは LBA(47:0) | 長さ(63:48) の 8 バイトエントリの並び (長さ 0 は無視)
+        if not features & 0x01 or not count or count * 512 != request.data_len:
+            return self._finish(request, extend, lba, count, 'abort')
+        payload = b''.join(request.buffers) if request.iovec is not None else \
+            memoryview(request.data).cast('B')[:request.data_len]
+        ranges = []
+        for (entry,) in struct.iter_unpack('<Q', payload):
+            first, sectors = entry & 0xFFFF_FFFF_FFFF, entry >> 48
+            if not sectors:
+                continue
+            if first + sectors > self.capacity:
+                return self._finish(request, extend, lba, count, 'abort')
+            ranges.append((first, sectors))
+        for first, sectors in ranges:
+            self.store.trim(first, sectors)
+            self.stats['trimmed_sectors'] += sectors
+        return False
+
+    def _scatter(self, request: io_request, view):
+        offset = 0
+        for pinned in request.buffers:
+            length = len(pinned)
+            memoryview(pinned).cast('B')[:] = view[offset:offset + length]
+            offset += length
+
+    def _complete_data(self, request: io_request, payload):
+        length = min(len(payload), request.data_len)
+        if request.iovec is not None:
+            self._scatter(request, memoryview(bytes(payload[:length]).ljust(request.data_len, b'\0')))
+        else:
+            memoryview(request.data).cast('B')[:length] = payload[:length]
+        request.resid = request.data_len - length
+        return False
+
+    def _finish(self, request: io_request, extend, lba, count, error):
+        if error is None:
+            return False
+        self.stats['errors'] += 1
+        ata_error, sense_key, asc, ascq = ERROR_SENSE[error]
+        request.device_status = SAM_STAT_CHECK_CONDITION
+        request.driver_status = DRIVER_SENSE
+        request.resid = request.data_len
+        # descriptor 形式センス + ATA Status Return descriptor (SAT)
+        sense = bytearray(len(request.sense))
+        sense[0:4] = bytes((0x72, sense_key, asc, ascq))
+        sense[7] = 14
+        sense[8:22] = bytes((
+            0x09, 0x0C, extend & 0x1, ata_error,
+            (count >> 8) & 0xFF, count & 0xFF,
+            (lba >> 24) & 0xFF, lba & 0xFF,
+            (lba >> 32) & 0xFF, (lba >> 8) & 0xFF,
+            (lba >> 40) & 0xFF, (lba >> 16) & 0xFF,
+            0x40, ATA_STATUS_ERR,
+        ))
+        memoryview(request.sense).cast('B')[:] = sense
+        return False
+
+    def identify_data(self):
+        words = [0] * 256
+
+        def put_string(first_word, word_count, text):
+            raw = text.encode('ascii').ljust(word_count * 2)[:word_count * 2]
+            for i in range(word_count):
+                words[first_word + i] = (raw[2 * i] << 8) | raw[2 * i + 1]
+
+        put_string(10, 10, self.serial)
+        put_string(23, 4, self.firmware)
+        put_string(27, 20, self.model)
+        words[49] = 1 << 9  # LBA supported
+        words[60] = min(self.capacity, 0x0FFF_FFFF) & 0xFFFF
+        words[61] = min(self.capacity, 0x0FFF_FFFF) >> 16
+        words[75] = self.queue_depth - 1  # QUEUE DEPTH
+        words[76] = 1 << 8  # NCQ supported
+        words[83] = (1 << 14) | (1 << 10)  # 48-bit Address feature set supported
+        words[86] = 1 << 10
+        words[105] = 8  # DATA SET MANAGEMENT 1 コマンドあたり最大 8 ブロック
+        for i in range(4):
+            words[100 + i] = (self.capacity >> (16 * i)) & 0xFFFF
+        if self.sector_size != 512:
+            words[106] = (1 << 14) | (1 << 12)  # logical sector longer than 256 words
+            words[117] = (self.sector_size // 2) & 0xFFFF
+            words[118] = (self.sector_size // 2) >> 16
+        else:
+            words[106] = 1 << 14
+        words[169] = 1  # TRIM supported
+        return b''.join(word.to_bytes(2, 'little') for word in words)
+
+    def close(self):
+        self.store.close()
+
+class simulated_transport:
+    # simulated_ata_device を transport として見せる。queued=True なら NCQ を模した非同期完了になる
+    # iovec=False なら bsg と同じく iovec の request を EOPNOTSUPP で拒否する
+    name = 'sim'
+
+    def __init__(self, device: simulated_ata_device = None, queued=True, iovec=True):
+        self.device = device if device is not None else simulated_ata_device()
+        self.queued = queued
+        self.iovec = iovec
+        self.fd = None
+        self.fds = []
+        self.lock = threading.Condition()
+        self.resets = 0  # reset() の回数。同期実行中のコマンドはこれが変わったら打ち切られる
+        if queued:
+            self.event_fd = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+            self.fds = [self.event_fd]
+            self.fd = self.event_fd
+            self.poller = select.poll()
+            self.poller.register(self.event_fd, select.POLLIN)
+            self.timeline = []  # (完了予定時刻, 通番, request)
+            self.completed = []
+            self.sequence = 0
+            self.busy_until = 0
+            self.running = True
+            self.clock = threading.Thread(target=self._run_clock, daemon=True)
+            self.clock.start()
+
+    def close(self):
+        if self.queued and self.running:
+            with self.lock:
+                self.running = False
+                self.lock.notify()
+            self.clock.join()
+            os.close(self.event_fd)
+            self.fds = []
+        self.device.close()
+
+    def _check(self, request: io_request):
+        if request.iovec is not None and not self.iovec:
+            raise OSError(errno.EOPNOTSUPP, "sim transport cannot transfer through an iovec")
+
+    def execute(self, request: io_request):
+        self._check(request)
+        request.issue_ns = perf_counter_ns()
+        service_ns = self.device.service_time_ns(request)
+        timed_out = self.device.execute(request)
+        if timed_out:
+            service_ns = request.timeout * 1_000_000
+        if service_ns:
+            # 処理時間だけ待つ。途中で reset() されたら DID_RESET で返す
+            due = request.issue_ns + service_ns
+            with self.lock:
+                resets = self.resets
+                while self.resets == resets and perf_counter_ns() < due:
+                    self.lock.wait((due - perf_counter_ns()) / 1e9)
+                if self.resets != resets:
+                    request.transport_status = DID_RESET
+        request.complete_ns = perf_counter_ns()
+        request.duration = (request.complete_ns - request.issue_ns) // 1_000_000
+
+    def submit(self, request: io_request):
+        self._check(request)
+        request.issue_ns = perf_counter_ns()
+        service_ns = self.device.service_time_ns(request)
+        timed_out = self.device.execute(request)
+        if timed_out:
+            service_ns = request.timeout * 1_000_000
+        with self.lock:
+            if request.command is not None and request.command.protocol.get_protocol() != xfer_protocol.fpdma:
+                # NCQ 以外のコマンドはデバイス上で 1 つずつ順番に処理される
+                self.busy_until = max(self.busy_until, request.issue_ns) + service_ns
+                due = self.busy_until
+            else:
+                due = request.issue_ns + service_ns
+            heapq.heappush(self.timeline, (due, self.sequence, request))
+            self.sequence += 1
+            self.lock.notify()
+
+    def _run_clock(self):
+        # 完了予定時刻になった request を completed に移して eventfd で知らせる
+        with self.lock:
+            while self.running:
+                now = perf_counter_ns()
+                moved = False
+                while self.timeline and self.timeline[0][0] <= now:
+                    due, _, request = heapq.heappop(self.timeline)
+                    request.complete_ns = now
+                    request.duration = (now - request.issue_ns) // 1_000_000
+                    self.completed.append(request)
+                    moved = True
+                if moved:
+                    os.eventfd_write(self.event_fd, 1)
+                if self.timeline:
+                    self.lock.wait((self.timeline[0][0] - now) / 1e9)
+                else:
+                    self.lock.wait()
+
+    def reset(self):
+        # 発行中のコマンドを DID_RESET で即座に完了させる
+        with self.lock:
+            self.resets += 1
+            self.lock.notify_all()
+            if not self.queued:
+                return
+            now = perf_counter_ns()
+            self.timeline = [(now, sequence, request) for _, sequence, request in self.timeline]
+            for _, _, request in self.timeline:
+                request.transport_status = DID_RESET
+            heapq.heapify(self.timeline)
+            self.busy_until = now
+            self.lock.notify()
+
+    def reap(self, timeout=None):
+        if self.poller.poll(timeout):
+            return self.reap_fd(self.event_fd)
+        return []
+
+    def reap_fd(self, fd):
+        try:
+            os.eventfd_read(self.event_fd)
+        except BlockingIOError:
+            pass
+        with self.lock:
+            completed, self.completed = self.completed, []
+        return completed
+
+    def outstanding(self):
+        with self.lock:
+            return len(self.timeline) + len(self.completed)
@@ -0,0 +1,66 @@
+import threading
+from time import perf_counter_ns
+
+# executor のパイプラインの段
+#   queue: submit_command() から組み立て開始まで (タグ/ワーカー/スケジューラ待ち)
+#   build: CDB のパックとデータの書き込み (_build_request)
+#   transport: ioctl/write() (同期 transport ではデバイスの処理時間を含む)
+#   complete: ステータス/データの取り出し、トレース/ログ記録 (_complete)
+#   resolve: Future の解決 (完了コールバックの実行を含む)
+STAGES = ('queue', 'build', 'transport', 'complete', 'resolve')
+
+class stage_profiler:
+    # 段ごとの所要時間を perf_counter_ns で測り、スレッドごとのカウンタに足し込む。
+    # 無効時は executor 側が profiler is None を見て呼ばないので、計測のコストは有効時だけかかる
+    def __init__(self, stages=STAGES):
+        self.stages = tuple(stages)
+        self.index = {stage: i for i, stage in enumerate(self.stages)}
+        self.local = threading.local()
+        self.counters = []  # スレッドごとの [合計 ns, 回数] * 段数。集計時だけ全部を足す
+        self.lock = threading.Lock()
+
+    def _counter(self):
+        counter = getattr(self.local, 'counter', None)
+        if counter is None:
+            counter = self.local.counter = [0] * (2 * len(self.stages))
+            with self.lock:
+                self.counters.append(counter)
+        return counter
+
+    def add(self, stage, start_ns):
+        # start_ns からの経過を stage に加え、現在時刻を返す (次の段の開始時刻として使う)
+        now = perf_counter_ns()
+        counter = self._counter()
+        i = 2 * self.index[stage]
+        counter[i] += now - start_ns
+        counter[i + 1] += 1
+        return now
+
+    def reset(self):
+        with self.lock:
+            for counter in self.counters:
+                counter[:] = [0] * len(counter)
+
+    def totals(self):
+        # 段 → (合計 ns, 回数)
+        with self.lock:
+            counters = [list(counter) for counter in self.counters]
+        return {stage: (sum(c[2 * i] for c in counters), sum(c[2 * i + 1] for c in counters))
+                for i, stage in enumerate(self.stages)}
+
+    def report(self, ios=None):
+        # 段ごとの 1 IO あたり ns と全体に占める割合。ios を省略すると resolve の回数 (完了数) で割る
+        totals = self.totals()
+        if ios is None:
+            ios = totals[self.stages[-1]][1]
+        overall = sum(total for total, _ in totals.values())
+        return {stage: {'calls': calls, 'ns_per_io': total / ios if ios else 0,
+                        'share': total / overall if overall else 0}
+                for stage, (total, calls) in totals.items()}
+
+    def format_report(self, ios=None):
+        lines = []
+        for stage, entry in self.report(ios).items():
+            lines.append(f"  {stage:>9}: {entry['ns_per_io'] / 1e3:8.2f} us/IO {entry['share'] * 100:5.1f}% "
+                         f"({entry['calls']} calls)")
+        return '\n'.join(lines)
@@ -0,0 +1,177 @@
+import argparse
+import sys
+import threading
+import time
+
+import numpy as np
+
+from .async_bsg_executer import bsg_with_ata_command_executor
+from .ata_command import xfer_protocol
+from .command_batch import command_batch
+from .command_trace import (TRACE_FIELDS, TRACE_HEADER, TRACE_MAGIC, TRACE_RECORD, FLAG_512_BLOCK, FLAG_EXT_COMMAND,
+                            FLAG_FAILED)
+from .simulated_ata_device import simulated_ata_device, simulated_transport
+
+# command_trace.TRACE_RECORD と同じ並びの構造化 dtype
+TRACE_DTYPE = np.dtype({
+    'names': list(TRACE_FIELDS),
+    'formats': ['<u8'] * 4 + ['<u4'] * 3 + ['<u2'] * 4 + ['u1'] * 7,
+    'itemsize': TRACE_RECORD.size,
+})
+_FPDMA_VALUES = (xfer_protocol.read_fpdma.value, xfer_protocol.write_fpdma.value)
+# トレースにはデータが残らないので、これらはゼロで埋めたデータで書き込むことになる (DATA SET MANAGEMENT も含む)
+_WRITE_VALUES = (xfer_protocol.write_pio.value, xfer_protocol.write_dma.value, xfer_protocol.write_fpdma.value)
+
+def write_mask(records):
+    return np.isin(records['protocol'], _WRITE_VALUES)
+
+def read_trace(path):
+    # (ヘッダの dict, レコードの構造化配列) を返す
+    with open(path, 'rb') as f:
+        magic, version, record_size, wall_ns, perf_ns = TRACE_HEADER.unpack(f.read(TRACE_HEADER.size))
+        if magic != TRACE_MAGIC or record_size != TRACE_RECORD.size:
+            raise ValueError(f"{path} is not an ATA trace (magic={magic!r}, record_size={record_size})")
+        records = np.fromfile(f, dtype=TRACE_DTYPE)
+    return {'version': version, 'wall_ns': wall_ns, 'perf_ns': perf_ns}, records
+
+def trace_batch(records):
+    # トレースから command_batch を作る。NCQ タグは executor が振り直すので COUNT から外す
+    count = records['count']
+    count = np.where(np.isin(records['protocol'], _FPDMA_VALUES), count & 0xFF07, count)
+    return command_batch.from_columns(
+        lba=records['lba'], feature=records['feature'], count=count, icc=records['icc'],
+        auxiliary=records['auxiliary'], device=records['device'], command=records['command'],
+        protocol=records['protocol'], transfer_length=records['transfer_length'],
+        is_512_block=(records['flags'] & FLAG_512_BLOCK) != 0, ext_command=(records['flags'] & FLAG_EXT_COMMAND) != 0,
+    )
+
+def summarize(records):
+    # トレース全体のレイテンシ (us) とスループット
+    if not len(records):
+        return {'ios': 0}
+    order = np.argsort(records['submit_ns'], kind='stable')
+    records = records[order]
+    total = (records['complete_ns'] - records['submit_ns']).astype(np.float64) / 1e3
+    service = (records['complete_ns'] - records['issue_ns']).astype(np.float64) / 1e3
+    span = (int(records['complete_ns'].max()) - int(records['submit_ns'][0])) / 1e9
+    good = (records['driver_status'] == 0) & (records['transport_status'] == 0) & (records['device_status'] == 0) & \
+        (records['flags'] & FLAG_FAILED == 0)
+    percentiles = (50, 99, 99.9)
+    return {
+        'ios': len(records),
+        'errors': int((~good).sum()),
+        'span_s': span,
+        'iops': len(records) / span if span else 0,
+        'mb_per_s': int(records['transfer_length'].sum(dtype=np.int64)) / span / 1e6 if span else 0,
+        'total_us': dict(zip(('p50', 'p99', 'p99.9'), np.percentile(total, percentiles).tolist()), mean=float(total.mean())),
+        'service_us': dict(zip(('p50', 'p99', 'p99.9'), np.percentile(service, percentiles).tolist()),
+                           mean=float(service.mean())),
+    }
+
+class trace_replayer:
+    # 記録時の投入間隔どおり (speed 倍速) にコマンドを投げ直す。speed=None は間隔を無視して queue_depth 分ずつ流す
+    # 書き込みのデータは記録されていないので、allow_writes=True のときだけゼロ埋めで書き込み、既定では飛ばす
+    def __init__(self, records, speed=1.0, allow_writes=False):
+        order = np.argsort(records['submit_ns'], kind='stable')
+        records = records[order]
+        writes = write_mask(records)
+        self.write_count = int(writes.sum())
+        self.skipped_writes = 0 if allow_writes else self.write_count
+        self.records = records if allow_writes else records[~writes]
+        self.batch = trace_batch(self.records)
+        self.speed = speed
+
+    def run(self, executor: bsg_with_ata_command_executor):
+        offsets = (self.records['submit_ns'] - self.records['submit_ns'][0]).astype(np.int64) if len(self.records) else []
+        if self.speed:
+            offsets = (offsets / self.speed).astype(np.int64).tolist()
+        window = None if self.speed else threading.BoundedSemaphore(executor.queue_depth)
+        lateness = np.zeros(len(self.records), dtype=np.int64)
+        errors = []
+
+        def on_done(future):
+            if window is not None:
+                window.release()
+            if future.exception() is not None or not future.result().is_good():
+                errors.append(future)
+
+        start = time.perf_counter_ns()
+        for index, command in enumerate(self.batch.commands()):
+            if window is not None:
+                window.acquire()
+            else:
+                due = start + offsets[index]
+                now = time.perf_counter_ns()
+                if due - now > 200_000:
+                    time.sleep((due - now - 100_000) / 1e9)  # 残りは下のスピンで合わせる
+                while now < due:
+                    now = time.perf_counter_ns()
+                lateness[index] = now - due
+            executor.submit_command(command).add_done_callback(on_done)
+        executor.drain_command()
+        elapsed = (time.perf_counter_ns() - start) / 1e9
+        return {
+            'ios': len(self.records),
+            'errors': len(errors),
+            'skipped_writes': self.skipped_writes,
+            'elapsed_s': elapsed,
+            'iops': len(self.records) / elapsed if elapsed else 0,
+            'late_us': {'mean': float(lateness.mean()) / 1e3 if len(lateness) else 0,
+                        'max': float(lateness.max()) / 1e3 if len(lateness) else 0} if self.speed else None,
+        }
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="inspect and replay ATA command traces")
+    commands = parser.add_subparsers(dest='action', required=True)
+    summary = commands.add_parser('summary', help="print latency/throughput of a trace")
+    summary.add_argument('trace')
+    dump = commands.add_parser('dump', help="print trace records")
+    dump.add_argument('trace')
+    dump.add_argument('--limit', type=int, default=None)
+    replay = commands.add_parser('replay', help="replay a trace against a device")
+    replay.add_argument('trace')
+    replay.add_argument('device', help="device node (/dev/bsg/H:C:T:L, /dev/sgN); a label for --transport sim/null")
+    replay.add_argument('--transport', default='bsg', choices=('bsg', 'sg', 'null', 'sim'))
+    replay.add_argument('--qd', type=int, default=32)
+    timing = replay.add_mutually_exclusive_group()
+    timing.add_argument('--speed', type=float, default=1.0, help="replay at N times the recorded rate")
+    timing.add_argument('--afap', action='store_true', help="ignore recorded timing, keep --qd commands in flight")
+    replay.add_argument('--trace-out', default=None, help="record the replay into this trace file")
+    replay.add_argument('--allow-writes', action='store_true',
+                        help="replay writes too; traces hold no data, so they write zeros (skipped by default)")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    header, records = read_trace(args.trace)
+    if args.action == 'summary':
+        print(summarize(records))
+    elif args.action == 'dump':
+        origin = int(records['submit_ns'].min()) if len(records) else 0
+        for record in records[:args.limit]:
+            print(f"{(int(record['submit_ns']) - origin) / 1e3:12.1f}us cmd={record['command']:#04x} "
+                  f"lba={record['lba']:#x} feature={record['feature']:#x} count={record['count']:#x} "
+                  f"len={record['transfer_length']} tag={record['tag']} "
+                  f"lat={(int(record['complete_ns']) - int(record['submit_ns'])) / 1e3:.1f}us "
+                  f"status={record['driver_status']:#x}/{record['transport_status']:#x}/{record['device_status']:#x}"
+                  + (" failed" if record['flags'] & FLAG_FAILED else ""))
+    else:
+        replayer = trace_replayer(records, None if args.afap else args.speed, args.allow_writes)
+        if args.allow_writes and replayer.write_count:
+            print(f"replaying {replayer.write_count} writes with zero-filled data", file=sys.stderr)
+        elif replayer.skipped_writes:
+            print(f"skipping {replayer.skipped_writes} writes (use --allow-writes to replay them with zero-filled data)",
+                  file=sys.stderr)
+        transport = args.transport
+        if transport == 'sim':
+            transport = simulated_transport(simulated_ata_device(queue_depth=min(args.qd, 32)))
+        with bsg_with_ata_command_executor(args.device, queue_depth=args.qd, transport=transport,
+                                           trace=args.trace_out) as executor:
+            result = replayer.run(executor)
+        print(result)
+        if args.trace_out:
+            print(summarize(read_trace(args.trace_out)[1]))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+import numpy as np
+
+from .ata_command import xfer_protocol
+from .command_batch import command_batch
+
+DISTRIBUTIONS = ('uniform', 'zipf', 'hotspot', 'seq')
+
+_SCRAMBLE_PRIME = 2654435761  # ランクをブロック番号へ散らす乗数 (素数なので N と互いに素なら全単射)
+_ZETA_EXACT_TERMS = 1 << 20
+
+def _zeta(n, theta):
+    # sum(1 / i^theta, i=1..n)。大きな n は先頭だけ厳密に足し、残りは積分で近似する
+    exact = min(n, _ZETA_EXACT_TERMS)
+    total = float(np.sum(np.arange(1, exact + 1, dtype=np.float64) ** -theta))
+    if n > exact:
+        total += ((n + 0.5) ** (1 - theta) - (exact + 0.5) ** (1 - theta)) / (1 - theta)
+    return total
+
+class workload_generator:
+    # LBA/転送長/読み書きの列を chunk 個ずつまとめて乱数生成し、command_batch として返す。
+    # 同じ seed と chunk なら同じ列になる
+    #   uniform: 全域一様
+    #   zipf   : ランク i の確率が 1/i^zipf_theta (YCSB 方式。scramble でホットブロックを全域に散らす)
+    #   hotspot: 先頭 hot_fraction の領域に hot_access の割合でアクセスする
+    #   seq    : stride_sectors (既定は転送長) ずつ進むシーケンシャル。終端で先頭に戻る
+    def __init__(self, distribution='uniform', lba_start=0, lba_range=0x0800_0000, block_sectors=8,
+                 block_weights=None, rwmix_read=100, fpdma=True, seed=None, chunk=4096, zipf_theta=0.99,
+                 scramble=True, hot_fraction=0.2, hot_access=0.8, stride_sectors=None, align_sectors=None,
+                 sector_size=512):
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"distribution must be one of {DISTRIBUTIONS}, got {distribution!r}")
+        self.sizes = np.atleast_1d(np.asarray(block_sectors, dtype=np.int64))
+        if (self.sizes < 1).any() or (self.sizes > 0x10000).any():
+            raise ValueError(f"block_sectors must be 1-65536, got {block_sectors}")
+        self.weights = None
+        if block_weights is not None:
+            weights = np.asarray(block_weights, dtype=np.float64)
+            self.weights = weights / weights.sum()
+        self.align = int(align_sectors or self.sizes.min())
+        self.blocks = (lba_range - int(self.sizes.max())) // self.align + 1  # 転送が範囲をはみ出さない開始位置の数
+        if self.blocks < 1:
+            raise ValueError(f"lba_range {lba_range} is smaller than the largest block {self.sizes.max()}")
+        if not 0 <= rwmix_read <= 100:
+            raise ValueError(f"rwmix_read must be 0-100, got {rwmix_read}")
+        self.distribution = distribution
+        self.lba_start = lba_start
+        self.lba_range = lba_range
+        self.rwmix_read = rwmix_read
+        self.sector_size = sector_size
+        self.fpdma = fpdma
+        self.chunk = chunk
+        self.rng = np.random.default_rng(seed)
+        self.scramble = scramble
+        self.hot_blocks = max(int(self.blocks * hot_fraction), 1)
+        self.hot_access = hot_access
+        self.stride = stride_sectors
+        self.position = 0  # seq の次の開始セクタ (lba_start からの相対)
+        if distribution == 'zipf':
+            if not 0 < zipf_theta < 1:
+                raise ValueError(f"zipf_theta must be in (0, 1), got {zipf_theta}")
+            if scramble and self.blocks >= 1 << 32:
+                raise ValueError(f"scrambled zipf supports at most 2^32 blocks, got {self.blocks}")
+            zetan = _zeta(self.blocks, zipf_theta)
+            self.zipf = (
+                zipf_theta,
+                zetan,
+                1 / (1 - zipf_theta),
+                (1 - (2 / self.blocks) ** (1 - zipf_theta)) / (1 - _zeta(2, zipf_theta) / zetan),
+            )
+
+    def _lengths(self, n):
+        if len(self.sizes) == 1:
+            return np.full(n, self.sizes[0], dtype=np.int64)
+        return self.rng.choice(self.sizes, size=n, p=self.weights)
+
+    def _zipf_ranks(self, n):
+        theta, zetan, alpha, eta = self.zipf
+        u = self.rng.random(n)
+        uz = u * zetan
+        ranks = (self.blocks * (eta * u - eta + 1) ** alpha).astype(np.int64)
+        ranks = np.where(uz < 1 + 0.5 ** theta, 1, ranks)
+        ranks = np.where(uz < 1, 0, ranks)
+        np.minimum(ranks, self.blocks - 1, out=ranks)
+        if self.scramble:
+            ranks = (ranks.astype(np.uint64) * np.uint64(_SCRAMBLE_PRIME % self.blocks)
+                     % np.uint64(self.blocks)).astype(np.int64)
+        return ranks
+
+    def _block_indices(self, n, lengths):
+        if self.distribution == 'uniform':
+            return self.rng.integers(0, self.blocks, n)
+        if self.distribution == 'zipf':
+            return self._zipf_ranks(n)
+        if self.distribution == 'hotspot':
+            hot = self.rng.random(n) < self.hot_access
+            cold_blocks = self.blocks - self.hot_blocks
+            if cold_blocks <= 0:
+                return self.rng.integers(0, self.blocks, n)
+            return np.where(hot, self.rng.integers(0, self.hot_blocks, n),
+                            self.hot_blocks + self.rng.integers(0, cold_blocks, n))
+        steps = lengths if self.stride is None else np.full(n, self.stride, dtype=np.int64)
+        offsets = self.position + np.cumsum(steps) - steps
+        self.position = int(offsets[-1] + steps[-1]) % (self.blocks * self.align)
+        return (offsets // self.align) % self.blocks
+
+    def next_batch(self, n=None):
+        n = n or self.chunk
+        lengths = self._lengths(n)
+        lbas = self.lba_start + self._block_indices(n, lengths) * self.align
+        is_read = self.rng.random(n) * 100 < self.rwmix_read
+        sectors = lengths & 0xFFFF  # 65536 セクタは 0 で表す
+        if self.fpdma:
+            codes = np.where(is_read, 0x60, 0x61)
+            protocols = np.where(is_read, xfer_protocol.read_fpdma.value, xfer_protocol.write_fpdma.value)
+            feature, count = sectors, 0
+        else:
+            codes = np.where(is_read, 0x25, 0x35)
+            protocols = np.where(is_read, xfer_protocol.read_dma.value, xfer_protocol.write_dma.value)
+            feature, count = 0, sectors
+        return command_batch.from_columns(lba=lbas, feature=feature, count=count, device=0x40, command=codes,
+                                          protocol=protocols, transfer_length=lengths * self.sector_size)
+
+    def batches(self, io_count=None):
+        # io_count 個 (None なら無限に) を chunk 個ずつ返す
+        remaining = io_count
+        while remaining is None or remaining > 0:
+            n = self.chunk if remaining is None else min(self.chunk, remaining)
+            yield self.next_batch(n)
+            if remaining is not None:
+                remaining -= n
+
+    def commands(self, io_count=None):
+        for batch in self.batches(io_count):
+            yield from batch.commands()
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+# リポジトリ直下から ata_tool を読み込む (インストール不要)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ata_tool.async_bsg_executer import bsg_with_ata_command_executor
+from ata_tool.simulated_ata_device import simulated_ata_device, simulated_transport
+
+@pytest.fixture
+def make_executor():
+    # シミュレータにつないだ executor を作る。テスト終了時にまとめて close() する
+    executors = []
+
+    def make(device=None, queued=True, iovec=True, transport=None, **kwargs):
+        # transport を渡すとそれを使う (シミュレータを継承した検査用 transport など)
+        transport = transport or simulated_transport(device or simulated_ata_device(), queued=queued, iovec=iovec)
+        kwargs.setdefault('queue_depth', 8)
+        executor = bsg_with_ata_command_executor('sim', transport=transport, **kwargs)
+        executors.append(executor)
+        return executor
+
+    yield make
+    for executor in executors:
+        executor.close()
@@ -0,0 +1,39 @@
+import threading
+
+from ata_tool.ata_command import ATA_COMMAND, xfer_protocol
+from ata_tool.simulated_ata_device import simulated_ata_device
+
+def new_threads(before):
+    # 前のテストのスレッドが終わりかけていても数がずれないよう、増えた分だけを見る
+    return [thread for thread in threading.enumerate() if thread not in before]
+
+def read_command(lba):
+    return ATA_COMMAND(count=1, lba=lba, device=0x40, command=0x25, protocol=xfer_protocol.read_dma,
+                       transfer_length=512)
+
+def test_sync_transport_uses_a_fixed_worker_pool(make_executor):
+    device = simulated_ata_device(service_time_us=500)
+    for lba in range(200):
+        device.store.write_from(lba, 1, lba.to_bytes(2, 'little') * 256)
+    before = set(threading.enumerate())
+    executor = make_executor(device, queued=False, queue_depth=4)
+    assert len(new_threads(before)) == 4
+    futures = [executor.submit_command(read_command(lba)) for lba in range(200)]
+    # コマンドの数だけスレッドを作らない
+    assert len(new_threads(before)) == 4
+    for lba, future in enumerate(futures):
+        completion = future.result(5)
+        assert completion.is_good() and completion.command.transfer_data == lba.to_bytes(2, 'little') * 256
+    executor.drain_command(timeout=5)
+    assert not executor.outstanding
+    executor.close()
+    assert new_threads(before) == []
+
+def test_queued_transport_uses_one_reaper(make_executor):
+    before = set(threading.enumerate())
+    executor = make_executor(queue_depth=16)
+    # シミュレータの時計スレッド + 刈り取りスレッド
+    assert len(new_threads(before)) == 2
+    futures = [executor.submit_command(read_command(lba)) for lba in range(100)]
+    assert all(f.result(5).is_good() for f in futures)
+    assert len(new_threads(before)) == 2
@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+from ata_tool.ata_command import ATA_COMMAND, xfer_protocol
+from ata_tool.asyncio_ata_executer import asyncio_ata_executor
+from ata_tool.simulated_ata_device import simulated_ata_device, simulated_transport
+
+def reads(lbas):
+    return [ATA_COMMAND(feature=1, lba=lba, device=0x40, command=0x60, protocol=xfer_protocol.read_fpdma,
+                        transfer_length=512) for lba in lbas]
+
+@pytest.mark.parametrize('queued', [True, False])
+def test_completions_return_every_command(queued):
+    device = simulated_ata_device(service_time_us=1000, jitter_us=500)
+    for lba in range(64):
+        device.store.write_from(lba, 1, bytes([lba]) * 512)
+
+    async def run():
+        async with asyncio_ata_executor('sim', queue_depth=8,
+                                        transport=simulated_transport(device, queued=queued)) as executor:
+            seen = []
+            async for completion in executor.completions(reads(range(64))):
+                assert completion.is_good()
+                seen.append(completion.command.transfer_data[0])
+            single = await executor.run(reads([5])[0])
+            return seen, single.command.transfer_data
+
+    seen, single = asyncio.run(run())
+    assert sorted(seen) == list(range(64)) and single == bytes([5]) * 512
+
+def test_errors_and_drain():
+    device = simulated_ata_device(service_time_us=2000)
+    device.inject_error(3, 3, 'unc')
+
+    async def run():
+        executor = asyncio_ata_executor('sim', queue_depth=4, transport=simulated_transport(device))
+        waiters = [executor.submit(command) for command in reads(range(6))]
+        await executor.drain()
+        assert all(waiter.done() for waiter in waiters) and not executor.waiters
+        executor.close()
+        return [waiter.result().is_good() for waiter in waiters]
+
+    assert asyncio.run(run()) == [True, True, True, False, True, True]
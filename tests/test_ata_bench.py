@@ -0,0 +1,34 @@
+import json
+
+import pytest
+
+from ata_tool.ata_bench import build_parser, format_result, main, parse_size, run
+
+def bench(*options):
+    return run(build_parser().parse_args(['sim0', '--transport', 'sim', '--seed', '1', *options]))
+
+def test_parse_size():
+    assert parse_size('4k') == 4096 and parse_size('1.5m') == 1536 * 1024 and parse_size('0x200') == 512
+
+@pytest.mark.parametrize('options', [
+    ('--opcode', 'read_fpdma', '--qd', '8'),
+    ('--opcode', 'write_dma_ext', '--qd', '4', '--sim-sync', '--pattern', 'seq'),
+    ('--opcode', 'read_dma_ext', '--qd', '4', '--elevator', '--profile'),
+])
+def test_runs_on_the_simulator(options):
+    result = bench('--io-count', '500', '--bs', '8k', *options)
+    assert result['ios'] == 500 and result['errors'] == 0
+    assert result['latency_us']['total']['count'] == 500
+    assert (result['stages'] is not None) == ('--profile' in options)
+    assert 'IOPS=' in format_result(result)
+
+def test_rwmix_splits_reads_and_writes():
+    result = bench('--io-count', '2000', '--opcode', 'read_fpdma', '--rwmix-read', '25')
+    assert result['reads'] + result['writes'] == 2000
+    assert 0.2 < result['reads'] / 2000 < 0.3
+
+def test_json_output_and_bad_block_size(capsys):
+    assert main(['sim0', '--transport', 'sim', '--io-count', '10', '--json']) == 0
+    assert json.loads(capsys.readouterr().out)['ios'] == 10
+    with pytest.raises(ValueError, match='multiple of 512'):
+        bench('--bs', '1000')
@@ -0,0 +1,43 @@
+import ctypes
+import time
+
+from ata_tool.ata_buffer_pool import PAGE_SIZE, ata_buffer_pool
+from ata_tool.ata_command import ATA_COMMAND, xfer_protocol
+
+def test_slots_are_page_aligned():
+    pool = ata_buffer_pool(slot_count=3, slot_size=PAGE_SIZE + 1)
+    assert pool.slot_size == 2 * PAGE_SIZE
+    assert pool.fits(2 * PAGE_SIZE) and not pool.fits(2 * PAGE_SIZE + 1)
+    assert all(ctypes.addressof(slot.data) % PAGE_SIZE == 0 for slot in pool.slots)
+    assert len({ctypes.addressof(slot.sense) for slot in pool.slots}) == 3
+
+def test_nowait_waiters_get_released_slots_in_order():
+    pool = ata_buffer_pool(slot_count=1, slot_size=4096)
+    slot = pool.acquire_nowait(None)
+    assert slot is not None and pool.in_use() == 1
+    handed = []
+    assert pool.acquire_nowait(lambda s: handed.append(('a', s))) is None
+    assert pool.acquire_nowait(lambda s: handed.append(('b', s))) is None
+    slot.sense[0] = 0x72
+    pool.release(slot)
+    assert handed == [('a', slot)] and slot.sense[0] == 0  # 引き渡す前に sense を消す
+    pool.release(slot)
+    assert [name for name, _ in handed] == ['a', 'b']
+    pool.release(slot)
+    assert pool.in_use() == 0
+
+def test_held_completions_do_not_block_the_submitter(make_executor):
+    executor = make_executor(buffer_slots=2, zero_copy=True)
+    start = time.perf_counter()
+    futures = [executor.submit_command(ATA_COMMAND(count=1, lba=lba, device=0x40, command=0x25,
+                                                   protocol=xfer_protocol.read_dma, transfer_length=512))
+               for lba in range(4)]
+    assert time.perf_counter() - start < 1
+    held = [f.result(5) for f in futures[:2]]
+    assert not futures[2].done() and executor.buffer_pool.in_use() == 2
+    for completion in held:
+        completion.release()
+    assert all(f.result(5).is_good() for f in futures[2:])
+    for f in futures[2:]:
+        f.result().release()
+    assert executor.buffer_pool.in_use() == 0
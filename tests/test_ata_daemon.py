@@ -0,0 +1,63 @@
+import socket
+
+import numpy as np
+import pytest
+
+from ata_tool.ata_command import xfer_protocol
+from ata_tool.ata_daemon import MSG_ERROR, MSG_REPLY, ata_daemon, ata_daemon_client, recv_frame, send_frame
+from ata_tool.command_batch import command_batch
+
+def io_batch(lbas, sectors, is_read):
+    protocol = xfer_protocol.read_fpdma if is_read else xfer_protocol.write_fpdma
+    return command_batch.from_columns(lba=lbas, feature=sectors, device=0x40, command=0x60 if is_read else 0x61,
+                                      protocol=protocol, transfer_length=np.asarray(sectors) * 512)
+
+@pytest.fixture
+def daemon(tmp_path):
+    with ata_daemon(['sim0'], socket_path=str(tmp_path / 'ata.sock'), frame_bytes=1024, transport='sim') as daemon:
+        yield daemon.start()
+
+def test_frame_round_trip():
+    left, right = socket.socketpair()
+    with left, right:
+        send_frame(left, MSG_REPLY, 7, b'x' * 70000, device=3)  # 2 回に分けて送る大きさ
+        send_frame(left, MSG_ERROR, 8)
+        assert recv_frame(right) == (MSG_REPLY, 3, 7, b'x' * 70000)
+        assert recv_frame(right) == (MSG_ERROR, 0, 8, b'')
+
+def test_batch_round_trip(daemon):
+    lbas, sectors = [0, 8, 100], [1, 2, 3]
+    written = np.random.default_rng(0).integers(0, 256, sum(sectors) * 512, dtype=np.uint8).tobytes()
+    with ata_daemon_client(daemon.socket_path) as client:
+        assert [device['path'] for device in client.devices()] == ['sim0']
+        results = client.run_batch(io_batch(lbas, sectors, is_read=False), write_data=written)
+        assert [entry[0] for entry in results] == [0, 1, 2]
+        assert all(entry[1:4] == (0, 0, 0) for entry in results)
+        results = client.run_batch(io_batch(lbas, sectors, is_read=True), return_data=True)
+        assert b''.join(entry[8] for entry in results) == written
+        assert client.last_batch['completed'] == 3 and client.last_batch['failed'] == 0
+        assert client.stats()['commands'] == 6
+
+def test_bad_batch_is_an_error_frame(daemon):
+    with ata_daemon_client(daemon.socket_path) as client:
+        with pytest.raises(RuntimeError, match='write data must be empty'):
+            client.run_batch(io_batch([0], [1], is_read=False), write_data=b'short')
+        # 接続はそのまま使える
+        assert client.devices()[0]['index'] == 0
+
+def test_submit_failure_is_reported_per_entry(daemon):
+    executor = daemon.executors[0]
+    submit = executor.submit_command
+
+    def failing_submit(command):
+        if command.lba == 8:
+            raise OSError("submit refused")
+        return submit(command)
+
+    executor.submit_command = failing_submit
+    with ata_daemon_client(daemon.socket_path) as client:
+        results = client.run_batch(io_batch([0, 8, 100], [1, 1, 1], is_read=True), return_data=True)
+        assert results[1][7] == b'OSError: submit refused' and results[1][8] == b''
+        # 失敗した行の前後に投入した分はそのまま完了が返る
+        assert len(results[0][8]) == 512 and len(results[2][8]) == 512
+        assert client.last_batch['completed'] == 3 and client.last_batch['failed'] == 1
@@ -0,0 +1,55 @@
+import errno
+import io
+
+import pytest
+
+from ata_tool.ata_imaging import drive_imager
+from ata_tool.simulated_ata_device import simulated_ata_device
+
+def filled_device(sectors):
+    device = simulated_ata_device(capacity=4096)
+    for lba in range(sectors):
+        device.store.write_from(lba, 1, lba.to_bytes(4, 'little') * 128)
+    return device
+
+def expected_image(first, last):
+    return b''.join(lba.to_bytes(4, 'little') * 128 for lba in range(first, last))
+
+@pytest.mark.parametrize('iovec', [True, False])
+@pytest.mark.parametrize('queued', [True, False])
+@pytest.mark.parametrize('zero_copy', [True, False])
+def test_image_matches_device_in_order(make_executor, iovec, queued, zero_copy):
+    executor = make_executor(filled_device(300), queued=queued, iovec=iovec, zero_copy=zero_copy,
+                             buffer_slots=5, max_pooled_transfer=16 * 512)
+    executor.transport.device.jitter_us = 200  # 完了順を入れ替える
+    imager = drive_imager(executor, 3, 290, chunk_sectors=16, in_flight=4)
+    assert imager.direct is iovec
+    output = io.BytesIO()
+    assert imager.image(output) == 287 * 512
+    assert output.getvalue() == expected_image(3, 290)
+    assert executor.buffer_pool.in_use() == 0
+
+@pytest.mark.parametrize('iovec', [True, False])
+def test_skip_errors_zero_fills_bad_chunks(make_executor, iovec):
+    device = filled_device(64)
+    device.inject_error(20, 20)
+    executor = make_executor(device, iovec=iovec, zero_copy=True)
+    imager = drive_imager(executor, 0, 64, chunk_sectors=16, in_flight=2, skip_errors=True)
+    output = io.BytesIO()
+    imager.image(output)
+    image = output.getvalue()
+    assert imager.bad_ranges == [(16, 16)]
+    assert image[16 * 512:32 * 512] == bytes(16 * 512)
+    assert image[:16 * 512] + image[32 * 512:] == expected_image(0, 16) + expected_image(32, 64)
+    assert executor.buffer_pool.in_use() == 0
+
+@pytest.mark.parametrize('iovec', [True, False])
+def test_read_error_aborts_and_returns_slots(make_executor, iovec):
+    device = filled_device(64)
+    device.inject_error(5, 5)
+    executor = make_executor(device, iovec=iovec, zero_copy=True)
+    imager = drive_imager(executor, 0, 64, chunk_sectors=4, in_flight=4)
+    with pytest.raises(OSError) as error:
+        imager.image(io.BytesIO())
+    assert error.value.errno == errno.EIO
+    assert executor.buffer_pool.in_use() == 0
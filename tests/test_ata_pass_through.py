@@ -0,0 +1,68 @@
+import random
+
+import pytest
+
+from ata_tool.ata_command import ATA_COMMAND, xfer_protocol
+from ata_tool.ata_pass_through import ATA_PASS_THROUGH_32, ATA_PT_PROTOCOL, pack_ata_command_into
+from ata_tool.command_batch import command_batch
+
+def legacy_cdb(command):
+    # 以前の executor と同じ組み立て方
+    ata_pt = ATA_PASS_THROUGH_32()
+    ata_pt.extend = command.ext_command
+    ata_pt.t_type = True
+    ata_pt.t_dir = command.protocol.is_read_xfer()
+    ata_pt.byt_blok = not command.is_512_block
+    ata_pt.t_length = 0b11
+    ata_pt.protocol = ATA_PT_PROTOCOL[command.protocol]
+    ata_pt.features = command.feature
+    ata_pt.sector_count = command.count
+    ata_pt.lba = command.lba
+    ata_pt.device = command.device
+    ata_pt.command = command.command
+    if command.ext_command:
+        ata_pt.icc = command.icc
+        ata_pt.auxiliary = command.auxiliary
+    return bytes(ata_pt.cdb())
+
+def random_commands(count, seed=0):
+    rng = random.Random(seed)
+    commands = []
+    for _ in range(count):
+        protocol = rng.choice(list(ATA_PT_PROTOCOL))
+        ext = rng.random() < 0.7
+        commands.append(ATA_COMMAND(
+            feature=rng.randrange(0x10000 if ext else 0x100),
+            count=rng.randrange(0x10000 if ext else 0x100),
+            lba=rng.randrange(1 << 48 if ext else 1 << 28),
+            icc=rng.randrange(0x100) if ext else 0,
+            auxiliary=rng.randrange(1 << 32) if ext else 0,
+            device=rng.choice((0x40, 0xE0, 0x00)),
+            command=rng.randrange(0x100),
+            protocol=protocol,
+            is_512_block=rng.random() < 0.5,
+            ext_command=ext,
+        ))
+    return commands
+
+def test_pack_into_matches_legacy_cdb():
+    buffer = bytearray(64)
+    for command in random_commands(500):
+        pack_ata_command_into(buffer, 32, command)
+        assert bytes(buffer[32:]) == legacy_cdb(command), command
+
+def test_batch_cdbs_match_legacy_cdb():
+    commands = random_commands(500, seed=1)
+    batch = command_batch.from_columns(**{name: [getattr(c, name) for c in commands] for name in (
+        'feature', 'count', 'lba', 'icc', 'auxiliary', 'device', 'command', 'is_512_block', 'ext_command')},
+        protocol=[c.protocol.value for c in commands])
+    cdbs = batch.cdbs()
+    assert len(cdbs) == 32 * len(commands)
+    for index, command in enumerate(commands):
+        assert bytes(cdbs[32 * index:32 * (index + 1)]) == legacy_cdb(command), index
+
+def test_unsupported_protocol_is_rejected():
+    batch = command_batch.from_columns(lba=[0, 0], protocol=[xfer_protocol.read_dma.value, xfer_protocol.dma.value],
+                                       validate=False)
+    with pytest.raises(ValueError, match='Unsupported transfer protocol at index 1'):
+        batch.cdbs()
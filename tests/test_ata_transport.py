@@ -0,0 +1,93 @@
+import ctypes
+import errno
+import os
+import threading
+from collections import deque
+
+from ata_tool.ata_command import ATA_COMMAND, xfer_protocol
+from ata_tool.ata_transport import SG_IO_HDR, build_iovec, io_request, sg_v3_transport
+from ata_tool.simulated_ata_device import simulated_transport
+
+def make_request(is_read=True, length=512):
+    return io_request(None, (ctypes.c_ubyte * 32)(), (ctypes.c_ubyte * 32)(), (ctypes.c_ubyte * length)(),
+                      length, is_read)
+
+def idle_sg_transport(queue_depth):
+    # デバイスを開かずに、完了が 1 つも届いていない (読むと EAGAIN) 状態の sg_v3_transport を作る
+    transport = sg_v3_transport.__new__(sg_v3_transport)
+    read_end, write_end = os.pipe2(os.O_NONBLOCK)
+    transport.queue_depth = queue_depth
+    transport.fds = [read_end]
+    transport.fd = read_end
+    transport.fd_load = {read_end: 0}
+    transport.in_flight = {}
+    transport.pending = deque()
+    transport.next_pack_id = 0
+    transport.lock = threading.Lock()
+    return transport, write_end
+
+def test_sg_header_uses_iovec_count():
+    transport, write_end = idle_sg_transport(1)
+    request = make_request()
+    request.iovec, request.buffers, _ = build_iovec([bytearray(256), bytearray(256)])
+    hdr = transport._header(request)
+    assert hdr.iovec_count == 2 and hdr.dxfer_len == 512
+    assert hdr.dxferp == ctypes.addressof(request.iovec)
+    assert ctypes.sizeof(SG_IO_HDR) == 88
+    os.close(write_end)
+    os.close(transport.fd)
+
+def test_failed_deferred_write_is_returned_and_reaping_continues():
+    transport, write_end = idle_sg_transport(2)
+    bad, good = make_request(), make_request()
+    transport.pending.extend([bad, good])
+    written = []
+
+    def write(request):
+        if request is bad:
+            raise OSError(errno.ENOMEM, "no memory")
+        written.append(request)
+        transport.in_flight[request.pack_id] = (transport.fd, request)
+
+    transport._write = write
+    completed = transport.reap_fd(transport.fd)
+    assert completed == [bad] and bad.error.errno == errno.ENOMEM
+    assert written == [good] and not transport.pending
+    os.close(write_end)
+    os.close(transport.fd)
+
+class failing_transport(simulated_transport):
+    # lba 13 のコマンドは発行に失敗したことにし、reap() は 1 回目だけ例外を出す
+    def __init__(self):
+        super().__init__()
+        self.reap_failures = 1
+
+    def submit(self, request):
+        if request.command.lba != 13:
+            return super().submit(request)
+        request.error = OSError(errno.EAGAIN, "queue full")
+        with self.lock:
+            self.completed.append(request)
+        os.eventfd_write(self.event_fd, 1)
+
+    def reap(self, timeout=None):
+        if self.reap_failures:
+            self.reap_failures -= 1
+            raise OSError(errno.EIO, "reap failed")
+        return super().reap(timeout)
+
+def test_executor_fails_only_the_unwritten_command(capsys):
+    from ata_tool.async_bsg_executer import bsg_with_ata_command_executor
+    executor = bsg_with_ata_command_executor('sim', transport=failing_transport(), queue_depth=4)
+    try:
+        commands = [ATA_COMMAND(count=1, lba=lba, device=0x40, command=0x25, protocol=xfer_protocol.read_dma,
+                                transfer_length=512) for lba in (12, 13, 14)]
+        futures = [executor.submit_command(command) for command in commands]
+        assert futures[0].result(5).is_good() and futures[2].result(5).is_good()
+        assert futures[1].exception(5).errno == errno.EAGAIN
+        executor.drain_command(timeout=5)
+        assert executor.buffer_pool.in_use() == 0
+        assert all(thread.is_alive() for thread in executor.io_thread)
+    finally:
+        executor.close()
+    assert 'reaping completions failed' in capsys.readouterr().err
@@ -0,0 +1,59 @@
+import errno
+
+import numpy as np
+import pytest
+
+from ata_tool.ata_command import ATA_COMMAND, xfer_protocol
+from ata_tool.ata_trim import DSM_MAX_RANGE, dsm_trimmer, normalize_extents, pack_dsm_ranges
+from ata_tool.simulated_ata_device import simulated_ata_device
+
+def test_normalize_merges_and_splits():
+    lbas, lengths = normalize_extents([100, 0, 10, 50, 105, 300], [10, 10, 5, 0, 20, 3 * DSM_MAX_RANGE + 1])
+    # 0-9 と 10-14 は隣接、100-109 と 105-124 は重なる、長さ 0 は捨てる
+    assert lbas.tolist() == [0, 100, 300, 300 + DSM_MAX_RANGE, 300 + 2 * DSM_MAX_RANGE, 300 + 3 * DSM_MAX_RANGE]
+    assert lengths.tolist() == [15, 25, DSM_MAX_RANGE, DSM_MAX_RANGE, DSM_MAX_RANGE, 1]
+    assert normalize_extents([], [])[0].size == 0
+    with pytest.raises(ValueError):
+        normalize_extents([0, 1], [1])
+    with pytest.raises(ValueError):
+        normalize_extents([-1], [1])
+
+def test_pack_ranges_into_padded_blocks():
+    payload = pack_dsm_ranges([0x1234_5678_9ABC, 7], [DSM_MAX_RANGE, 1])
+    assert len(payload) == 64 and payload.tobytes()[16:] == bytes(62 * 8)
+    assert payload.tobytes()[:8] == bytes.fromhex('bc9a78563412ffff')
+    assert int(payload[1]) == (1 << 48) | 7
+    assert len(pack_dsm_ranges(np.arange(65), np.ones(65))) == 128
+
+def read(executor, lba, sectors):
+    completion = executor.submit_command(ATA_COMMAND(count=sectors, lba=lba, device=0x40, command=0x25,
+                                                     protocol=xfer_protocol.read_dma,
+                                                     transfer_length=sectors * 512)).result(5)
+    assert completion.is_good()
+    return bytes(completion.command.transfer_data)
+
+def test_trim_deallocates_on_the_simulator(make_executor):
+    device = simulated_ata_device()
+    executor = make_executor(device)
+    written = bytes(range(256)) * 2 * 300
+    completion = executor.submit_command(ATA_COMMAND(count=300, lba=0, device=0x40, command=0x35,
+                                                     protocol=xfer_protocol.write_dma, transfer_length=len(written),
+                                                     transfer_data=written)).result(5)
+    assert completion.is_good()
+    trimmer = dsm_trimmer(executor, blocks_per_command=1, in_flight=2)
+    # 1 コマンド 64 範囲なので 100 範囲は 2 コマンドになる
+    assert trimmer.trim(np.arange(0, 200, 2), np.ones(100)) == 100
+    assert trimmer.stats == {'ranges': 100, 'sectors': 100, 'commands': 2}
+    data = read(executor, 0, 300)
+    for sector in range(300):
+        expected = bytes(512) if sector < 200 and sector % 2 == 0 else written[sector * 512:(sector + 1) * 512]
+        assert data[sector * 512:(sector + 1) * 512] == expected, sector
+    assert device.stats['trimmed_sectors'] == 100
+
+def test_trim_beyond_capacity_fails(make_executor):
+    executor = make_executor(simulated_ata_device(capacity=1000))
+    with pytest.raises(OSError) as error:
+        dsm_trimmer(executor).trim([900], [200])
+    assert error.value.errno == errno.EIO
+    with pytest.raises(ValueError, match='beyond max LBA'):
+        dsm_trimmer(executor, max_lba=999).trim([900], [200])
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from ata_tool.ata_command import xfer_protocol
+from ata_tool.command_batch import command_batch
+
+def io_batch(lbas, sectors, is_read):
+    protocol = xfer_protocol.read_fpdma if is_read else xfer_protocol.write_fpdma
+    return command_batch.from_columns(lba=lbas, feature=sectors, device=0x40, command=0x60 if is_read else 0x61,
+                                      protocol=protocol, transfer_length=np.asarray(sectors) * 512)
+
+def test_from_columns_validates_per_row():
+    with pytest.raises(ValueError, match='lba out of range .28 bit. at index 1'):
+        command_batch.from_columns(lba=[0, 0x1000_0000], ext_command=False, protocol=xfer_protocol.read_dma)
+    with pytest.raises(ValueError, match='feature out of range at index 2'):
+        command_batch.from_columns(lba=[0, 1, 2], feature=[1, 2, 0x10000], protocol=xfer_protocol.read_dma)
+    with pytest.raises(ValueError, match='xfer direction at index 0'):
+        command_batch.from_columns(lba=[0], protocol=xfer_protocol.dma)
+
+def test_commands_match_columns():
+    batch = io_batch([10, 20, 30], [1, 2, 3], is_read=False)
+    commands = list(batch.commands())
+    assert [c.lba for c in commands] == [10, 20, 30]
+    assert [c.transfer_length for c in commands] == [512, 1024, 1536]
+    # アリーナなしの書き込みはゼロを送る
+    assert all(c.transfer_data == bytes(c.transfer_length) for c in commands)
+    assert list(batch.data_offsets()) == [0, 512, 1536]
+    assert batch.nbytes() == 3072
+    assert batch[1].lba == 20 and len(batch[1:]) == 2
+
+@pytest.mark.parametrize('iovec', [True, False])
+@pytest.mark.parametrize('queued', [True, False])
+def test_submit_batch_arena_round_trip(make_executor, iovec, queued):
+    executor = make_executor(queued=queued, iovec=iovec, max_pooled_transfer=1024)
+    lbas, sectors = [100, 0, 50, 7], [2, 4, 1, 3]  # 4 セクタはスロットに収まらない
+    written = np.random.default_rng(0).integers(0, 256, sum(sectors) * 512, dtype=np.uint8)
+    futures = executor.submit_batch(io_batch(lbas, sectors, is_read=False), written)
+    assert all(f.result(5).is_good() for f in futures)
+    arena = bytearray(len(written))
+    futures = executor.submit_batch(io_batch(lbas, sectors, is_read=True), arena)
+    assert all(f.result(5).is_good() for f in futures)
+    assert arena == written.tobytes()
+    assert executor.buffer_pool.in_use() == 0
@@ -0,0 +1,63 @@
+import time
+
+import pytest
+
+from ata_tool.ata_command import ATA_COMMAND, xfer_protocol
+from ata_tool.command_watchdog import command_timeout, command_watchdog
+from ata_tool.simulated_ata_device import simulated_ata_device
+
+def fpdma_read(lba, timeout_ms=None):
+    return ATA_COMMAND(feature=1, lba=lba, device=0x40, command=0x60, protocol=xfer_protocol.read_fpdma,
+                       transfer_length=512, timeout_ms=timeout_ms)
+
+def wait_for(condition, seconds=5):
+    deadline = time.monotonic() + seconds
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+def test_fail_fast_holds_the_tag_until_the_command_returns(make_executor):
+    device = simulated_ata_device(queue_depth=4)
+    device.inject_error(100, 100, 'timeout')
+    watchdog = command_watchdog(deadline_ms=50)
+    executor = make_executor(device, queue_depth=4, timeout_ms=400, watchdog=watchdog)
+    start = time.perf_counter()
+    hung = executor.submit_command(fpdma_read(100))
+    error = hung.exception(2)
+    assert isinstance(error, command_timeout) and time.perf_counter() - start < 0.35
+    assert error.command.lba == 100 and error.tag in executor.held_tags
+    # 残りのタグで他のコマンドは流れ続ける
+    futures = [executor.submit_command(fpdma_read(lba)) for lba in range(8)]
+    assert all(f.result(2).is_good() for f in futures)
+    assert error.tag not in [f.result().tag for f in futures]
+    # カーネル側のタイムアウト (timeout_ms) で返ってきたらタグとバッファを解放する
+    assert wait_for(lambda: not executor.held_tags and executor.buffer_pool.in_use() == 0)
+    assert len(watchdog.events) == 1 and watchdog.in_flight() == 0
+
+def test_report_policy_uses_the_command_deadline(make_executor):
+    overdue = []
+    # 見回り間隔は既定の期限 (10 s) から決まって 100 ms になるので、コマンド側の短い期限に合わせて指定する
+    watchdog = command_watchdog(deadline_ms=10_000, policy='report', interval_ms=5, on_overdue=overdue.extend)
+    executor = make_executor(simulated_ata_device(service_time_us=100_000), watchdog=watchdog)
+    slow = executor.submit_command(fpdma_read(0, timeout_ms=20))
+    fine = executor.submit_command(fpdma_read(8))
+    # 報告だけしてコマンドはそのまま完了させる
+    assert slow.result(2).is_good() and fine.result(2).is_good()
+    assert [(report['lba'], report['deadline_ms']) for report in overdue] == [(0, 20)]
+    assert overdue[0]['age_ms'] >= 20
+
+def test_reset_policy_aborts_the_whole_queue(make_executor):
+    watchdog = command_watchdog(deadline_ms=50, policy='reset')
+    executor = make_executor(simulated_ata_device(service_time_us=2_000_000), watchdog=watchdog)
+    start = time.perf_counter()
+    futures = [executor.submit_command(fpdma_read(lba)) for lba in range(4)]
+    errors = [f.exception(2) for f in futures]
+    assert all(isinstance(error, command_timeout) for error in errors)
+    assert time.perf_counter() - start < 1
+    assert executor.transport.resets == 1 and watchdog.reset_error is None
+    # リセットでデバイスから返ってきたらタグが戻る
+    assert wait_for(lambda: not executor.held_tags and executor.tag_allocator.in_flight() == 0)
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        command_watchdog(policy='retry')
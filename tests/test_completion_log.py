@@ -0,0 +1,60 @@
+import numpy as np
+
+from ata_tool.ata_command import ATA_COMMAND, xfer_protocol
+from ata_tool.completion_log import completion_log, decode_sense
+from ata_tool.simulated_ata_device import simulated_ata_device
+
+def descriptor_sense(lba, status=0x51, error=0x40, leading=b''):
+    # descriptor 形式。leading に別のディスクリプタを置くと ATA Status Return を後ろにずらせる
+    ata = bytes((0x09, 0x0C, 0x01, error, 0, 1, (lba >> 24) & 0xFF, lba & 0xFF, (lba >> 32) & 0xFF,
+                 (lba >> 8) & 0xFF, (lba >> 40) & 0xFF, (lba >> 16) & 0xFF, 0x40, status))
+    descriptors = leading + ata
+    return bytes((0x72, 0x03, 0x11, 0x04, 0, 0, 0, len(descriptors))) + descriptors
+
+def fixed_sense(asc, ascq, lba=0, status=0, error=0):
+    sense = bytearray(18)
+    sense[0], sense[2], sense[7], sense[12], sense[13] = 0x70, 0x04, 10, asc, ascq
+    sense[3], sense[4] = error, status
+    sense[9:12] = (lba & 0xFFFFFF).to_bytes(3, 'little')
+    return bytes(sense)
+
+def test_decode_sense_formats():
+    rows = [
+        descriptor_sense(0x1234_5678_9ABC),
+        descriptor_sense(0x42, leading=bytes((0x80, 0x06)) + bytes(6)),  # ベンダー固有ディスクリプタの後ろ
+        fixed_sense(0x00, 0x1D, lba=0xABCDEF, status=0x51, error=0x04),  # SAT のパススルー情報
+        fixed_sense(0x44, 0x00, lba=0xABCDEF),  # ATA の値は入っていない
+        b'',
+    ]
+    decoded = decode_sense(np.array([np.frombuffer(row.ljust(32, b'\0'), np.uint8) for row in rows]))
+    assert decoded['ata_valid'].tolist() == [True, True, True, False, False]
+    assert decoded['ata_lba'].tolist() == [0x1234_5678_9ABC, 0x42, 0xABCDEF, 0, 0]
+    assert decoded['ata_status'].tolist() == [0x51, 0x51, 0x51, 0, 0]
+    assert decoded['ata_error'].tolist() == [0x40, 0x40, 0x04, 0, 0]
+    assert decoded['sense_key'].tolist() == [0x03, 0x03, 0x04, 0x04, 0]
+    assert (decoded['asc'].tolist(), decoded['ascq'].tolist()) == ([0x11, 0x11, 0x00, 0x44, 0], [4, 4, 0x1D, 0, 0])
+
+def test_descriptor_list_truncated_by_length():
+    sense = bytearray(descriptor_sense(7))
+    sense[7] = 13  # ATA Status Return (14 バイト) が収まらない
+    decoded = decode_sense(np.frombuffer(bytes(sense).ljust(32, b'\0'), np.uint8))
+    assert not decoded['ata_valid'][0]
+
+def test_log_reports_failed_lbas_from_the_simulator(make_executor):
+    device = simulated_ata_device()
+    device.inject_error(1005, 1006, 'unc')
+    executor = make_executor(device, completion_log=True)
+    futures = [executor.submit_command(ATA_COMMAND(count=8, lba=lba, device=0x40, command=0x25,
+                                                   protocol=xfer_protocol.read_dma, transfer_length=4096))
+               for lba in range(0, 4000, 8)]
+    assert sum(not f.result(5).is_good() for f in futures) == 1
+    log = executor.completion_log
+    assert len(log) == 500
+    assert log.failed_lbas().tolist() == [1005]
+    assert log.error_counts('sense') == {(0x03, 0x11, 0x04): 1}
+    summary = log.summary()
+    assert summary['failed'] == 1 and summary['short_transfers'] == 1
+    # 追加分だけデコードしても結果は同じ
+    executor.submit_command(ATA_COMMAND(count=8, lba=1000, device=0x40, command=0x25, protocol=xfer_protocol.read_dma,
+                                        transfer_length=4096)).result(5)
+    assert log.decode()['failed'].sum() == 2 and log.failed_lbas().tolist() == [1005]
@@ -0,0 +1,58 @@
+import json
+import os
+
+import pytest
+
+from ata_tool.async_bsg_executer import bsg_with_ata_command_executor
+from ata_tool.device_probe import _cache_path, identify, parse_identify, probe_device, read_sectors
+from ata_tool.simulated_ata_device import simulated_ata_device, simulated_transport
+
+def test_parse_identify_from_the_simulator():
+    device = simulated_ata_device(capacity=0x2_0000_0000, sector_size=4096, queue_depth=16, serial='SN 42',
+                                  model='MODEL X', firmware='FW9')
+    capabilities = parse_identify(device.identify_data(), max_transfer=512 * 1024)
+    assert (capabilities.serial, capabilities.model, capabilities.firmware) == ('SN 42', 'MODEL X', 'FW9')
+    assert capabilities.lba48 and capabilities.max_lba == 0x2_0000_0000 - 1
+    assert capabilities.logical_sector_size == capabilities.physical_sector_size == 4096
+    assert capabilities.ncq and capabilities.ncq_depth == 16 and capabilities.trim
+    assert capabilities.dsm_max_blocks == 8
+    assert capabilities.max_sectors() == 128
+    assert capabilities.executor_defaults() == {'queue_depth': 16, 'ncq_depth': 16, 'max_pooled_transfer': 512 * 1024}
+
+def test_probe_caches_by_serial(tmp_path):
+    device = simulated_ata_device(queue_depth=8)
+    transport = simulated_transport(device)
+    try:
+        capabilities = probe_device(transport, cache_dir=str(tmp_path))
+        path = _cache_path(str(tmp_path), capabilities.serial)
+        assert os.path.exists(path) and capabilities.ncq_depth == 8
+        # IDENTIFY の結果が同じデバイスならキャッシュの内容 (ログで調べた項目など) をそのまま使う
+        with open(path) as f:
+            cached = json.load(f)
+        cached['queued_trim'] = True
+        with open(path, 'w') as f:
+            json.dump(cached, f)
+        assert probe_device(transport, cache_dir=str(tmp_path)).queued_trim
+        assert not probe_device(transport, cache_dir=str(tmp_path), refresh=True).queued_trim
+        assert not probe_device(transport, cache_dir=None).queued_trim
+    finally:
+        transport.close()
+
+def test_single_commands_before_the_executor():
+    device = simulated_ata_device(capacity=100)
+    device.store.write_from(10, 1, b'\xA5' * 512)
+    transport = simulated_transport(device)
+    try:
+        assert len(identify(transport)) == 512
+        assert read_sectors(transport, 10) == b'\xA5' * 512
+        with pytest.raises(OSError, match='command 0x25 failed'):
+            read_sectors(transport, 99, count=2)
+    finally:
+        transport.close()
+
+def test_executor_probe_sizes_queues(tmp_path):
+    transport = simulated_transport(simulated_ata_device(queue_depth=4))
+    with bsg_with_ata_command_executor('sim', transport=transport, probe=True, probe_cache=str(tmp_path)) as executor:
+        assert executor.capabilities.ncq_depth == 4
+        assert executor.queue_depth == 4 and executor.tag_allocator.depth == 4
+        assert executor.buffer_pool.slot_count == 4
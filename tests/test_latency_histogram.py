@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from ata_tool.ata_command import ATA_COMMAND, xfer_protocol
+from ata_tool.latency_histogram import latency_histogram
+
+def test_buckets_cover_every_value_within_relative_error():
+    histogram = latency_histogram()
+    values = list(range(1024)) + [int(v) for v in np.geomspace(1024, 1 << 41, 2000)]
+    for value in values:
+        index = histogram._index(value)
+        low, high = histogram._value(index), histogram._value(index + 1)
+        assert low <= value < high
+        assert high - low <= max(1, value >> histogram.sub_bucket_bits)
+
+def test_percentiles_track_exact_values():
+    values = np.random.default_rng(0).lognormal(11, 1.5, 20000).astype(np.int64)
+    histogram = latency_histogram()
+    for value in values.tolist():
+        histogram.record(value)
+    for percent in (50, 90, 99, 99.9):
+        exact = np.percentile(values, percent, method='inverted_cdf')
+        assert histogram.percentile(percent) == pytest.approx(exact, rel=2 ** -6)
+    assert histogram.percentile(100) == histogram.max == values.max()
+    assert histogram.mean() == pytest.approx(values.mean())
+
+def test_merge_and_snapshot_reset():
+    first, second = latency_histogram(), latency_histogram()
+    for value in range(1000):
+        (first if value % 2 else second).record(value)
+    merged = latency_histogram().merge(first).merge(second)
+    assert merged.total == 1000 and merged.max == 999 and merged.percentile(50) == 499
+    copy = merged.snapshot(reset=True)
+    assert copy.total == 1000 and merged.total == 0 and merged.percentile(50) == 0
+    with pytest.raises(ValueError):
+        merged.merge(latency_histogram(sub_bucket_bits=5))
+    # 上限を超える値は最後のバケットに入る
+    clipped = latency_histogram(max_value_bits=20)
+    clipped.record(1 << 30)
+    assert clipped.total == 1 and clipped.counts[-1] == 1
+
+def test_executor_records_per_opcode_latency(make_executor):
+    executor = make_executor()
+    futures = [executor.submit_command(ATA_COMMAND(count=1, lba=lba, device=0x40, command=0x25,
+                                                   protocol=xfer_protocol.read_dma, transfer_length=512))
+               for lba in range(10)]
+    assert all(f.result(5).is_good() for f in futures)
+    snapshot = executor.latency.snapshot()
+    assert snapshot['total'][0x25].total == 10 and snapshot['service']['all'].total == 10
+    assert snapshot['total']['all'].percentile(50) >= snapshot['service']['all'].percentile(50) > 0
@@ -0,0 +1,98 @@
+import pytest
+
+from ata_tool.ata_command import ATA_COMMAND, xfer_protocol
+from ata_tool.lba_scheduler import elevator_scheduler
+from ata_tool.simulated_ata_device import simulated_ata_device
+
+def read_command(lba, sectors, buffers=None):
+    return ATA_COMMAND(count=sectors, lba=lba, device=0x40, command=0x25, protocol=xfer_protocol.read_dma,
+                       transfer_length=sectors * 512, transfer_buffers=buffers)
+
+def write_command(lba, payload):
+    return ATA_COMMAND(count=len(payload) // 512, lba=lba, device=0x40, command=0x35,
+                       protocol=xfer_protocol.write_dma, transfer_length=len(payload), transfer_data=payload)
+
+def slow_device():
+    # 最初のコマンドが終わるまでの間に後続の要求を溜める
+    return simulated_ata_device(service_time_us=20_000)
+
+@pytest.mark.parametrize('iovec, merged_commands', [(True, 1), (False, 4)])
+def test_merge_is_capped_to_the_slot_without_iovec(make_executor, iovec, merged_commands):
+    scheduler = elevator_scheduler(max_transfer=64 * 1024)
+    executor = make_executor(slow_device(), iovec=iovec, scheduler=scheduler, max_pooled_transfer=8 * 512)
+    device = executor.transport.device
+    device.store.write_from(0, 64, bytes(range(256)) * 128)
+    targets = [bytearray(2 * 512) for _ in range(16)]
+    futures = [executor.submit_command(read_command(1000, 1))]
+    futures += [executor.submit_command(read_command(2 * i, 2, [target])) for i, target in enumerate(targets)]
+    assert all(f.result(5).is_good() for f in futures)
+    assert b''.join(targets) == bytes(range(256)) * 64
+    # 先頭の 1 本 + まとめたコマンド
+    assert device.stats['commands'] == 1 + merged_commands
+    assert executor.buffer_pool.in_use() == 0
+
+def sector_data(seed, sectors):
+    return bytes((seed + i) & 0xFF for i in range(sectors * 512))
+
+def test_adjacent_reads_merge_and_split(make_executor):
+    scheduler = elevator_scheduler()
+    executor = make_executor(slow_device(), scheduler=scheduler)
+    device = executor.transport.device
+    written = sector_data(7, 32)
+    device.store.write_from(0, 32, written)
+    futures = [executor.submit_command(read_command(1000, 1))]
+    # 逆順・隙間なしで投入しても 1 コマンドにまとまり、それぞれの要求に自分の範囲が返る
+    ranges = [(24, 8), (16, 8), (8, 8), (0, 8)]
+    futures += [executor.submit_command(read_command(lba, sectors)) for lba, sectors in ranges]
+    for (lba, sectors), future in zip(ranges, futures[1:]):
+        completion = future.result(5)
+        assert completion.is_good() and completion.resid == 0
+        assert completion.command.transfer_data == written[lba * 512:(lba + sectors) * 512]
+    assert device.stats['commands'] == 2
+    assert scheduler.stats == {'requests': 5, 'dispatched': 2, 'merged': 4}
+
+def test_reads_see_earlier_overlapping_writes(make_executor):
+    executor = make_executor(slow_device(), scheduler=elevator_scheduler())
+    device = executor.transport.device
+    original = sector_data(1, 16)
+    device.store.write_from(0, 16, original)
+    first, second = sector_data(100, 4), sector_data(200, 4)
+    blocker = executor.submit_command(read_command(1000, 1))
+    before = executor.submit_command(read_command(0, 16))
+    executor.submit_command(write_command(4, first))
+    middle = executor.submit_command(read_command(4, 4))
+    executor.submit_command(write_command(6, second))
+    after = executor.submit_command(read_command(0, 16))
+    assert blocker.result(5).is_good()
+    expected = bytearray(original)
+    assert before.result(5).command.transfer_data == expected
+    expected[4 * 512:8 * 512] = first
+    assert middle.result(5).command.transfer_data == expected[4 * 512:8 * 512]
+    expected[6 * 512:10 * 512] = second
+    assert after.result(5).command.transfer_data == expected
+
+def test_overlapping_writes_merge_in_submit_order(make_executor):
+    scheduler = elevator_scheduler()
+    executor = make_executor(slow_device(), scheduler=scheduler)
+    device = executor.transport.device
+    first, second = sector_data(10, 4), sector_data(20, 4)
+    futures = [executor.submit_command(read_command(1000, 1)),
+               executor.submit_command(write_command(2, second[:2 * 512] * 2)),
+               executor.submit_command(write_command(0, first)),
+               executor.submit_command(write_command(2, second))]
+    assert all(f.result(5).is_good() for f in futures)
+    # lba 0 の書き込みは先に投入された lba 2 の書き込みを追い越せないので、まとまるのは後ろの 2 つだけ
+    assert scheduler.stats == {'requests': 4, 'dispatched': 3, 'merged': 2}
+    stored = bytearray(6 * 512)
+    device.store.read_into(0, 6, memoryview(stored))
+    assert bytes(stored) == first[:2 * 512] + second
+
+def test_failed_merge_is_retried_per_request(make_executor):
+    device = slow_device()
+    device.inject_error(20, 20, 'unc')
+    executor = make_executor(device, scheduler=elevator_scheduler())
+    futures = [executor.submit_command(read_command(1000, 1))]
+    futures += [executor.submit_command(read_command(lba, 8)) for lba in (0, 8, 16, 24)]
+    assert [f.result(5).is_good() for f in futures] == [True, True, True, False, True]
+    # まとめた 1 本が失敗し、4 つを個別に出し直す
+    assert device.stats['commands'] == 1 + 1 + 4
@@ -0,0 +1,34 @@
+import os
+import subprocess
+import sys
+
+from ata_tool.__main__ import main
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_import_and_one_shot_commands_stay_light():
+    # パッケージの import と単発コマンドでは numpy もスレッドも読み込まない
+    code = ("import sys, threading, ata_tool.__main__ as cli; "
+            "cli.main(['identify', 'sim0', '--transport', 'sim']); "
+            "print(sorted({'numpy', 'ata_tool.async_bsg_executer'} & set(sys.modules)), threading.active_count())")
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    assert output.rstrip().splitlines()[-1] == '[] 1'
+    assert 'SIMULATED ATA DEVICE' in output
+
+def test_usage_and_unknown_commands(capsys):
+    assert main([]) == 2
+    assert 'usage: python -m ata_tool' in capsys.readouterr().err
+    assert main(['--help']) == 0
+    assert 'bench' in capsys.readouterr().out
+    assert main(['frobnicate']) == 2
+    assert 'unknown command: frobnicate' in capsys.readouterr().err
+
+def test_read_writes_the_sectors(tmp_path):
+    output = tmp_path / 'sectors.bin'
+    assert main(['read', 'sim0', '--transport', 'sim', '--lba', '0x10', '--count', '2', '--output', str(output)]) == 0
+    assert output.read_bytes() == bytes(1024)
+
+def test_subcommands_are_dispatched(capsys, monkeypatch):
+    monkeypatch.setattr(sys, 'argv', ['ata_tool'])  # main() は usage 用に argv[0] を書き換える
+    assert main(['bench', 'sim0', '--transport', 'sim', '--io-count', '10']) == 0
+    assert 'ios=10' in capsys.readouterr().out
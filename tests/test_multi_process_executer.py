@@ -0,0 +1,100 @@
+import errno
+import multiprocessing
+
+import pytest
+
+from ata_tool.ata_command import ATA_COMMAND, xfer_protocol
+from ata_tool.multi_process_executer import COMPLETION_RECORD, multi_process_ata_executor, shared_ring
+
+def read_command(lba, sectors=1):
+    return ATA_COMMAND(feature=sectors, lba=lba, device=0x40, command=0x60, protocol=xfer_protocol.read_fpdma,
+                       transfer_length=sectors * 512)
+
+def write_command(lba, payload):
+    return ATA_COMMAND(feature=len(payload) // 512, lba=lba, device=0x40, command=0x61,
+                       protocol=xfer_protocol.write_fpdma, transfer_length=len(payload), transfer_data=payload)
+
+@pytest.fixture
+def executor():
+    executor = multi_process_ata_executor('sim0', queue_depth=8, transport='sim', shards_per_device=2,
+                                          stripe_sectors=8, max_transfer=4096)
+    yield executor
+    executor.close()
+
+def test_shared_ring_wraps_and_times_out():
+    ring = shared_ring.create(multiprocessing.get_context('spawn'), COMPLETION_RECORD.size, 3)
+    consumer = shared_ring.attach(ring.handle())  # 読み出し側は別プロセスと同じく位置を別に持つ
+    try:
+        for i in range(7):
+            ring.push(COMPLETION_RECORD, i, 0, 0, 0, 0, 0, -i, 0, 0, 0, 0, b'x')
+            if i % 2:
+                continue
+            for expected in range(max(i - 1, 0), i + 1):
+                values = consumer.pop(COMPLETION_RECORD, timeout=0)
+                assert values[0] == expected and values[6] == -expected
+                assert values[-1] == b'x'.ljust(32, bytes(1))
+        assert consumer.pop(COMPLETION_RECORD, timeout=0.01) is None
+    finally:
+        consumer.close()
+        ring.close(unlink=True)
+
+def test_round_trip_across_shards(executor):
+    payloads = {lba: bytes([lba]) * 1024 for lba in range(0, 64, 4)}
+    for future in [executor.submit_command(write_command(lba, data)) for lba, data in payloads.items()]:
+        assert future.result(10).is_good()
+    futures = {lba: executor.submit_command(read_command(lba, 2)) for lba in payloads}
+    for lba, future in futures.items():
+        completion = future.result(10)
+        assert completion.is_good() and completion.tag is not None
+        assert completion.command.transfer_data == payloads[lba]
+    executor.drain_command(timeout=10)
+    assert executor.latency.snapshot()
+
+def test_dead_worker_fails_pending_and_later_commands(executor):
+    shard = executor.shards[0]
+    shard.process.kill()
+    shard.process.join()
+    futures = [executor.submit_command(read_command(0)) for _ in range(3)]
+    for future in futures:
+        with pytest.raises(OSError) as error:
+            future.result(10)
+        assert error.value.errno == errno.EIO
+        assert 'exit code' in str(error.value)
+    executor.drain_command(timeout=10)
+    # 残りのシャードはそのまま使える
+    assert executor.submit_command(read_command(8)).result(10).is_good()
+
+def test_transfer_buffers_are_copied_through_the_slot(executor):
+    payload = bytes(range(256)) * 8
+    write = ATA_COMMAND(feature=4, lba=16, device=0x40, command=0x61, protocol=xfer_protocol.write_fpdma,
+                        transfer_buffers=[payload[:1536], bytearray(payload[1536:])])
+    assert executor.submit_command(write).result(10).is_good()
+    targets = [bytearray(512), bytearray(1536)]
+    read = read_command(16, 4)
+    read.transfer_buffers = targets
+    completion = executor.submit_command(read).result(10)
+    assert completion.is_good() and completion.command.transfer_data == b''
+    assert bytes(targets[0] + targets[1]) == payload
+
+def test_oversize_and_mismatched_transfers_fail_the_future(executor):
+    with pytest.raises(ValueError, match='at most 4096'):
+        executor.submit_command(read_command(0, 16)).result(10)
+    command = read_command(0, 2)
+    command.transfer_buffers = [bytearray(512)]
+    with pytest.raises(ValueError, match='does not match'):
+        executor.submit_command(command).result(10)
+    executor.drain_command(timeout=10)
+    assert all(len(shard.free_slots) == 4 for shard in executor.shards)
+
+def test_submit_batch_with_arena(executor):
+    from ata_tool.command_batch import command_batch
+    lbas = [0, 8, 16, 24]
+    written = bytes(range(256)) * 16
+    batch = command_batch.from_columns(lba=lbas, feature=2, device=0x40, command=0x61,
+                                       protocol=xfer_protocol.write_fpdma, transfer_length=1024)
+    assert all(f.result(10).is_good() for f in executor.submit_batch(batch, written))
+    batch = command_batch.from_columns(lba=lbas, feature=2, device=0x40, command=0x60,
+                                       protocol=xfer_protocol.read_fpdma, transfer_length=1024)
+    arena = bytearray(len(written))
+    assert all(f.result(10).is_good() for f in executor.submit_batch(batch, arena, device='sim0'))
+    assert arena == written
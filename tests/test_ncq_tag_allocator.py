@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+
+from ata_tool.ata_command import ATA_COMMAND, xfer_protocol
+from ata_tool.ncq_tag_allocator import (NCQ_PRIO_HIGH, decode_ncq_tag, encode_ncq_priority, encode_ncq_tag,
+                                        ncq_tag_allocator)
+from ata_tool.simulated_ata_device import simulated_ata_device, simulated_transport
+
+def test_tag_and_priority_encoding():
+    count = encode_ncq_tag(0xFFFF, 0)
+    assert count == 0xFF07 and decode_ncq_tag(count) == 0
+    for tag in range(32):
+        count = encode_ncq_priority(encode_ncq_tag(0x0005, tag), NCQ_PRIO_HIGH)
+        assert decode_ncq_tag(count) == tag
+        assert count >> 14 == NCQ_PRIO_HIGH and count & 0x7 == 0x5
+    # 優先度を付け直してもタグは変わらない
+    assert decode_ncq_tag(encode_ncq_priority(encode_ncq_tag(0, 17), 0)) == 17
+
+def test_allocator_hands_released_tags_to_waiters():
+    allocator = ncq_tag_allocator(tags=[3, 5])
+    assert allocator.depth == 2
+    assert [allocator.acquire('a'), allocator.acquire('b')] == [3, 5]
+    assert allocator.acquire('c') is None and allocator.acquire('d') is None
+    assert allocator.waiting() == 2
+    assert allocator.release(5) == (5, 'c')
+    assert allocator.release(3) == (3, 'd')
+    assert allocator.release(5) is None and allocator.release(3) is None
+    assert allocator.in_flight() == 0
+    with pytest.raises(ValueError):
+        ncq_tag_allocator(tags=[32])
+
+class tag_checking_transport(simulated_transport):
+    # 同じタグが発行中に 2 度使われないことを確かめる
+    def __init__(self, device):
+        super().__init__(device)
+        self.live = set()
+        self.seen = set()
+        self.duplicates = []
+        self.live_lock = threading.Lock()
+
+    def submit(self, request):
+        tag = decode_ncq_tag(request.command.count)
+        with self.live_lock:
+            if tag in self.live:
+                self.duplicates.append(tag)
+            self.live.add(tag)
+            self.seen.add(tag)
+        return super().submit(request)
+
+    def reap_fd(self, fd):
+        completed = super().reap_fd(fd)
+        with self.live_lock:
+            for request in completed:
+                self.live.discard(decode_ncq_tag(request.command.count))
+        return completed
+
+def test_executor_never_reuses_a_live_tag(make_executor):
+    device = simulated_ata_device(queue_depth=4)
+    transport = tag_checking_transport(device)
+    executor = make_executor(transport=transport, queue_depth=4)
+    futures = [executor.submit_command(ATA_COMMAND(feature=1, lba=lba, device=0x40, command=0x60,
+                                                   protocol=xfer_protocol.read_fpdma, transfer_length=512))
+               for lba in range(64)]
+    assert all(f.result(5).is_good() for f in futures)
+    assert transport.duplicates == [] and transport.seen <= set(range(4))
+    assert executor.tag_allocator.in_flight() == 0 and executor.tag_allocator.waiting() == 0
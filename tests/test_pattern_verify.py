@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from ata_tool.pattern_verify import main, mismatch_range, pattern_generator, verify_engine
+from ata_tool.simulated_ata_device import simulated_ata_device
+
+@pytest.mark.parametrize('kind', ['lba', 'prbs'])
+def test_pattern_is_position_independent(kind):
+    generator = pattern_generator(kind, pass_id=3, seed=7)
+    whole = generator.fill(np.empty((8, 64), dtype=np.uint64), 100, 8)
+    part = generator.fill(np.empty((3, 64), dtype=np.uint64), 104, 3)
+    assert np.array_equal(whole[4:7], part)
+    other_pass = pattern_generator(kind, pass_id=4, seed=7).fill(np.empty((8, 64), dtype=np.uint64), 100, 8)
+    assert not np.equal(whole, other_pass).all(axis=1).any()
+
+def test_lba_pattern_stamps_lba_and_pass():
+    out = pattern_generator('lba', pass_id=9).fill(np.empty((2, 64), dtype=np.uint64), 0x1234, 2)
+    assert out[1, 0] == 0x1235 and out[1, 1] == 9
+
+def test_compare_groups_bad_sectors_into_ranges():
+    generator = pattern_generator('prbs')
+    buffer = generator.fill(np.empty((10, 64), dtype=np.uint64), 50, 10)
+    buffer[2, 5] ^= 1
+    buffer[3, 0] ^= 1
+    buffer[7, 63] ^= 1
+    scratch = np.empty((10, 64), dtype=np.uint64)
+    assert generator.compare(buffer, 50, 10, scratch) == [(52, 2), (57, 1)]
+
+@pytest.mark.parametrize('iovec', [True, False])
+@pytest.mark.parametrize('zero_copy', [True, False])
+def test_write_then_verify_finds_corruption(make_executor, iovec, zero_copy):
+    executor = make_executor(iovec=iovec, zero_copy=zero_copy, max_pooled_transfer=16 * 512)
+    engine = verify_engine(executor, pattern_generator('prbs', seed=1), chunk_sectors=16, in_flight=4)
+    assert engine.direct is iovec
+    assert engine.write(0, 200) == []
+    assert engine.verify(0, 200) == []
+    executor.transport.device.store.write_from(77, 1, bytes(512))
+    executor.transport.device.inject_error(130, 130, commands=(0x60,))
+    assert engine.verify(0, 200) == [mismatch_range(77, 1, 'data'), mismatch_range(128, 16, 'io')]
+    assert engine.stats == {'written_sectors': 200, 'verified_sectors': 384}
+    assert executor.buffer_pool.in_use() == 0
+
+def test_cli_on_simulator():
+    assert main(['sim0', '--transport', 'sim', '--end-lba', '1000', '--pattern', 'prbs', '--chunk', '16k']) == 0
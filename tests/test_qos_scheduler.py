@@ -0,0 +1,77 @@
+import time
+
+import pytest
+
+from ata_tool.ata_command import ATA_COMMAND, xfer_protocol
+from ata_tool.qos_scheduler import _token_bucket, qos_class, qos_scheduler
+from ata_tool.simulated_ata_device import simulated_ata_device
+
+def read_command(lba):
+    return ATA_COMMAND(feature=1, lba=lba, device=0x40, command=0x60, protocol=xfer_protocol.read_fpdma,
+                       transfer_length=512)
+
+def test_token_bucket_refills_at_rate():
+    bucket = _token_bucket(1000, burst_ms=10)  # 1000/s、容量 10
+    now = bucket.last
+    assert bucket.wait_time(10, now) == 0
+    bucket.take(10)
+    assert bucket.wait_time(1, now) == pytest.approx(0.001)
+    assert bucket.wait_time(5, now + 0.002) == pytest.approx(0.003)
+    # 容量を超える要求は満タンになれば通す
+    assert bucket.wait_time(100, now + 0.010) == 0
+
+def test_rate_limit_spaces_out_commands(make_executor):
+    scheduler = qos_scheduler(make_executor(), [qos_class('slow', iops=200, burst_ms=5)])
+    start = time.perf_counter()
+    futures = [scheduler.submit(read_command(lba), 'slow') for lba in range(6)]
+    scheduler.drain()
+    # 最初の 1 本の後は 5 ms 間隔
+    assert time.perf_counter() - start >= 0.02
+    assert all(f.result().is_good() for f in futures)
+    scheduler.close()
+
+def test_high_priority_gets_ncq_prio_and_reserved_depth(make_executor):
+    executor = make_executor(simulated_ata_device(service_time_us=20_000), queue_depth=4)
+    scheduler = qos_scheduler(executor, reserved_depth=2)
+    normal = [scheduler.submit(read_command(lba), 'normal') for lba in range(4)]
+    assert scheduler.in_flight == 2  # 残り 2 は reserved クラス用
+    high = scheduler.submit(read_command(100), 'high')
+    assert scheduler.in_flight == 3
+    assert high.result(5).command.count >> 14 == 2
+    assert all(f.result(5).is_good() for f in normal)
+    scheduler.close()
+
+def test_aging_lets_lower_classes_through(make_executor):
+    executor = make_executor(simulated_ata_device(service_time_us=2_000), queue_depth=1)
+    classes = [qos_class('high', priority=0), qos_class('background', priority=1)]
+
+    def background_done_under_load(aging_ms):
+        # high を処理能力より速く積み続けている間に background が発行されるか
+        scheduler = qos_scheduler(executor, classes, reserved_depth=0, depth=1, aging_ms=aging_ms)
+        scheduler.submit(read_command(1), 'high')
+        background = scheduler.submit(read_command(0), 'background')
+        deadline = time.perf_counter() + 0.1
+        while time.perf_counter() < deadline:
+            scheduler.submit(read_command(1), 'high')
+            time.sleep(0.001)
+        done = background.done()
+        scheduler.close()
+        scheduler.drain()
+        return done
+
+    assert not background_done_under_load(None)
+    assert background_done_under_load(10)
+
+def test_close_fails_throttled_commands_and_refuses_new_ones(make_executor):
+    scheduler = qos_scheduler(make_executor(), [qos_class('slow', iops=1, burst_ms=1)])
+    first = scheduler.submit(read_command(0), 'slow')
+    throttled = [scheduler.submit(read_command(lba), 'slow') for lba in range(1, 4)]
+    assert first.result(5).is_good()
+    assert not any(f.done() for f in throttled)
+    scheduler.close()
+    for future in throttled:
+        with pytest.raises(RuntimeError, match='closed'):
+            future.result(1)
+    scheduler.drain()
+    with pytest.raises(RuntimeError, match='closed'):
+        scheduler.submit(read_command(9), 'slow')
@@ -0,0 +1,65 @@
+import ctypes
+import errno
+import mmap
+
+import pytest
+
+from ata_tool.ata_command import ATA_COMMAND, xfer_protocol
+from ata_tool.ata_transport import bsg_transport, build_iovec, io_request, sg_v3_transport
+from ata_tool.simulated_ata_device import simulated_ata_device
+
+def data_command(lba, buffers, is_read, sectors):
+    return ATA_COMMAND(count=sectors, lba=lba, device=0x40, command=0x25 if is_read else 0x35,
+                       protocol=xfer_protocol.read_dma if is_read else xfer_protocol.write_dma,
+                       transfer_length=sectors * 512, transfer_buffers=buffers)
+
+def test_transport_capabilities():
+    assert bsg_transport.iovec is False
+    assert sg_v3_transport.iovec is True
+
+def test_bsg_rejects_iovec_before_the_ioctl():
+    transport = bsg_transport.__new__(bsg_transport)
+    transport.fd = -1
+    iovec, pins, total = build_iovec([bytearray(512)])
+    request = io_request(None, (ctypes.c_ubyte * 32)(), (ctypes.c_ubyte * 32)(), None, total, True)
+    request.iovec = iovec
+    with pytest.raises(OSError) as error:
+        transport.execute(request)
+    assert error.value.errno == errno.EOPNOTSUPP
+
+@pytest.mark.parametrize('iovec', [True, False])
+@pytest.mark.parametrize('queued', [True, False])
+def test_transfer_buffers_round_trip(make_executor, iovec, queued):
+    executor = make_executor(queued=queued, iovec=iovec)
+    payload = bytes(range(256)) * 12
+    sources = [payload[:512], bytearray(payload[512:2048]), memoryview(payload)[2048:]]
+    assert executor.submit_command(data_command(50, sources, False, 6)).result(5).is_good()
+    targets = [bytearray(1024), mmap.mmap(-1, 2048)]
+    completion = executor.submit_command(data_command(50, targets, True, 6)).result(5)
+    assert completion.is_good()
+    assert bytes(targets[0]) + bytes(targets[1]) == payload
+    assert executor.buffer_pool.in_use() == 0
+
+def test_bounce_larger_than_a_slot(make_executor):
+    executor = make_executor(iovec=False, max_pooled_transfer=4096)
+    payload = bytes(range(256)) * 64
+    assert executor.submit_command(data_command(0, [payload], False, 32)).result(5).is_good()
+    target = bytearray(len(payload))
+    assert executor.submit_command(data_command(0, [target], True, 32)).result(5).is_good()
+    assert target == payload
+
+def test_bounce_leaves_buffers_untouched_on_error(make_executor):
+    device = simulated_ata_device()
+    device.inject_error(0, 7)
+    executor = make_executor(device, iovec=False)
+    target = bytearray(b'\xAA' * 4096)
+    completion = executor.submit_command(data_command(0, [target], True, 8)).result(5)
+    assert not completion.is_good()
+    assert target == b'\xAA' * 4096
+
+def test_read_into_read_only_buffer_is_rejected(make_executor):
+    executor = make_executor(iovec=False)
+    future = executor.submit_command(data_command(0, [bytes(512)], True, 1))
+    with pytest.raises(ValueError):
+        future.result(5)
+    assert executor.buffer_pool.in_use() == 0
@@ -0,0 +1,84 @@
+import struct
+
+import pytest
+
+from ata_tool.ata_command import ATA_COMMAND, xfer_protocol
+from ata_tool.simulated_ata_device import (DID_RESET, SAM_STAT_CHECK_CONDITION, simulated_ata_device,
+                                           simulated_transport)
+
+def read_command(lba, sectors, fpdma=False):
+    if fpdma:
+        return ATA_COMMAND(feature=sectors, lba=lba, device=0x40, command=0x60,
+                           protocol=xfer_protocol.read_fpdma, transfer_length=sectors * 512)
+    return ATA_COMMAND(count=sectors, lba=lba, device=0x40, command=0x25,
+                       protocol=xfer_protocol.read_dma, transfer_length=sectors * 512)
+
+def write_command(lba, payload, fpdma=False):
+    sectors = len(payload) // 512
+    if fpdma:
+        return ATA_COMMAND(feature=sectors, lba=lba, device=0x40, command=0x61,
+                           protocol=xfer_protocol.write_fpdma, transfer_length=len(payload), transfer_data=payload)
+    return ATA_COMMAND(count=sectors, lba=lba, device=0x40, command=0x35,
+                       protocol=xfer_protocol.write_dma, transfer_length=len(payload), transfer_data=payload)
+
+@pytest.mark.parametrize('queued', [True, False])
+@pytest.mark.parametrize('fpdma', [True, False])
+def test_write_then_read_round_trip(make_executor, queued, fpdma):
+    executor = make_executor(queued=queued)
+    payload = bytes(range(256)) * 8
+    assert executor.submit_command(write_command(100, payload, fpdma)).result(5).is_good()
+    completion = executor.submit_command(read_command(100, 4, fpdma)).result(5)
+    assert completion.is_good()
+    assert completion.resid == 0
+    assert bytes(completion.command.transfer_data) == payload
+
+def test_unwritten_sectors_read_as_zero(make_executor):
+    completion = make_executor().submit_command(read_command(0x1234, 2)).result(5)
+    assert bytes(completion.command.transfer_data) == bytes(1024)
+
+def test_injected_error_returns_sat_sense(make_executor):
+    device = simulated_ata_device()
+    device.inject_error(10, 12, 'unc', remaining=1)
+    executor = make_executor(device)
+    completion = executor.submit_command(read_command(8, 8)).result(5)
+    assert completion.device_status == SAM_STAT_CHECK_CONDITION
+    assert completion.resid == 8 * 512
+    assert completion.sense[:4] == bytes((0x72, 0x03, 0x11, 0x04))
+    # ATA Status Return descriptor: ERROR=UNC, LBA=10 (最初のエラー LBA), STATUS=ERR
+    assert completion.sense[8:10] == b'\x09\x0c'
+    assert completion.sense[11] == 0x40
+    assert completion.sense[15] == 10 and completion.sense[21] == 0x51
+    # remaining=1 なので 2 回目は成功する
+    assert executor.submit_command(read_command(8, 8)).result(5).is_good()
+
+def test_out_of_range_lba_is_idnf(make_executor):
+    executor = make_executor(simulated_ata_device(capacity=1000))
+    completion = executor.submit_command(read_command(999, 2)).result(5)
+    assert completion.sense[1:3] == bytes((0x05, 0x21))
+
+def test_identify_reports_geometry(make_executor):
+    device = simulated_ata_device(capacity=123456, sector_size=4096, queue_depth=16, model='TEST MODEL')
+    command = ATA_COMMAND(command=0xEC, protocol=xfer_protocol.read_pio, transfer_length=512)
+    data = bytes(make_executor(device).submit_command(command).result(5).command.transfer_data)
+    words = struct.unpack('<256H', data)
+    assert words[75] == 15
+    assert sum(words[100 + i] << (16 * i) for i in range(4)) == 123456
+    assert (words[117] | words[118] << 16) * 2 == 4096
+    model = b''.join(struct.pack('>H', word) for word in words[27:47])
+    assert model.rstrip() == b'TEST MODEL'
+
+@pytest.mark.parametrize('queued', [True, False])
+def test_reset_completes_in_flight_command_with_did_reset(make_executor, queued):
+    device = simulated_ata_device(service_time_us=2_000_000)
+    executor = make_executor(device, queued=queued)
+    future = executor.submit_command(read_command(0, 1))
+    transport = executor.transport
+    while (transport.outstanding() if queued else transport.device.stats['commands']) == 0:
+        pass
+    executor.reset_device()
+    assert future.result(1).transport_status == DID_RESET
+
+def test_sync_transport_has_no_fds():
+    transport = simulated_transport(queued=False)
+    assert transport.fds == [] and not transport.queued
+    transport.close()
@@ -0,0 +1,44 @@
+import threading
+import time
+
+import pytest
+
+from ata_tool.ata_command import ATA_COMMAND, xfer_protocol
+from ata_tool.stage_profiler import STAGES, stage_profiler
+
+def test_counters_from_every_thread_are_summed():
+    profiler = stage_profiler(('a', 'b'))
+
+    def run():
+        for _ in range(100):
+            profiler.add('b', profiler.add('a', 0) - 10)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    totals = profiler.totals()
+    assert totals['a'][1] == totals['b'][1] == 400
+    assert totals['b'][0] >= 400 * 10
+    report = profiler.report()
+    assert report['a']['share'] + report['b']['share'] == pytest.approx(1)
+    assert report['b']['ns_per_io'] == pytest.approx(totals['b'][0] / 400)
+    profiler.reset()
+    assert profiler.totals() == {'a': (0, 0), 'b': (0, 0)}
+    assert 'calls' in profiler.format_report()
+
+@pytest.mark.parametrize('queued', [True, False])
+def test_executor_counts_each_stage_once_per_command(make_executor, queued):
+    executor = make_executor(queued=queued, profile=True)
+    futures = [executor.submit_command(ATA_COMMAND(count=1, lba=lba, device=0x40, command=0x25,
+                                                   protocol=xfer_protocol.read_dma, transfer_length=512))
+               for lba in range(20)]
+    assert all(f.result(5).is_good() for f in futures)
+    # resolve は Future を解決した後に数えるので、最後の 1 件が足し込まれるまで待つ
+    deadline = time.monotonic() + 5
+    while executor.profiler.totals()['resolve'][1] < 20 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    totals = executor.profiler.totals()
+    assert {stage: calls for stage, (_, calls) in totals.items()} == {stage: 20 for stage in STAGES}
+    assert make_executor(queued=queued).profiler is None
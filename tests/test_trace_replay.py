@@ -0,0 +1,73 @@
+import pytest
+
+from ata_tool.ata_command import ATA_COMMAND, xfer_protocol
+from ata_tool.command_trace import FLAG_FAILED, TRACE_NO_TAG, trace_writer
+from ata_tool.command_watchdog import command_timeout, command_watchdog
+from ata_tool.simulated_ata_device import simulated_ata_device
+from ata_tool.trace_replay import main, read_trace, summarize, trace_replayer
+
+def read_command(lba, sectors=1, fpdma=True, **kwargs):
+    if fpdma:
+        return ATA_COMMAND(feature=sectors, lba=lba, device=0x40, command=0x60, protocol=xfer_protocol.read_fpdma,
+                           transfer_length=sectors * 512, **kwargs)
+    return ATA_COMMAND(count=sectors, lba=lba, device=0x40, command=0x25, protocol=xfer_protocol.read_dma,
+                       transfer_length=sectors * 512, **kwargs)
+
+def write_command(lba, sectors=1):
+    return ATA_COMMAND(feature=sectors, lba=lba, device=0x40, command=0x61, protocol=xfer_protocol.write_fpdma,
+                       transfer_length=sectors * 512, transfer_data=b'\x5a' * sectors * 512)
+
+@pytest.fixture
+def recorded(make_executor, tmp_path):
+    # 書き込み 3 本、読み込み 4 本 (うち 1 本は発行前に失敗) を記録したトレース
+    path = str(tmp_path / 'a.trc')
+    with trace_writer(path) as trace:
+        executor = make_executor(trace=trace)
+        futures = [executor.submit_command(write_command(lba, 2)) for lba in (0, 8, 16)]
+        futures += [executor.submit_command(read_command(lba)) for lba in (0, 1, 2)]
+        futures.append(executor.submit_command(read_command(3, fpdma=False, transfer_buffers=[bytes(512)])))
+        executor.drain_command(timeout=5)
+        executor.close()
+    return path, futures
+
+def test_trace_records_completions_and_submit_failures(recorded):
+    path, futures = recorded
+    assert isinstance(futures[-1].exception(), ValueError)
+    header, records = read_trace(path)
+    assert header['version'] == 1 and len(records) == 7
+    failed = records[(records['flags'] & FLAG_FAILED) != 0]
+    assert failed['lba'].tolist() == [3] and failed['tag'].tolist() == [TRACE_NO_TAG]
+    fpdma = records[records['command'] == 0x60]
+    assert len(fpdma) == 3 and (fpdma['tag'] != TRACE_NO_TAG).all()
+    summary = summarize(records)
+    assert summary['ios'] == 7 and summary['errors'] == 1
+
+def test_watchdog_expiry_is_traced(make_executor, tmp_path):
+    path = str(tmp_path / 'b.trc')
+    device = simulated_ata_device()
+    device.inject_error(50, 50, 'timeout')
+    with trace_writer(path) as trace:
+        executor = make_executor(device, trace=trace, timeout_ms=300, watchdog=command_watchdog(deadline_ms=30))
+        future = executor.submit_command(read_command(50))
+        assert isinstance(future.exception(5), command_timeout)
+        executor.close()
+    records = read_trace(path)[1]
+    assert len(records) == 1 and records['flags'][0] & FLAG_FAILED and records['lba'][0] == 50
+
+@pytest.mark.parametrize('allow_writes', [False, True])
+def test_replay_skips_writes_unless_allowed(recorded, make_executor, allow_writes):
+    records = read_trace(recorded[0])[1]
+    replayer = trace_replayer(records, speed=None, allow_writes=allow_writes)
+    assert replayer.write_count == 3
+    executor = make_executor()
+    result = replayer.run(executor)
+    stats = executor.transport.device.stats
+    assert result['skipped_writes'] == (0 if allow_writes else 3)
+    assert stats['written_sectors'] == (6 if allow_writes else 0)
+    assert stats['read_sectors'] == 4
+
+def test_replay_cli_reports_skipped_writes(recorded, capsys):
+    assert main(['replay', recorded[0], 'sim0', '--transport', 'sim', '--afap']) == 0
+    assert 'skipping 3 writes' in capsys.readouterr().err
+    assert main(['replay', recorded[0], 'sim0', '--transport', 'sim', '--speed', '100', '--allow-writes']) == 0
+    assert 'replaying 3 writes with zero-filled data' in capsys.readouterr().err
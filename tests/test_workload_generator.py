@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from ata_tool.ata_command import xfer_protocol
+from ata_tool.workload_generator import _zeta, workload_generator
+
+def columns(generator, n):
+    batch = generator.next_batch(n)
+    return batch.lba.astype(np.int64), batch.transfer_length.astype(np.int64) // 512, batch.is_read()
+
+@pytest.mark.parametrize('distribution', ['uniform', 'zipf', 'hotspot', 'seq'])
+def test_transfers_stay_in_range_and_aligned(distribution):
+    generator = workload_generator(distribution, lba_start=1000, lba_range=4096, block_sectors=[8, 16],
+                                   block_weights=[3, 1], seed=1, align_sectors=8)
+    lbas, sectors, _ = columns(generator, 20000)
+    assert lbas.min() >= 1000 and (lbas + sectors).max() <= 1000 + 4096
+    assert ((lbas - 1000) % 8 == 0).all()
+    assert set(sectors.tolist()) == {8, 16}
+
+def test_same_seed_gives_the_same_stream():
+    first = list(workload_generator('zipf', seed=5, chunk=100).batches(250))
+    second = list(workload_generator('zipf', seed=5, chunk=100).batches(250))
+    assert [len(b) for b in first] == [100, 100, 50]
+    assert [b.records.tobytes() for b in first] == [b.records.tobytes() for b in second]
+
+def test_zipf_concentrates_on_few_blocks():
+    generator = workload_generator('zipf', lba_range=8 * 100_000, seed=2)
+    lbas, _, _ = columns(generator, 100_000)
+    _, counts = np.unique(lbas, return_counts=True)
+    top = np.sort(counts)[::-1]
+    # ランク 1 の確率は 1 / zeta(N)
+    assert top[0] / len(lbas) == pytest.approx(1 / _zeta(100_000, 0.99), rel=0.1)
+    assert top[:100].sum() > 0.3 * len(lbas)
+    assert _zeta(10, 0.5) == pytest.approx(sum(i ** -0.5 for i in range(1, 11)))
+
+def test_hotspot_and_rwmix_ratios():
+    generator = workload_generator('hotspot', lba_range=8 * 1000, rwmix_read=70, seed=3)
+    lbas, _, is_read = columns(generator, 50_000)
+    assert (lbas < 8 * 200).mean() == pytest.approx(0.8, abs=0.02)
+    assert is_read.mean() == pytest.approx(0.7, abs=0.02)
+
+def test_seq_wraps_and_encodes_commands():
+    generator = workload_generator('seq', lba_range=64, block_sectors=16, fpdma=False, rwmix_read=0, seed=0)
+    batch = generator.next_batch(6)
+    assert batch.lba.tolist() == [0, 16, 32, 48, 0, 16]
+    assert set(batch.command.tolist()) == {0x35} and set(batch.count.tolist()) == {16}
+    assert set(batch.protocol.tolist()) == {xfer_protocol.write_dma.value}
+    fpdma = workload_generator(block_sectors=0x10000, lba_range=0x20000, seed=0).next_batch(4)
+    # 65536 セクタは FEATURE に 0 で入る
+    assert set(fpdma.feature.tolist()) == {0} and set(fpdma.command.tolist()) == {0x60}
+    with pytest.raises(ValueError):
+        workload_generator('normal')